@@ -0,0 +1,369 @@
+import os
+import json
+import argparse
+import collections
+import multiprocessing
+
+from thymeml import * # THYME-ML object model
+from DocumentProcessor import CLOSURE_ENGINES
+from SpanIndex import SpanIndex # Interval index of entity spans
+from Corpus import Corpus, DOCUMENT_KINDS
+from DocumentText import DocumentText
+
+'''
+Inter-annotator agreement between two annotation sets of the same document, e.g. two annotators of a round, or the
+same annotator in two rounds. One set is the reference and the other the response: precision is the fraction of the
+response found in the reference, recall the fraction of the reference found in the response, and F1 (which is
+symmetric) is the agreement.
+
+Entities are aligned in linear time: first by type and identical spans (a dictionary lookup per entity), then the
+remaining ones by type and overlapping spans (a SpanIndex query per entity). Relations are compared through the
+aligned entities they refer to, so that every relation is compared by a dictionary lookup as well:
+
+    entities/<type>             same type and spans
+    entities/<type> (lenient)   same type and overlapping spans
+    attributes/<type>           aligned entities (same spans) with the same properties, see ThymeMLAnnotation.__eq__
+    relations/<type>            same type, properties and aligned references
+    tlinkTypes                  TLINKs between the same aligned entities with the same relation type
+    tlinkClosure                TLINKs entailed by the temporal closure of the other set (temporal awareness)
+
+Counts of several documents are summed, so corpus-wide scores are micro-averaged.
+'''
+
+# x OVERLAP y is y OVERLAP x, and x ENDS-ON y is y BEGINS-ON x (see EndpointClosure.POINT_CONSTRAINTS)
+SYMMETRIC_TLINK_TYPES = ("OVERLAP",)
+CONVERSE_TLINK_TYPES = {"ENDS-ON": "BEGINS-ON"}
+
+# Sections of the categories, in the order they are written
+_SECTIONS = ("entities", "attributes", "relations", "tlinkTypes", "tlinkClosure")
+
+def _categoryOrder(category):
+    return (_SECTIONS.index(category.split("/")[0]), category)
+
+def _ratio(numerator, denominator):
+    return float(numerator) / denominator if denominator else None
+
+class AgreementCounts(object):
+    '''
+    Reference, response and matched counts per category (e.g. entities/EVENT) of one or more documents.
+    '''
+
+    def __init__(self):
+        self.counts = collections.OrderedDict() # category -> [reference, response, matched reference, matched response]
+
+    def add(self, category, reference, response, matchedReference, matchedResponse=None):
+        """
+        :param str category: e.g. entities/EVENT
+        :param int reference: number of reference items
+        :param int response: number of response items
+        :param int matchedReference: number of reference items found in the response
+        :param int matchedResponse: number of response items found in the reference (defaults to matchedReference)
+        """
+        if matchedResponse is None:
+            matchedResponse = matchedReference
+        counts = self.counts.setdefault(category, [0, 0, 0, 0])
+        for (position, value) in enumerate((reference, response, matchedReference, matchedResponse)):
+            counts[position] += value
+
+    def merge(self, other):
+        """
+        :param AgreementCounts other: counts added to these counts
+        """
+        for (category, counts) in other.counts.items():
+            self.add(category, *counts)
+
+    def scores(self, category):
+        """
+        :return tuple: (precision, recall, F1) of the category, None where there is nothing to score
+        """
+        (reference, response, matchedReference, matchedResponse) = self.counts[category]
+        precision = _ratio(matchedResponse, response)
+        recall = _ratio(matchedReference, reference)
+        f1 = None
+        if precision is not None and recall is not None:
+            f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+        return (precision, recall, f1)
+
+    def record(self):
+        """
+        :return OrderedDict: JSON-ready counts and scores of every category, see fromRecord
+        """
+        record = collections.OrderedDict()
+        for (category, counts) in self.counts.items():
+            (precision, recall, f1) = self.scores(category)
+            record[category] = collections.OrderedDict([
+                ("counts", list(counts)), ("precision", precision), ("recall", recall), ("f1", f1)])
+        return record
+
+    @classmethod
+    def fromRecord(cls, record):
+        """
+        :param dict record: see record
+        """
+        agreement = cls()
+        for (category, fields) in record.items():
+            agreement.add(category, *fields["counts"])
+        return agreement
+
+    def writeText(self, out=None):
+        """
+        :param out: file to write to (None writes to stdout)
+        """
+        def formatted(score):
+            return "-" if score is None else "%.3f" % score
+        print >> out, "\t" + "\t".join(["Category".ljust(32), "Reference", "Response", "P", "R", "F1"])
+        for category in sorted(self.counts, key=_categoryOrder):
+            (reference, response, _, _) = self.counts[category]
+            (precision, recall, f1) = self.scores(category)
+            print >> out, "\t" + "\t".join([category.ljust(32), str(reference).rjust(9), str(response).rjust(8),
+                                             formatted(precision), formatted(recall), formatted(f1)])
+
+def alignEntities(referenceEntities, responseEntities, lenient=True):
+    """
+    Aligns every response entity with at most one reference entity of the same type: with identical spans first,
+    then (if lenient) with the first remaining reference entity whose spans overlap.
+
+    :param list referenceEntities: the reference entities, in document order
+    :param list responseEntities: the response entities, in document order
+    :return tuple: (id(response entity) -> reference entity, ids of the response entities aligned by identical spans)
+    """
+    alignment = {}
+    exact = set()
+    bySpans = collections.defaultdict(collections.deque) # (type, spans) -> reference entities, in document order
+    for entity in referenceEntities:
+        bySpans[(entity.type, entity.spans)].append(entity)
+
+    unaligned = []
+    for entity in responseEntities:
+        candidates = bySpans.get((entity.type, entity.spans))
+        if candidates:
+            alignment[id(entity)] = candidates.popleft()
+            exact.add(id(entity))
+        else:
+            unaligned.append(entity)
+
+    if lenient and unaligned:
+        aligned = set(id(entity) for entity in alignment.values())
+        spanIndex = SpanIndex(entity for entity in referenceEntities if id(entity) not in aligned)
+        for entity in unaligned:
+            for candidate in spanIndex.overlappingEntities(entity, entity.type):
+                if id(candidate) not in aligned:
+                    aligned.add(id(candidate))
+                    alignment[id(entity)] = candidate
+                    break
+    return (alignment, exact)
+
+def _referenceKey(value, entityKeys, visiting):
+    if isinstance(value, ThymeMLEntity):
+        return entityKeys.get(id(value))
+    if isinstance(value, ThymeMLRelation):
+        if id(value) in visiting: # Reached again through its own properties
+            return None
+        return relationKey(value, entityKeys, visiting | frozenset([id(value)]))
+    if type(value) is list: # e.g. the Coreferring_String of a chain, in any order
+        return frozenset(_referenceKey(item, entityKeys, visiting) for item in value)
+    return value
+
+def relationKey(relation, entityKeys, visiting=frozenset()):
+    """
+    :param ThymeMLRelation relation: a relation of either annotation set
+    :param dict entityKeys: id(entity) -> key, aligned entities of both sets having the same key
+    :return tuple: a key equal for the relations of both sets that agree, e.g. (TLINK, (source, BEFORE, target))
+    """
+    if relation.type == "TLINK":
+        (source, relationType, target) = (_referenceKey(relation.properties[name], entityKeys, visiting) if name in relation.properties else None
+                                          for name in ("Source", "Type", "Target"))
+        if relationType in CONVERSE_TLINK_TYPES:
+            (source, relationType, target) = (target, CONVERSE_TLINK_TYPES[relationType], source)
+        elif relationType in SYMMETRIC_TLINK_TYPES and target < source:
+            (source, target) = (target, source)
+        return (relation.type, (source, relationType, target))
+    return (relation.type, tuple((name, _referenceKey(relation.properties[name], entityKeys, visiting))
+                                 for name in sorted(relation.properties)))
+
+def _matchedCount(referenceKeys, responseKeys):
+    # Size of the multiset intersection
+    return sum((collections.Counter(referenceKeys) & collections.Counter(responseKeys)).values())
+
+def _closedTLINKKeys(tlinkRelations, data, documentContents, entityKeys, closureEngine):
+    relations = list(tlinkRelations)
+    closureEngine(relations, data.annotations, documentContents, "agreement@closure").run()
+    return set(relationKey(relation, entityKeys) for relation in relations)
+
+def compareDocuments(referenceData, responseData, documentContents=u"", closureEngine=None, lenient=True):
+    """
+    :param ThymeMLData referenceData: the reference annotations
+    :param ThymeMLData responseData: the response annotations of the same document
+    :param unicode documentContents: text of the document
+    :param closureEngine: temporal closure engine class (see DocumentProcessor.CLOSURE_ENGINES) for tlinkClosure,
+        None skips it
+    :param bool lenient: also align the entities with overlapping spans (entities/<type> (lenient))
+    :return AgreementCounts: the counts of every category, see the module documentation
+    """
+    agreement = AgreementCounts()
+
+    referenceEntities = list(referenceData.annotations.select_class(ThymeMLEntity))
+    responseEntities = list(responseData.annotations.select_class(ThymeMLEntity))
+    (alignment, exact) = alignEntities(referenceEntities, responseEntities, lenient)
+
+    entityTypes = sorted(set(entity.type for entity in referenceEntities + responseEntities))
+    referenceCounts = collections.Counter(entity.type for entity in referenceEntities)
+    responseCounts = collections.Counter(entity.type for entity in responseEntities)
+    exactCounts = collections.Counter(entity.type for entity in responseEntities if id(entity) in exact)
+    alignedCounts = collections.Counter(entity.type for entity in responseEntities if id(entity) in alignment)
+    equalCounts = collections.Counter(entity.type for entity in responseEntities
+                                      if id(entity) in exact and entity == alignment[id(entity)])
+    for entityType in entityTypes:
+        agreement.add("entities/" + entityType, referenceCounts[entityType], responseCounts[entityType], exactCounts[entityType])
+        if lenient:
+            agreement.add("entities/" + entityType + " (lenient)", referenceCounts[entityType], responseCounts[entityType], alignedCounts[entityType])
+    for entityType in entityTypes:
+        agreement.add("attributes/" + entityType, exactCounts[entityType], exactCounts[entityType], equalCounts[entityType])
+
+    # Aligned entities share the key of the reference entity, unaligned response entities get keys of their own
+    entityKeys = {}
+    for (position, entity) in enumerate(referenceEntities):
+        entityKeys[id(entity)] = position
+    for (position, entity) in enumerate(responseEntities):
+        entityKeys[id(entity)] = entityKeys[id(alignment[id(entity)])] if id(entity) in alignment else -1 - position
+
+    referenceRelations = list(referenceData.annotations.select_class(ThymeMLRelation))
+    responseRelations = list(responseData.annotations.select_class(ThymeMLRelation))
+    referenceKeys = collections.defaultdict(list) # relation type -> keys
+    responseKeys = collections.defaultdict(list)
+    for relation in referenceRelations:
+        referenceKeys[relation.type].append(relationKey(relation, entityKeys))
+    for relation in responseRelations:
+        responseKeys[relation.type].append(relationKey(relation, entityKeys))
+    for relationType in sorted(set(referenceKeys) | set(responseKeys)):
+        agreement.add("relations/" + relationType, len(referenceKeys[relationType]), len(responseKeys[relationType]),
+                      _matchedCount(referenceKeys[relationType], responseKeys[relationType]))
+
+    # Relation types of the TLINKs whose (unordered) pair of entities is linked in both sets
+    referenceTypes = {}
+    for (_, (source, relationType, target)) in referenceKeys["TLINK"]:
+        referenceTypes.setdefault(frozenset((source, target)), (source, relationType, target))
+    linkedPairs = 0
+    sameTypes = 0
+    pairs = set()
+    for (_, (source, relationType, target)) in responseKeys["TLINK"]:
+        pair = frozenset((source, target))
+        if pair in referenceTypes and pair not in pairs:
+            pairs.add(pair)
+            linkedPairs += 1
+            sameTypes += referenceTypes[pair] == (source, relationType, target)
+    agreement.add("tlinkTypes", linkedPairs, linkedPairs, sameTypes)
+
+    if closureEngine is not None:
+        referenceTLINKs = [relation for relation in referenceRelations if relation.type == "TLINK"]
+        responseTLINKs = [relation for relation in responseRelations if relation.type == "TLINK"]
+        closedReference = _closedTLINKKeys(referenceTLINKs, referenceData, documentContents, entityKeys, closureEngine)
+        closedResponse = _closedTLINKKeys(responseTLINKs, responseData, documentContents, entityKeys, closureEngine)
+        agreement.add("tlinkClosure", len(referenceKeys["TLINK"]), len(responseKeys["TLINK"]),
+                      sum(1 for key in referenceKeys["TLINK"] if key in closedResponse),
+                      sum(1 for key in responseKeys["TLINK"] if key in closedReference))
+    return agreement
+
+def compareFiles(task):
+    """
+    Compares the annotation sets of two XML files of the same document, in a worker process.
+
+    :param tuple task: (document name, text path or None, reference XML path, response XML path, closure engine name
+        or None, lenient)
+    :return tuple: (document name, AgreementCounts record, see AgreementCounts.record)
+    """
+    (documentName, textPath, referencePath, responsePath, engineName, lenient) = task
+    documentContents = DocumentText(textPath) if textPath is not None else u""
+    try:
+        referenceData = ThymeMLData.from_file(referencePath, documentContents)
+        responseData = ThymeMLData.from_file(responsePath, documentContents)
+        closureEngine = CLOSURE_ENGINES[engineName] if engineName is not None else None
+        agreement = compareDocuments(referenceData, responseData, documentContents, closureEngine, lenient)
+    finally:
+        if isinstance(documentContents, DocumentText):
+            documentContents.close()
+    return (documentName, agreement.record())
+
+def main(referenceDirectory, responseDirectory, referenceAnnotator=None, responseAnnotator=None, documentDirectory="./Tim-Round1/THYME-Analysis/",
+         kinds=DOCUMENT_KINDS, engineName="TemporalClosure", lenient=True, workerCount=None, outputPath=None):
+    """
+    Scores the agreement of every document annotated in both XML directories (which can be the same directory, for
+    two annotators of the same round).
+
+    :param str referenceDirectory: XML directory of the reference annotations (one folder per document, see Corpus)
+    :param str responseDirectory: XML directory of the response annotations
+    :param str referenceAnnotator: annotator of the reference XML files (None takes the first XML file of every document)
+    :param str responseAnnotator: annotator of the response XML files (None takes the first XML file of every document)
+    :param str documentDirectory: directory of the text folders
+    :param tuple kinds: kinds of documents to score, see Corpus.DOCUMENT_KINDS
+    :param str engineName: temporal closure engine of tlinkClosure, see DocumentProcessor.CLOSURE_ENGINES (None skips it)
+    :param bool lenient: also align the entities with overlapping spans
+    :param int workerCount: number of worker processes (defaults to the number of CPUs)
+    :param str outputPath: if given, the counts and scores of every document are written to this JSON Lines file
+    """
+    def firstDocuments(xmlDirectory, annotator):
+        documents = collections.OrderedDict()
+        for document in Corpus(documentDirectory, xmlDirectory).documents(kinds, None if annotator is None else (annotator,)):
+            documents.setdefault(document.name, document)
+        return documents
+
+    referenceDocuments = firstDocuments(referenceDirectory, referenceAnnotator)
+    responseDocuments = firstDocuments(responseDirectory, responseAnnotator)
+    tasks = []
+    for (documentName, reference) in referenceDocuments.items():
+        response = responseDocuments.get(documentName)
+        if response is None or response.xmlPath == reference.xmlPath:
+            continue
+        tasks.append((documentName, reference.textPath, reference.xmlPath, response.xmlPath, engineName, lenient))
+    print "Scoring " + str(len(tasks)) + " documents annotated in both sets"
+
+    if workerCount is None:
+        workerCount = multiprocessing.cpu_count()
+    pool = None
+    if workerCount > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(workerCount)
+        results = pool.imap(compareFiles, tasks) # Documents come back in order
+    else:
+        results = (compareFiles(task) for task in tasks)
+
+    total = AgreementCounts()
+    outputFile = open(outputPath, "w") if outputPath is not None else None
+    try:
+        for (documentName, record) in results:
+            total.merge(AgreementCounts.fromRecord(record))
+            if outputFile is not None:
+                outputFile.write(json.dumps(collections.OrderedDict([("document", documentName), ("agreement", record)])) + "\n")
+    finally:
+        if outputFile is not None:
+            outputFile.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    print "Agreement of " + str(len(tasks)) + " documents (micro-averaged)"
+    total.writeText()
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inter-annotator agreement between two sets of THYME annotations")
+    parser.add_argument("reference", help="XML directory of the reference annotations, or a reference XML file")
+    parser.add_argument("response", help="XML directory of the response annotations, or a response XML file")
+    parser.add_argument("--reference-annotator", default=None, help="annotator of the reference XML files (default: the first XML file of every document)")
+    parser.add_argument("--response-annotator", default=None, help="annotator of the response XML files (default: the first XML file of every document)")
+    parser.add_argument("--documents", default="./Tim-Round1/THYME-Analysis/", help="directory of the text folders (default: ./Tim-Round1/THYME-Analysis/)")
+    parser.add_argument("--text", default=None, help="text of the document, when comparing two XML files")
+    parser.add_argument("--kind", action="append", choices=DOCUMENT_KINDS, help="kind of documents to score, can be repeated (default: every kind)")
+    parser.add_argument("--engine", choices=list(CLOSURE_ENGINES), default="TemporalClosure", help="closure engine of the TLINK closure agreement (default: TemporalClosure)")
+    parser.add_argument("--no-closure", action="store_true", help="skip the TLINK closure agreement")
+    parser.add_argument("--strict", action="store_true", help="only align entities with identical spans")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--output", default=None, help="JSON Lines file of the counts and scores of every document")
+    args = parser.parse_args()
+
+    engineName = None if args.no_closure else args.engine
+    if os.path.isfile(args.reference) and os.path.isfile(args.response):
+        (_, record) = compareFiles((None, args.text, args.reference, args.response, engineName, not args.strict))
+        AgreementCounts.fromRecord(record).writeText()
+    else:
+        main(args.reference, args.response, args.reference_annotator, args.response_annotator, args.documents,
+             tuple(args.kind or DOCUMENT_KINDS), engineName, not args.strict, args.workers, args.output)
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import sys
+import types
+
+def hashOfFile(path):
+    """
+    :param str path: path of the file to hash
+    :return str: md5 hex digest of the contents of the file
+    """
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def _sourcePath(module):
+    return os.path.splitext(os.path.abspath(module.__file__))[0] + ".py"
+
+def checkerModules(module):
+    """
+    :param module: the module running the checks
+    :return list: the module and the modules of its directory it uses, directly or through other modules, in the order
+        of their source paths
+    """
+    directory = os.path.dirname(_sourcePath(module))
+    modules = {} # source path -> module
+    pending = [module]
+    while pending:
+        current = pending.pop()
+        if getattr(current, "__file__", None) is None or os.path.dirname(_sourcePath(current)) != directory or _sourcePath(current) in modules:
+            continue
+        modules[_sourcePath(current)] = current
+        for value in vars(current).values():
+            if isinstance(value, types.ModuleType):
+                pending.append(value)
+            elif isinstance(value, (type, types.ClassType, types.FunctionType)) and value.__module__ in sys.modules:
+                pending.append(sys.modules[value.__module__]) # Imported with from ... import
+    return [modules[sourcePath] for sourcePath in sorted(modules)]
+
+def checkerVersion(modules, options=()):
+    """
+    :param list modules: the modules implementing the checks
+    :param tuple options: options changing the results of the checks (e.g. the closure engine)
+    :return str: a version that changes whenever the source of one of the modules or an option changes
+    """
+    md5 = hashlib.md5()
+    for module in modules:
+        md5.update(hashOfFile(_sourcePath(module)).encode("ascii"))
+    md5.update(repr(options).encode("utf-8"))
+    return md5.hexdigest()
+
+class BatchManifest(object):
+    '''
+    Records, for every checked document, the hashes of its XML and source text, the version of the checker, and
+    its conflict counts, so that a batch run only re-checks the documents whose inputs or checker changed.
+    '''
+
+    def __init__(self, path, checkerVersion):
+        """
+        :param str path: path of the manifest (JSON) file
+        :param str checkerVersion: version of the checker, see checkerVersion
+        """
+        self.path = path
+        self.checkerVersion = checkerVersion
+        self.documents = {}
+        if os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    self.documents = json.load(f)
+            except ValueError:
+                print "Ignoring invalid manifest " + path
+
+    def isCurrent(self, documentName, xmlHash, textHash):
+        """
+        :return bool: True if the document was checked with the same inputs and the same checker
+        """
+        entry = self.documents.get(documentName)
+        return (entry is not None and
+                entry["xml"] == xmlHash and
+                entry["text"] == textHash and
+                entry["checker"] == self.checkerVersion)
+
+    def conflictCounts(self, documentName):
+        """
+        :return tuple: the conflict counts recorded for the document
+        """
+        return tuple(self.documents[documentName]["counts"])
+
+    def record(self, documentName, xmlHash, textHash, conflictCounts):
+        self.documents[documentName] = {
+            "xml": xmlHash,
+            "text": textHash,
+            "checker": self.checkerVersion,
+            "counts": list(conflictCounts),
+        }
+
+    def save(self):
+        temporaryPath = self.path + ".tmp"
+        with open(temporaryPath, "w") as f:
+            json.dump(self.documents, f, indent=1, sort_keys=True)
+        os.rename(temporaryPath, self.path)
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import shutil
+import codecs
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from DocumentProcessor import *
+from SyntheticThymeML import writeDocument
+
+'''
+Scaling benchmark of the checker on synthetic documents (see SyntheticThymeML).
+
+Every document size is measured in a fresh worker process, so that the peak memory (maximum resident set size)
+reported for a size is not inflated by the sizes measured before it.
+'''
+
+def _peakMemoryMB():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0 # Bytes on OS X, KB on Linux
+
+def measure(task):
+    """
+    Times the stages of the check of one synthetic document, the same way processDocumentThymeMLData runs them.
+
+    :param tuple task: (directory, entity count, TLINK density, chain size, chain fraction, conflict rate, seed, closure engine name)
+    :return dict: the sizes, times (seconds), derived relation and conflict counts, and peak memory (MB) of the check
+    """
+    (directory, entityCount, tlinkDensity, chainSize, chainFraction, conflictRate, seed, engineName) = task
+    documentName = "ID%03d_clinic_%03d" % (entityCount % 1000, seed % 1000)
+    (documentPath, xmlPath) = writeDocument(os.path.join(directory, "text"), os.path.join(directory, "xml"), documentName,
+                                            entityCount=entityCount, tlinkDensity=tlinkDensity, chainSize=chainSize,
+                                            chainFraction=chainFraction, conflictRate=conflictRate, seed=seed)
+    documentContents = codecs.open(documentPath, "r", "utf-8").read()
+
+    start = time.time()
+    data = ThymeMLData.from_file(xmlPath, documentContents)
+    loadTime = time.time() - start
+
+    start = time.time()
+    tlinkRelations = list(data.annotations.select_type("TLINK"))
+    coreferenceIndex = CoreferenceIndex(CompiledDocument(data.annotations))
+    mergeCoreferentEventsInTemporalRelations(tlinkRelations, coreferenceIndex)
+    mergeTime = time.time() - start
+
+    start = time.time()
+    tlinkCount = len(tlinkRelations)
+    newRelationID = str(data.annotations.count_class(ThymeMLRelation) + 1) + "@" + documentName + "@gold"
+    closure = CLOSURE_ENGINES[engineName](tlinkRelations, data.annotations, documentContents, newRelationID)
+    (implicitRelationCount, conflictingRelationPairs) = closure.run()
+    closureTime = time.time() - start
+
+    return {
+        "entities": data.annotations.count_class(ThymeMLEntity),
+        "tlinks": tlinkCount,
+        "load": loadTime,
+        "merge": mergeTime,
+        "closure": closureTime,
+        "derived": implicitRelationCount,
+        "conflicts": len(conflictingRelationPairs),
+        "peakMB": _peakMemoryMB(),
+    }
+
+def main(sizes, tlinkDensity=1.0, chainSize=3, chainFraction=0.2, conflictRate=0.02, repeat=1, engineName="TemporalClosure"):
+    """
+    :param list sizes: numbers of entities per document
+    :param int repeat: number of documents (with different seeds) measured per size, the fastest one is reported
+    """
+    directory = tempfile.mkdtemp(prefix="thymeml-benchmark-")
+    try:
+        print "Closure engine: " + engineName
+        print "\t".join(["entities", "tlinks", "load (s)", "merge (s)", "closure (s)", "derived", "conflicts", "peak (MB)"])
+        for size in sizes:
+            results = []
+            for seed in range(repeat):
+                task = (directory, size, tlinkDensity, chainSize, chainFraction, conflictRate, seed, engineName)
+                pool = multiprocessing.Pool(1) # Fresh process, see _peakMemoryMB
+                try:
+                    results.append(pool.apply(measure, (task,)))
+                finally:
+                    pool.close()
+                    pool.join()
+            result = min(results, key=lambda r: r["load"] + r["merge"] + r["closure"])
+            print "%d\t%d\t%.3f\t%.3f\t%.3f\t%d\t%d\t%.1f" % (result["entities"], result["tlinks"], result["load"], result["merge"],
+                                                             result["closure"], result["derived"], result["conflicts"], result["peakMB"])
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the checker on synthetic documents of increasing size")
+    parser.add_argument("--sizes", default="100,200,400,800,1600", help="comma separated entity counts (default: 100,200,400,800,1600)")
+    parser.add_argument("--tlink-density", type=float, default=1.0, help="TLINKs per EVENT/TIMEX3 (default: 1.0)")
+    parser.add_argument("--chain-size", type=int, default=3, help="EVENTs per coreference chain (default: 3)")
+    parser.add_argument("--chain-fraction", type=float, default=0.2, help="fraction of EVENTs in coreference chains (default: 0.2)")
+    parser.add_argument("--conflict-rate", type=float, default=0.02, help="fraction of flipped TLINKs (default: 0.02)")
+    parser.add_argument("--repeat", type=int, default=1, help="documents measured per size, the fastest is reported (default: 1)")
+    parser.add_argument("--engine", choices=list(CLOSURE_ENGINES), default="TemporalClosure", help="closure engine (default: TemporalClosure)")
+    args = parser.parse_args()
+
+    main([int(size) for size in args.sizes.split(",")], args.tlink_density, args.chain_size, args.chain_fraction,
+         args.conflict_rate, args.repeat, args.engine)
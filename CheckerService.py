@@ -0,0 +1,259 @@
+import os
+import sys
+import stat
+import signal
+import json
+import time
+import hashlib
+import traceback
+import argparse
+import collections
+import SocketServer
+import BaseHTTPServer
+
+from DocumentProcessor import * # CLOSURE_ENGINES
+from BatchManifest import hashOfFile
+from DocumentText import DocumentText
+from Report import VERBOSITY_LEVELS, DETAIL
+from TermProject import processDocument
+
+class LRUCache(object):
+    '''
+    Fixed-size mapping that evicts its least recently used entry.
+    '''
+
+    def __init__(self, capacity):
+        """
+        :param int capacity: maximum number of entries
+        """
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict() # key -> value, least recently used first
+
+    def get(self, key):
+        """
+        :return: the value of the key (now the most recently used), or None
+        """
+        value = self._entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries[key] = value
+        return value
+
+    def put(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def record(self):
+        """
+        :return dict: size and hit counts of the cache
+        """
+        return collections.OrderedDict([("entries", len(self)), ("capacity", self.capacity), ("hits", self.hits), ("misses", self.misses)])
+
+class CheckerService(object):
+    '''
+    Checks documents on request, keeping what can be reused between checks in memory.
+
+    Parsed XML files are kept in their compiled form (see ThymeMLData.compile), keyed by the hash of the file, and a
+    fresh document is created from them for every check: the check modifies the annotations (TLINKs are merged with
+    their coreference chains, the closure adds relations), so the document and its indexes are rebuilt each time,
+    which costs far less than parsing. The results are kept too, keyed by the hashes of the XML and text files and
+    by the request (paths and options), so a document that did not change since its last check is answered without
+    checking it again. Both caches are LRU caches, so a long-running service holds at most cacheSize of each.
+    '''
+
+    def __init__(self, cacheSize=64, runClosure=True, engineName="TemporalClosure", reportFormat="text", verbosity=DETAIL):
+        """
+        :param int cacheSize: number of compiled XML files, and of results, kept in memory
+        :param bool runClosure: default of the closure option of the requests, see TermProject.main
+        :param str engineName: default temporal closure engine, see DocumentProcessor.CLOSURE_ENGINES
+        :param str reportFormat: default format of the reports, text or jsonl
+        :param int verbosity: default level of detail of the reports, see Report.VERBOSITY_LEVELS
+        """
+        self.documents = LRUCache(cacheSize) # XML hash -> compiled XML file
+        self.results = LRUCache(cacheSize) # (XML hash, text hash, paths, document name, options) -> result
+        self.runClosure = runClosure
+        self.engineName = engineName
+        self.reportFormat = reportFormat
+        self.verbosity = verbosity
+
+    def check(self, request):
+        """
+        :param dict request: {"xml": XML path, "text": text path} and optionally "document" (name of the document,
+            defaults to the name of the text file), "closure" (bool), "engine", "format" (text or jsonl) and
+            "verbosity" (summary, items or detail)
+        :return dict: the name of the document, its conflict counts and its rendered report, whether the result was
+            cached, and the time taken
+        """
+        start = time.time()
+        for field in ("xml", "text"):
+            if field not in request:
+                raise ValueError("missing field: {0}".format(field))
+        (xmlPath, documentPath) = (request["xml"], request["text"])
+        documentName = request.get("document") or os.path.basename(documentPath)
+        runClosure = bool(request.get("closure", self.runClosure))
+        engineName = request.get("engine", self.engineName)
+        reportFormat = request.get("format", self.reportFormat)
+        if engineName not in CLOSURE_ENGINES:
+            raise ValueError("unknown closure engine: {0}".format(engineName))
+        if reportFormat not in ("text", "jsonl"):
+            raise ValueError("unknown report format: {0}".format(reportFormat))
+        if "verbosity" in request and request["verbosity"] not in VERBOSITY_LEVELS:
+            raise ValueError("unknown verbosity: {0}".format(request["verbosity"]))
+        verbosity = VERBOSITY_LEVELS[request["verbosity"]] if "verbosity" in request else self.verbosity
+
+        with open(xmlPath, "rb") as xmlFile:
+            content = xmlFile.read()
+        xmlHash = hashlib.md5(content).hexdigest()
+        resultKey = (xmlHash, hashOfFile(documentPath), xmlPath, documentPath, documentName, (runClosure, engineName, reportFormat, verbosity))
+        result = self.results.get(resultKey)
+        cached = result is not None
+        if not cached:
+            compiled = self.documents.get(xmlHash)
+            if compiled is None:
+                compiled = ThymeMLData.compile(content, xmlPath)
+                self.documents.put(xmlHash, compiled)
+            documentContents = DocumentText(documentPath)
+            try:
+                data = ThymeMLData.from_compiled(compiled, documentContents)
+            except BaseException:
+                documentContents.close()
+                raise
+            task = (documentName, documentPath, xmlPath, None, runClosure, engineName, False, reportFormat, verbosity, None)
+            (_, conflictCounts, rendered, _) = processDocument(task, (documentContents, data, None))
+            result = collections.OrderedDict([
+                ("document", documentName),
+                ("conflicts", collections.OrderedDict(zip(("temporalClosure", "identityCoreference", "selfReferential"), conflictCounts))),
+                ("report", rendered),
+            ])
+            self.results.put(resultKey, result)
+
+        response = collections.OrderedDict(result)
+        response["cached"] = cached
+        response["seconds"] = round(time.time() - start, 6)
+        return response
+
+    def status(self):
+        """
+        :return dict: state of the caches
+        """
+        return collections.OrderedDict([("documents", self.documents.record()), ("results", self.results.record())])
+
+class CheckerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    POST /check with a JSON request (see CheckerService.check) answers with the JSON result, GET /status with the
+    state of the caches.
+    '''
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._reply(200, self.server.service.status())
+        else:
+            self._reply(404, {"error": "unknown path: " + self.path})
+
+    def do_POST(self):
+        if self.path != "/check":
+            self._reply(404, {"error": "unknown path: " + self.path})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+            if not isinstance(request, dict):
+                raise ValueError("the request must be a JSON object")
+            response = self.server.service.check(request)
+        except (ValueError, IOError) as e:
+            self._reply(400, {"error": str(e)})
+        except Exception as e:
+            traceback.print_exc()
+            self._reply(500, {"error": "{0}: {1}".format(type(e).__name__, e)})
+        else:
+            self._reply(200, response)
+
+    def _reply(self, status, fields):
+        body = json.dumps(fields)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else "local" # Unix socket clients have no address
+
+    def log_message(self, format, *args):
+        sys.stderr.write("%s - - [%s] %s\n" % (self.address_string(), self.log_date_time_string(), format % args))
+
+class CheckerHTTPServer(BaseHTTPServer.HTTPServer):
+    '''
+    HTTP server of a CheckerService on a localhost port. Requests are checked one at a time.
+    '''
+
+    def __init__(self, address, service):
+        """
+        :param tuple address: (host, port)
+        :param CheckerService service: the service answering the requests
+        """
+        self.service = service
+        BaseHTTPServer.HTTPServer.__init__(self, address, CheckerRequestHandler)
+
+class CheckerUnixServer(SocketServer.UnixStreamServer):
+    '''
+    HTTP server of a CheckerService on a Unix socket. Requests are checked one at a time.
+    '''
+
+    def __init__(self, path, service):
+        """
+        :param str path: path of the socket, a stale socket left at this path is replaced
+        :param CheckerService service: the service answering the requests
+        """
+        self.service = service
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path, CheckerRequestHandler)
+        (self.server_name, self.server_port) = (path, 0) # Used by BaseHTTPRequestHandler
+
+def main(host="localhost", port=8765, socketPath=None, cacheSize=64, runClosure=True, engineName="TemporalClosure", reportFormat="text", verbosity=DETAIL):
+    """
+    :param str host: address the service listens on
+    :param int port: port the service listens on
+    :param str socketPath: if given, the service listens on this Unix socket instead
+    :param int cacheSize: see CheckerService
+    """
+    service = CheckerService(cacheSize, runClosure, engineName, reportFormat, verbosity)
+    if socketPath is not None:
+        server = CheckerUnixServer(socketPath, service)
+        print "Checking documents on " + socketPath
+    else:
+        server = CheckerHTTPServer((host, port), service)
+        print "Checking documents on http://" + host + ":" + str(port) + "/check"
+    signal.signal(signal.SIGTERM, lambda signalNumber, frame: sys.exit(0)) # Stopping the service removes its socket
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socketPath is not None and os.path.exists(socketPath):
+            os.remove(socketPath)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check THYME annotations on request, keeping parsed documents and results in memory",
+                                     epilog='example: curl --data \'{"xml": "<XML file>", "text": "<text file>"}\' http://localhost:8765/check')
+    parser.add_argument("--host", default="localhost", help="address to listen on (default: localhost)")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on (default: 8765)")
+    parser.add_argument("--socket", default=None, metavar="PATH", help="listen on a Unix socket instead of a port")
+    parser.add_argument("--cache-size", type=int, default=64, help="number of parsed documents, and of results, kept in memory (default: 64)")
+    parser.add_argument("--format", choices=["text", "jsonl"], default="text", help="default format of the reports (default: text)")
+    parser.add_argument("--verbosity", choices=list(VERBOSITY_LEVELS), default="detail", help="default level of detail of the reports (default: detail)")
+    parser.add_argument("--quick", action="store_true", help="by default, only check BEFORE/CONTAINS relations for cycles, without the temporal closure")
+    parser.add_argument("--engine", choices=list(CLOSURE_ENGINES), default="TemporalClosure", help="default temporal closure engine (default: TemporalClosure)")
+    args = parser.parse_args()
+
+    main(args.host, args.port, args.socket, args.cache_size, not args.quick, args.engine, args.format, VERBOSITY_LEVELS[args.verbosity])
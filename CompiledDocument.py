@@ -0,0 +1,161 @@
+import array
+
+from thymeml import * # THYME-ML object model
+
+# Code of a missing or unresolved reference (e.g. a Source id that matches no annotation)
+NO_REFERENCE = -1
+
+# Class of an annotation that was not compared with the chain members yet
+_UNKNOWN_CLASS = -2
+
+class Codes(object):
+    '''
+    Interned strings of a column (e.g. the annotation types): every distinct value gets a small integer code.
+    '''
+
+    def __init__(self):
+        self.values = [] # code -> value
+        self._codes = {} # value -> code
+
+    def code(self, value):
+        """
+        :return int: the code of the value, interned if it is new
+        """
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def find(self, value):
+        """
+        :return int: the code of the value, or NO_REFERENCE if it was never interned
+        """
+        return self._codes.get(value, NO_REFERENCE)
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+class CompiledDocument(object):
+    '''
+    Columnar, integer-indexed tables of the relations of a document, for the checks that only need their types and
+    references: the coreference index (chain membership) and the BEFORE/CONTAINS cycle check (TLINK columns).
+
+    Every annotation gets a code: entities are numbered 0 .. entityCount - 1 in document order, then relations
+    entityCount .. entityCount + relationCount - 1. Columns are arrays indexed by relation (relationTypes,
+    relationSources, relationTargets, relationTemporalTypes), and references between annotations are codes, so
+    walking the tables never touches the XML-backed objects. The members of the coreference chains are stored as one
+    flat array with an offset per chain.
+
+    The members of the chains are also numbered by equality class (chainMemberClasses): members that are equal as
+    ThymeMLAnnotations (same spans, type and properties) share a class, as they share a key of a dict, so looking up
+    the chains of a reference compares integers once its class is known (see classOf).
+
+    The tables are a snapshot: refresh rereads the references of relations whose properties changed (e.g. TLINKs
+    merged with coreference chains). Relations created later are not part of them, so the closure engines, which
+    create TLINKs as they run (and TemporalClosure composes them further), still work on the annotation objects, and
+    no entity table is compiled since no check reads the offsets or types of entities.
+    '''
+
+    def __init__(self, annotations):
+        """
+        :param ThymeMLAnnotations annotations: the annotations of the document
+        """
+        entities = [annotation for annotation in annotations if isinstance(annotation, ThymeMLEntity)]
+        relations = [annotation for annotation in annotations if isinstance(annotation, ThymeMLRelation)]
+        self.entityCount = len(entities)
+        self.relationCount = len(relations)
+
+        self.annotations = entities + relations # code -> annotation
+        self._codeOfAnnotation = dict((id(annotation), code) for (code, annotation) in enumerate(self.annotations))
+
+        self.types = Codes() # relation types, e.g. TLINK, Identical
+        self.temporalTypes = Codes() # Type property of TLINKs and ALINKs, e.g. BEFORE
+
+        self.relationTypes = array.array("h")
+        self.relationSources = array.array("l", [NO_REFERENCE]) * self.relationCount # relation -> code of its Source
+        self.relationTargets = array.array("l", [NO_REFERENCE]) * self.relationCount # relation -> code of its Target
+        self.relationTemporalTypes = array.array("h", [NO_REFERENCE]) * self.relationCount
+        for relation in relations:
+            self.relationTypes.append(self.types.code(relation.type))
+        self.refresh(relations)
+
+        # Equality classes of the chain members (same notion of equality as set()), only computed for the other
+        # annotations when they are looked up, since hashing a relation resolves its references
+        self._classOf = {} # chain member (annotation or unresolved reference) -> class
+        self.references = [] # class -> first chain member of the class
+        self.classes = array.array("l", [_UNKNOWN_CLASS]) * len(self.annotations) # code -> class (NO_REFERENCE if none)
+
+        # Members of the coreference chains, in the order of allReferences
+        self.chainRelations = array.array("l") # chain -> relation index
+        self.chainOffsets = array.array("l", [0]) # chain -> offset of its first member (and of the next chain)
+        self.chainMembers = array.array("l") # member -> code (NO_REFERENCE if unresolved)
+        self.chainMemberClasses = array.array("l") # member -> equality class
+        for (relationIndex, relation) in enumerate(relations):
+            if relation.parents_type != "CorefChains":
+                continue
+            for reference in relation.allReferences:
+                code = self.codeOf(reference)
+                self.chainMembers.append(code)
+                self.chainMemberClasses.append(self._intern(reference))
+                if code != NO_REFERENCE:
+                    self.classes[code] = self.chainMemberClasses[-1]
+            self.chainRelations.append(relationIndex)
+            self.chainOffsets.append(len(self.chainMembers))
+
+    def _intern(self, reference):
+        equalityClass = self._classOf.get(reference)
+        if equalityClass is None:
+            equalityClass = self._classOf[reference] = len(self.references)
+            self.references.append(reference)
+        return equalityClass
+
+    def codeOf(self, annotation):
+        """
+        :param annotation: an annotation of the document (or an unresolved reference)
+        :return int: its code, NO_REFERENCE if it is not an annotation of the document
+        """
+        return self._codeOfAnnotation.get(id(annotation), NO_REFERENCE)
+
+    def classOf(self, reference):
+        """
+        :param reference: an annotation (of this document or not) or an unresolved reference
+        :return int: its equality class, NO_REFERENCE if no chain member is equal to it
+        """
+        code = self._codeOfAnnotation.get(id(reference))
+        if code is None:
+            return self._classOf.get(reference, NO_REFERENCE)
+        equalityClass = self.classes[code]
+        if equalityClass == _UNKNOWN_CLASS:
+            equalityClass = self.classes[code] = self._classOf.get(reference, NO_REFERENCE)
+        return equalityClass
+
+    def relationCode(self, relationIndex):
+        return self.entityCount + relationIndex
+
+    def relationIndex(self, code):
+        """
+        :return int: the index of the relation in the relation columns, NO_REFERENCE if the code is not a relation
+        """
+        return code - self.entityCount if code >= self.entityCount else NO_REFERENCE
+
+    def refresh(self, relations):
+        """
+        Rereads the Source, Target and Type of relations of the document.
+
+        :param list relations: relations of the document (relations that are not part of it are ignored)
+        """
+        for relation in relations:
+            relationIndex = self.relationIndex(self.codeOf(relation))
+            if relationIndex == NO_REFERENCE:
+                continue
+            properties = relation.properties
+            if "Source" in properties:
+                self.relationSources[relationIndex] = self.codeOf(properties["Source"])
+            if "Target" in properties:
+                self.relationTargets[relationIndex] = self.codeOf(properties["Target"])
+            if "Type" in properties and isinstance(properties["Type"], basestring):
+                self.relationTemporalTypes[relationIndex] = self.temporalTypes.code(properties["Type"])
@@ -0,0 +1,134 @@
+import collections
+
+from thymeml import * # THYME-ML object model
+from CompiledDocument import NO_REFERENCE
+
+class CoreferenceIndex(object):
+    '''
+    Disjoint-set index over the coreference chains (CorefChains relations) of a document.
+
+    The index is built once per document, from the chain membership arrays of its CompiledDocument. Every reference
+    is mapped to the chains it belongs to through its equality class, which is the same notion of equality as
+    `reference in chain.allReferences`, and chains of the same type (Identical, Whole/Part) that share a reference are
+    joined into one set, so the canonical chain of an annotation and the chains that share annotations are found in
+    near-constant time.
+    '''
+
+    def __init__(self, compiledDocument):
+        """
+        :param CompiledDocument compiledDocument: the compiled annotations of the document
+        """
+        self.compiledDocument = compiledDocument
+        self.chains = [compiledDocument.annotations[compiledDocument.relationCode(relationIndex)]
+                       for relationIndex in compiledDocument.chainRelations] # CorefChains relations in document order
+        self._chainTypes = [compiledDocument.relationTypes[relationIndex] for relationIndex in compiledDocument.chainRelations]
+        self._parent = list(range(len(self.chains)))
+        self._classesByChain = [] # chain index -> equality classes of its references, in the order of allReferences
+        self._chainsByClass = {} # equality class -> chain indexes (one per chain), in document order
+        self._references = collections.OrderedDict() # equality class -> first reference seen, in first-seen order
+
+        offsets = compiledDocument.chainOffsets
+        for index in range(len(self.chains)):
+            chainType = self._chainTypes[index]
+            classes = compiledDocument.chainMemberClasses[offsets[index]:offsets[index + 1]]
+            self._classesByChain.append(classes)
+            for (position, equalityClass) in enumerate(classes, offsets[index]):
+                if equalityClass not in self._references:
+                    self._references[equalityClass] = self._member(position)
+                chainIndexes = self._chainsByClass.setdefault(equalityClass, [])
+                if chainIndexes and chainIndexes[-1] == index: # Reference repeated within the chain
+                    continue
+                for otherIndex in chainIndexes: # Earlier chains of the same type are already in one set
+                    if self._chainTypes[otherIndex] == chainType:
+                        self._union(otherIndex, index)
+                        break
+                chainIndexes.append(index)
+
+    def _member(self, position):
+        # Reference at a position of the membership arrays (unresolved references are only known by their class)
+        code = self.compiledDocument.chainMembers[position]
+        if code == NO_REFERENCE:
+            return self.compiledDocument.references[self.compiledDocument.chainMemberClasses[position]]
+        return self.compiledDocument.annotations[code]
+
+    def _chainIndexes(self, reference, chainType):
+        chainIndexes = self._chainsByClass.get(self.compiledDocument.classOf(reference), ())
+        if chainType is None:
+            return chainIndexes
+        typeCode = self.compiledDocument.types.find(chainType)
+        return [index for index in chainIndexes if self._chainTypes[index] == typeCode]
+
+    def _find(self, index):
+        while self._parent[index] != index:
+            self._parent[index] = self._parent[self._parent[index]] # Path halving
+            index = self._parent[index]
+        return index
+
+    def _union(self, index1, index2):
+        root1 = self._find(index1)
+        root2 = self._find(index2)
+        if root1 != root2: # The chain that comes first in the document is the canonical chain of the set
+            self._parent[max(root1, root2)] = min(root1, root2)
+
+    def chainsOf(self, reference, chainType=None):
+        """
+        :param ThymeMLAnnotation reference: an annotation (or reference) that may belong to coreference chains
+        :param str chainType: only return chains of this type, e.g. Identical
+        :return list: the chains containing the reference, in document order
+        """
+        return [self.chains[index] for index in self._chainIndexes(reference, chainType)]
+
+    def chainOf(self, reference, chainType="Identical", mergeOverlappingChains=False):
+        """
+        :param ThymeMLAnnotation reference: an annotation (or reference) that may belong to coreference chains
+        :param str chainType: type of the chain to look for
+        :param bool mergeOverlappingChains: return the canonical chain of all the chains transitively sharing
+            annotations with the chain containing the reference, instead of the first chain containing it
+        :return ThymeMLRelation: the chain, or None if the reference does not belong to a chain of that type
+        """
+        for index in self._chainIndexes(reference, chainType):
+            if mergeOverlappingChains:
+                index = self._find(index)
+            return self.chains[index]
+        return None
+
+    def mergedChains(self, chainType="Identical"):
+        """
+        :param str chainType: type of the chains to merge
+        :return list: one list per set of chains transitively sharing annotations, the canonical chain first
+        """
+        typeCode = self.compiledDocument.types.find(chainType)
+        merged = collections.OrderedDict()
+        for (index, chain) in enumerate(self.chains):
+            if self._chainTypes[index] == typeCode:
+                merged.setdefault(self._find(index), []).append(chain)
+        return list(merged.values())
+
+    def sharedReferences(self, chainType="Identical"):
+        """
+        :param str chainType: type of the chains to check
+        :return list: (reference, chains) for every reference belonging to more than one chain of that type
+        """
+        shared = []
+        for reference in self._references.values():
+            chains = self.chainsOf(reference, chainType)
+            if len(chains) > 1:
+                shared.append((reference, chains))
+        return shared
+
+    def sharedReferenceCount(self, chainType="Identical"):
+        """
+        :param str chainType: type of the chains to check
+        :return int: number of (chain, reference of that chain, other chain containing the reference) triples
+        """
+        typeCode = self.compiledDocument.types.find(chainType)
+        chainCounts = {} # equality class -> number of chains of that type containing it
+        for (equalityClass, chainIndexes) in self._chainsByClass.items():
+            chainCounts[equalityClass] = sum(1 for index in chainIndexes if self._chainTypes[index] == typeCode)
+        count = 0
+        for (index, classes) in enumerate(self._classesByChain):
+            if self._chainTypes[index] != typeCode:
+                continue
+            for equalityClass in classes:
+                count += chainCounts[equalityClass] - 1
+        return count
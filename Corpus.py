@@ -0,0 +1,169 @@
+import os
+import re
+import sys
+import json
+import collections
+
+from thymeml import scandir
+
+'''
+Discovery of the documents of a THYME corpus: a directory of text folders and a directory of XML folders, both with
+one folder per document, e.g.
+
+    <document directory>/ID001_clinic_001/ID001_clinic_001
+    <XML directory>/ID001_clinic_001/ID001_clinic_001.Thyme2v1-withindoc.ogormant.inprogress.xml
+
+The listing of the folders is cached in a JSON manifest, with the modification times of the two directories and
+of each of their folders. Checking the cached listing only stats the two directories: when one of them changed (a
+folder was added, removed or renamed), its folders are statted and only the new folders, and those whose
+modification time changed, are listed again. Adding or removing a file in an existing folder changes the time of
+the folder but not of the directory, so the cached listing misses it until the corpus is rescanned (see
+Corpus(rescan=True) and TermProject --rescan), which lists every folder again.
+'''
+
+# e.g. ID001_clinic_001, ID001_path_002
+FOLDER_PATTERN = re.compile(r"^ID\d+_(?P<kind>clinic|path)_\d+$")
+# e.g. ID001_clinic_001.Thyme2v1-withindoc.ogormant.inprogress.xml
+XML_PATTERN = re.compile(r"^(?P<document>[^.]+)[.](?P<schema>[^.]+)[.](?P<annotator>[^.]+)[.](?P<status>[^.]+)[.]xml$")
+
+DOCUMENT_KINDS = ("clinic", "path")
+
+# Bump whenever the layout of the manifest changes
+_MANIFEST_FORMAT = 2
+
+CorpusDocument = collections.namedtuple("CorpusDocument", ["name", "kind", "textPath", "xmlPath", "annotator"])
+
+def _directoryTime(directory):
+    """
+    :return float: modification time of the directory, None if it does not exist
+    """
+    return os.stat(directory).st_mtime if os.path.isdir(directory) else None
+
+def _modificationTimes(directory):
+    """
+    :return dict: {"directory": modification time of the directory, "folders": folder -> modification time}, the
+        directory time is None if the directory does not exist
+    """
+    if not os.path.isdir(directory):
+        return {"directory": None, "folders": {}}
+    folders = {}
+    for entry in scandir(directory):
+        if entry.is_dir():
+            folders[entry.name] = entry.stat().st_mtime
+    return {"directory": os.stat(directory).st_mtime, "folders": folders}
+
+def _listFolders(directory, times, previousFolders=None, previousTimes=None):
+    """
+    :param dict times: modification times of the directory and its folders, see _modificationTimes
+    :param dict previousFolders: the cached listing of the directory, reused for the folders whose modification time
+        did not change since previousTimes
+    :return dict: folder -> sorted names of the files of the folder, for every folder of the directory
+    """
+    folders = {}
+    for (folder, time) in times["folders"].items():
+        if previousFolders is not None and folder in previousFolders and previousTimes["folders"].get(folder) == time:
+            folders[folder] = previousFolders[folder]
+        else:
+            folders[folder] = sorted(entry.name for entry in scandir(os.path.join(directory, folder)) if entry.is_file())
+    return folders
+
+def _fileSystemNames(folders):
+    # JSON strings are loaded as unicode, file names are listed as str
+    encoding = sys.getfilesystemencoding() or "utf-8"
+    return dict((folder.encode(encoding), [name.encode(encoding) for name in names]) for (folder, names) in folders.items())
+
+def _fileSystemTimes(times):
+    encoding = sys.getfilesystemencoding() or "utf-8"
+    return {"directory": times["directory"],
+            "folders": dict((folder.encode(encoding), time) for (folder, time) in times["folders"].items())}
+
+class Corpus(object):
+    '''
+    Folders, text files and XML files of a corpus, see the module documentation.
+    '''
+
+    def __init__(self, documentDirectory, xmlDirectory, manifestPath=None, rescan=False):
+        """
+        :param str documentDirectory: directory of the text folders
+        :param str xmlDirectory: directory of the XML folders
+        :param str manifestPath: path of the cached listing (None always scans the directories)
+        :param bool rescan: list every folder of the directories, even if the cached listing is current
+        """
+        self.documentDirectory = documentDirectory
+        self.xmlDirectory = xmlDirectory
+        self.manifestPath = manifestPath
+        self.rescanned = False
+
+        manifest = None if rescan else self._loadManifest()
+        directoryTimes = [_directoryTime(documentDirectory), _directoryTime(xmlDirectory)]
+        if manifest is None or [times["directory"] for times in manifest["modificationTimes"]] != directoryTimes:
+            modificationTimes = [_modificationTimes(documentDirectory), _modificationTimes(xmlDirectory)]
+            if manifest is None:
+                (textFolders, xmlFolders) = (_listFolders(documentDirectory, modificationTimes[0]), _listFolders(xmlDirectory, modificationTimes[1]))
+            else: # Only list the folders that changed
+                (previousTextTimes, previousXMLTimes) = manifest["modificationTimes"]
+                textFolders = _listFolders(documentDirectory, modificationTimes[0], manifest["textFolders"], previousTextTimes)
+                xmlFolders = _listFolders(xmlDirectory, modificationTimes[1], manifest["xmlFolders"], previousXMLTimes)
+            manifest = {
+                "format": _MANIFEST_FORMAT,
+                "documentDirectory": documentDirectory,
+                "xmlDirectory": xmlDirectory,
+                "modificationTimes": modificationTimes,
+                "textFolders": textFolders,
+                "xmlFolders": xmlFolders,
+            }
+            self.rescanned = True
+            self._saveManifest(manifest)
+
+        self.textFolders = manifest["textFolders"] # folder -> text files
+        self.xmlFolders = manifest["xmlFolders"] # folder -> XML files
+
+    def _loadManifest(self):
+        if self.manifestPath is None or not os.path.isfile(self.manifestPath):
+            return None
+        try:
+            with open(self.manifestPath) as f:
+                manifest = json.load(f)
+        except ValueError:
+            print "Ignoring invalid corpus manifest " + self.manifestPath
+            return None
+        if (manifest.get("format") != _MANIFEST_FORMAT or manifest.get("documentDirectory") != self.documentDirectory or
+                manifest.get("xmlDirectory") != self.xmlDirectory):
+            return None
+        manifest["textFolders"] = _fileSystemNames(manifest["textFolders"])
+        manifest["xmlFolders"] = _fileSystemNames(manifest["xmlFolders"])
+        manifest["modificationTimes"] = [_fileSystemTimes(times) for times in manifest["modificationTimes"]]
+        return manifest
+
+    def _saveManifest(self, manifest):
+        if self.manifestPath is None:
+            return
+        temporaryPath = self.manifestPath + ".tmp"
+        with open(temporaryPath, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.rename(temporaryPath, self.manifestPath)
+
+    def documents(self, kinds=DOCUMENT_KINDS, annotators=None):
+        """
+        :param tuple kinds: kinds of documents to include, see DOCUMENT_KINDS
+        :param tuple annotators: annotators whose XML files are included (None includes every annotator)
+        :return list: a CorpusDocument per XML file of a document of those kinds, ordered by document and XML file
+            (the text path is None when the document has no text file)
+        """
+        documents = []
+        for folder in sorted(self.xmlFolders):
+            match = FOLDER_PATTERN.match(folder)
+            if match is None or match.group("kind") not in kinds:
+                continue
+            textPath = None
+            if folder in self.textFolders.get(folder, ()):
+                textPath = os.path.join(self.documentDirectory, folder, folder)
+            for xmlName in self.xmlFolders[folder]:
+                xmlMatch = XML_PATTERN.match(xmlName)
+                if xmlMatch is None or xmlMatch.group("document") != folder:
+                    continue
+                if annotators is not None and xmlMatch.group("annotator") not in annotators:
+                    continue
+                documents.append(CorpusDocument(folder, match.group("kind"), textPath,
+                                                os.path.join(self.xmlDirectory, folder, xmlName), xmlMatch.group("annotator")))
+        return documents
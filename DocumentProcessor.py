@@ -1,77 +1,127 @@
-from thymeml import * # THYME-ML object model
+import copy
+import functools
+import collections
 
-def printSectionDivider(depth):
+from thymeml import * # THYME-ML object model
+from TemporalClosure import TemporalClosure # THYME transitivity rules
+from IntervalAlgebra import AllenClosure # Allen's interval algebra with path consistency
+from EndpointClosure import EndpointClosure # Point constraints between the start and end points of annotations
+from CompiledDocument import CompiledDocument # Columnar tables of the annotations
+from CoreferenceIndex import CoreferenceIndex # Disjoint-set index of coreference chains
+from TemporalCycles import TemporalCycleCheck # Cycles of BEFORE/CONTAINS relations
+from SpanIndex import SpanIndex # Interval index of entity spans
+from Instrumentation import NO_INSTRUMENTATION # Per-stage timing and counters
+from Report import Report, ITEMS, DETAIL # Records of the check, rendered to text or JSON Lines
+
+# Closure engines by name, every engine is built with (TLINKs, annotations, document contents, new relation id) and
+# its run() returns (derived relation count, conflicting relation pairs)
+CLOSURE_ENGINES = collections.OrderedDict([
+    ("TemporalClosure", TemporalClosure),
+    ("AllenClosure", AllenClosure),
+    ("EndpointClosure", EndpointClosure),
+])
+
+def printSectionDivider(depth, out=None):
 
     if depth == 0:
-        print "########################################"
-        print "########################################"
+        print >> out, "########################################"
+        print >> out, "########################################"
     elif depth == 1:
-        print "________________________________________"
+        print >> out, "________________________________________"
     elif depth == 2:
-        print "\t----------------------" 
+        print >> out, "\t----------------------" 
     elif depth == 3:
-        print "\t\t------------------" 
-
-def processDocumentThymeMLData(xmlPath, documentName, documentContents):
-
-    data = ThymeMLData.from_file(xmlPath, documentContents)
+        print >> out, "\t\t------------------" 
+
+def processDocumentThymeMLData(xmlPath, documentName, documentContents, closureEngine=TemporalClosure, mergeOverlappingChains=False, out=None, cacheDirectory=None, runClosure=True, instrumentation=NO_INSTRUMENTATION, report=None, exportPath=None, data=None):
+    """
+    :param closureEngine: temporal closure engine class, see CLOSURE_ENGINES
+    :param out: file the text report is written to when no report is given (None writes to stdout)
+    :param bool runClosure: False skips the temporal closure and counts the BEFORE/CONTAINS cycles as conflicts instead
+    :param Instrumentation instrumentation: collects the time spent in every stage and the closure counters
+    :param Report report: collects the records of the check, to be rendered by the caller
+    :param str exportPath: if given, the document is written to this path with the TLINKs derived by the closure,
+        see exportedAnnotations
+    :param ThymeMLData data: the document, when it was already loaded from xmlPath (e.g. by a Prefetcher)
+    :return tuple: (temporal closure, identity coreference, self-referential) conflict counts
+    """
+    if report is None:
+        report = Report(documentName)
+        conflictCounts = processDocumentThymeMLData(xmlPath, documentName, documentContents, closureEngine, mergeOverlappingChains,
+                                                    cacheDirectory=cacheDirectory, runClosure=runClosure,
+                                                    instrumentation=instrumentation, report=report, exportPath=exportPath, data=data)
+        report.writeText(out)
+        return conflictCounts
+
+    if data is None:
+        instrumentation.stage("load")
+        data = ThymeMLData.from_file(xmlPath, documentContents, cache_dir=cacheDirectory)
 
     # Events
-    entities = [a for a in data.annotations if type(a) is ThymeMLEntity]
-    if len([a for a in entities if a.type == "DOCTIME"]) < 1:
-        print "ERROR: Found LESS than 1 DOCTIME entity annotation"
-    elif len([a for a in entities if a.type == "DOCTIME"]) > 1:
-        print "ERROR: Found MORE than 1 DOCTIME entity annotation"
-    docTime = [a for a in entities if a.type == "DOCTIME"][0] # There should be exactly one match
-    events = [a for a in entities if a.type == "EVENT"]
-    timex3s = [a for a in entities if a.type == "TIMEX3"]
-    markables = [a for a in entities if a.type == "Markable"]
-
-    print "\tENTITY ANNOTATIONS (Total: " + str(len(entities)) + ")"
+    instrumentation.stage("filter")
+    entityCount = data.annotations.count_class(ThymeMLEntity)
+    docTimes = [a for a in data.annotations.select_type("DOCTIME") if type(a) is ThymeMLEntity]
+    if len(docTimes) < 1:
+        _error(report, "ERROR: Found LESS than 1 DOCTIME entity annotation")
+    elif len(docTimes) > 1:
+        _error(report, "ERROR: Found MORE than 1 DOCTIME entity annotation")
+    docTime = docTimes[0] # There should be exactly one match
+    eventCount = len([a for a in data.annotations.select_type("EVENT") if type(a) is ThymeMLEntity])
+    timex3Count = len([a for a in data.annotations.select_type("TIMEX3") if type(a) is ThymeMLEntity])
+    markableCount = len([a for a in data.annotations.select_type("Markable") if type(a) is ThymeMLEntity])
+
+    _count(report, "entities", entityCount, "\tENTITY ANNOTATIONS (Total: " + str(entityCount) + ")")
     #printSectionDivider(3)
-    print "\t\tMarkables (" + str(len(markables)) + ")"
+    _count(report, "markables", markableCount, "\t\tMarkables (" + str(markableCount) + ")")
     # for annotation in markables:
         # print "" #annotation.spansContent
     #printSectionDivider(3)
-    print "\t\tDocTime (" + str(docTime.spansContent) 
+    report.record("docTime", {"id": docTime.id, "spans": docTime.spans}, "\t\tDocTime (" + str(docTime.spansContent))
     #printSectionDivider(3)
-    print "\t\tEvents (" + str(len(events)) + ")"
+    _count(report, "events", eventCount, "\t\tEvents (" + str(eventCount) + ")")
+    spanIndex = SpanIndex(data.annotations.select_class(ThymeMLEntity))
+    overlappingEventCount = len(spanIndex.overlappingPairs("EVENT"))
+    _count(report, "overlappingEvents", overlappingEventCount, "\t\t\tOverlapping Events (" + str(overlappingEventCount) + ")")
     # for annotation in events:
         # print "" #annotation.spansContent
     #printSectionDivider(3)
-    print "\t\tTIMEX3s (" + str(len(timex3s)) + ")"
+    _count(report, "timex3s", timex3Count, "\t\tTIMEX3s (" + str(timex3Count) + ")")
     # for annotation in timex3s:
         # print "" #annotation.spansContent
     #printSectionDivider(3)
 
     # Relations
-    relations = [a for a in data.annotations if type(a) is ThymeMLRelation]
-    identicalRelations = [r for r in data.annotations if r.type == "Identical"]
+    relationCount = data.annotations.count_class(ThymeMLRelation)
+    identicalRelations = list(data.annotations.select_type("Identical"))
     
     # TLINKs connect two EVENTs, or an EVENT and a TIMEX3 together, specifying the temporal relationship between them (before, overlap, contains, begins-on and ends-on)
-    tlinkRelations = [r for r in data.annotations if r.type == "TLINK"]
-    alinkRelations = [r for r in data.annotations if r.type == "ALINK"]
-    print "\tRELATION ANNOTATIONS (Total: " + str(len(relations)) + ")"
+    tlinkRelations = list(data.annotations.select_type("TLINK"))
+    alinkCount = data.annotations.count_type("ALINK")
+    _count(report, "relations", relationCount, "\tRELATION ANNOTATIONS (Total: " + str(relationCount) + ")")
     #printSectionDivider(3)
-    print "\t\tTLINK Relations (" + str(len(tlinkRelations)) + ")"
+    _count(report, "tlinks", len(tlinkRelations), "\t\tTLINK Relations (" + str(len(tlinkRelations)) + ")")
     # for annotation in tlinkRelations:
     #     if type(annotation) is ThymeMLRelation: 
     #         print "" #annotation.spansContent
 
    #printSectionDivider(3)
-    print "\t\tALINK Relations (" + str(len(alinkRelations)) + ")"
+    _count(report, "alinks", alinkCount, "\t\tALINK Relations (" + str(alinkCount) + ")")
     # for annotation in alinkRelations:
     #     if type(annotation) is ThymeMLRelation: 
     #         print "" #annotation.spansContent
 
     #printSectionDivider(3)
-    print "\t\tIdentical Relations (" + str(len(identicalRelations)) + ")"
+    _count(report, "identicalRelations", len(identicalRelations), "\t\tIdentical Relations (" + str(len(identicalRelations)) + ")")
     # for annotation in identicalRelations:
     #     if type(annotation) is ThymeMLRelation: 
     #         print "" #annotation.spansContent
 
-    printSectionDivider(1)
-    print "Checking coreference chains (Identical) for multiple types..."
+    instrumentation.stage("compile")
+    compiledDocument = CompiledDocument(data.annotations)
+
+    instrumentation.stage("corefCheck")
+    report.text(functools.partial(_renderDivider, 1))
+    report.text("Checking coreference chains (Identical) for multiple types...")
     
     for relation in identicalRelations:
         hasMarkable = False
@@ -85,25 +135,20 @@ def processDocumentThymeMLData(xmlPath, documentName, documentContents):
             elif reference.type == "TIMEX3":
                 hasTimex3 = True
         if (hasMarkable + hasEvent + hasTimex3) > 1:
-            printSectionDivider(2)
-            print "\tCoreference chain with multiple types:"
-            for reference in relation.allReferences:
-                print "\t\t" + reference.type + ": " + str(reference.spansContent)
-
-    printSectionDivider(1)
-    print "Confirm that all Identical Relations (" + str(len(identicalRelations)) + ") are mutually independent (do not share annotations)"
-    independentIdenticalRelations = 0
-    for relation in identicalRelations:
-        for reference in relation.allReferences:
-            for relation2 in identicalRelations:
-                if relation is relation2:
-                    continue
-                if reference in relation2.allReferences:
-                    independentIdenticalRelations += 1
+            references = relation.allReferences
+            report.record("corefTypeMix",
+                          {"chain": relation.id, "references": [[reference.id, reference.type] for reference in references]},
+                          functools.partial(_renderCorefTypeMix, references), ITEMS)
+
+    report.text(functools.partial(_renderDivider, 1))
+    report.text("Confirm that all Identical Relations (" + str(len(identicalRelations)) + ") are mutually independent (do not share annotations)")
+    coreferenceIndex = CoreferenceIndex(compiledDocument)
+    independentIdenticalRelations = coreferenceIndex.sharedReferenceCount("Identical")
+    report.record("count", collections.OrderedDict([("name", "sharedIdenticalReferences"), ("value", independentIdenticalRelations)]), None)
     if independentIdenticalRelations > 0:
-        print "\tERROR: Found (" + str(independentIdenticalRelations) + ") Identical relations with references in common!"
+        report.text("\tERROR: Found (" + str(independentIdenticalRelations) + ") Identical relations with references in common!")
     else:
-        print "\t All identical relations are independent."
+        report.text("\t All identical relations are independent.")
 
     # printSectionDivider(1)
     # print "Confirm that all Events are anchored to the timeline (Whether this anchoring is as specific as a TLINK to a TIMEX3 or general as the DocTimeRel marking)..."
@@ -111,215 +156,55 @@ def processDocumentThymeMLData(xmlPath, documentName, documentContents):
     #     if not event.isAnchored(relations):
     #         print "Event (" + event.text + ") is not anchored!!!"
 
-    printSectionDivider(1)
-    print "Replacing TLINK relationship source/target entities with the coreference chain relation they belong to (if any)"
+    instrumentation.stage("corefMerge")
+    report.text(functools.partial(_renderDivider, 1))
+    report.text("Replacing TLINK relationship source/target entities with the coreference chain relation they belong to (if any)")
 
-    print "TLINK Relations"
-    mergeCoreferentEventsInTemporalRelations(tlinkRelations, identicalRelations)
+    report.text("TLINK Relations")
+    replaced = mergeCoreferentEventsInTemporalRelations(tlinkRelations, coreferenceIndex, mergeOverlappingChains)
+    compiledDocument.refresh(tlinkRelations)
+    _count(report, "mergedTlinkEndpoints", replaced, "\tTemporal Relation Components Replaced with Coreference Chains " + str(replaced) + "/" + str(len(tlinkRelations)*2))
     # print "ALINK Relations" # We are no longer handling ALINK relations
-    # mergeCoreferentEventsInTemporalRelations(alinkRelations, identicalRelations)
-
-    printSectionDivider(1)
-    print "Performing temporal closure..."
-
-    conflictingRelationPairs = []
-    foundImplicitRelation = True
-    implicitRelationCount = 0
-    while foundImplicitRelation:
-        foundImplicitRelation = False
-        
-        for i, relation1 in enumerate(tlinkRelations):
-
-            for j, relation2 in enumerate(tlinkRelations):
-
-                if j <= i:
-                    continue
-
-                allReferences = relation1.allReferences[:]
-                allReferences.extend(relation2.allReferences)
-
-                if len(allReferences) is not 4:
-                    # print "ERROR: There should always be 4 annotations to compare when propogating relations. Found (" + str(len(allReferences)) + ")"
-                    continue
-
-                uniqueReferences = set(allReferences) # This did not work because of non-hashable lists
-                # uniqueReferences = list()
-                # for reference in allReferences:
-                #     isUnique = True
-                #     for uniqueReference in uniqueReferences:
-                #         if uniqueReference.id == reference.id:
-                #             isUnique = False
-                #     if isUnique:
-                #         uniqueReferences.append(reference)
-
-                if len(uniqueReferences) == 2: # Complete overlap... look for conflicts (2 overlapping references)
-                    
-                    # print "\t\tChecking for conflict or agreement"
-
-                    referenceAlignment = relation1.properties["Source"] is relation2.properties["Source"]  # x R1 y, x R2 y
-
-                    if relation1.properties["Type"] == "OVERLAP" or relation2.properties["Type"] == "OVERLAP": # Do not support conflict discovery for relation type "OVERLAP"
-                        continue
-
-                    relationConflict = False
-                    if referenceAlignment:
-                        relationConflict = relation1.properties["Type"] != relation2.properties["Type"]
-                    else:
-                        relationConflict = (relation1.properties["Type"] == "BEGINS-ON" and relation2.properties["Type"] == "ENDS-ON") or (relation2.properties["Type"] == "BEGINS-ON" and relation1.properties["Type"] == "ENDS-ON")                    
-
-                    # Relation Conflict
-                    if relationConflict:
-                        relationPair = (relation1, relation2)
-                        if relationPair not in conflictingRelationPairs:
-                            conflictingRelationPairs.append(relationPair)
-
-                elif len(uniqueReferences) == 3: # Create new explicit relation (1 overlapping reference)
-
-                    '''
-                    We use Allen's Transitivity Table for the Twelve Temporal Relations, except that
-                    THYME Annotation Guidelines only support 5 different temporal relation TLINK types:
-                        "BEFORE", "CONTAINS", "OVERLAP", "BEGINS-ON", "ENDS-ON"
-                    Therefore we first do some magic to convert THYME TLINK types to Allen's relations
-                    when the events are reversed, and then once the temporal closure is complete, we convert
-                    Allen's relation types back to THYME relation types. In this way, we can support the following types:
-                        "BEFORE", "AFTER", "DURING", "CONTAINS", "OVERLAP", "BEGINS-ON", "ENDS-ON"
-                    Since THYME Annotation Guidelines merge Allen's "Overlaps" and "Overlapped-By" into a single type,
-                    therefore we do not apply temporal closure to temporal relation TLINKs of type "OVERLAP"  
-                    '''
-
-                    # x R1 y, y R2 z # None reversed
-                    newRelationType = ""
-                    relation1Reversed = False
-                    relation2Reversed = False
-                    if relation1.properties["Source"] is relation2.properties["Source"]: # y R1 x, y R2 z # 1st reversed
-                        relation1Reversed = True
-                    elif relation1.properties["Target"] is relation2.properties["Target"]: # x R1 y, z R2 y # 2nd reversed
-                        relation2Reversed = True
-                    elif relation1.properties["Source"] is relation2.properties["Target"]: # y R1 x, z R2 y # 1st/2nd reversed
-                        relation1Reversed = True
-                        relation2Reversed = True
-
-                    # Reverse the relation if necessary, since ThymeML does not use AFTER or DURING relations
-                    relation1Resolved = relation1.properties["Type"]
-                    if relation1.properties["Type"] == "BEFORE" and relation1Reversed:
-                        relation1Resolved = "AFTER"
-                    elif relation1.properties["Type"] == "CONTAINS" and relation1Reversed:
-                        relation1Resolved = "DURING"
-
-                    relation2Resolved = relation2.type
-                    if relation2.properties["Type"] == "BEFORE" and relation2Reversed:
-                        relation2Resolved = "AFTER"
-                    elif relation2.properties["Type"] == "CONTAINS" and relation2Reversed:
-                        relation2Resolved = "DURING"
-
-                    # Temporal closure
-                    if relation1Resolved == "BEFORE":
-                        if relation2Resolved in ["BEFORE", "CONTAINS", "ENDS-ON"]:
-                            newRelationType = "BEFORE"
-                    if relation1Resolved == "AFTER":
-                        if relation2Resolved in ["AFTER", "CONTAINS", "BEGINS-ON"]:
-                            newRelationType = "AFTER"
-                    if relation1Resolved == "DURING":
-                        if relation2Resolved in ["BEFORE", "ENDS-ON"]:
-                            newRelationType = "BEFORE"
-                        elif relation2Resolved in ["AFTER", "BEGINS-ON"]:
-                            newRelationType = "AFTER"
-                        elif relation2Resolved in ["DURING"]:
-                            newRelationType = "DURING"
-                    elif relation1Resolved == "CONTAINS":
-                        if relation2Resolved in ["CONTAINS"]:
-                            newRelationType = "CONTAINS"
-                    elif relation1Resolved == "ENDS-ON":
-                        if relation2Resolved in ["BEFORE", "CONTAINS", "ENDS-ON"]:
-                            newRelationType = "BEFORE"
-                    elif relation1Resolved == "BEGINS-ON":
-                        if relation2Resolved in ["AFTER", "CONTAINS", "BEGINS-ON"]:
-                            newRelationType = "AFTER"
-
-                    if newRelationType == "":
-                        continue
-
-                    # Reverse the relation again if necessary, since ThymeML does not use AFTER or DURING relations
-                    shouldReverseNewRelation = False
-                    if newRelationType == "AFTER":
-                        newRelationType = "BEFORE"
-                        shouldReverseNewRelation = True
-                    elif newRelationType == "DURING":
-                        newRelationType = "CONTAINS"
-                        shouldReverseNewRelation = True
-
-                    source = relation1.properties["Target"] if relation1Reversed else relation1.properties["Source"] 
-                    target = relation2.properties["Source"] if relation2Reversed else relation2.properties["Target"]
-
-                    if shouldReverseNewRelation:
-                        tempReference = source
-                        source = target
-                        target = tempReference
-
-                    # Create new temporal relation
-                    newRelationID = str(len(relations) + 1) + "@" + documentName + "@gold"
-
-                    newRelationXMLString = """<relation>
-                                        <id>""" + newRelationID + """</id>
-                                        <type>TLINK</type>
-                                        <parentsType>TemporalRelations</parentsType>
-                                        <properties>
-                                        <Source>""" + source.id + """</Source>
-                                        <Type>""" + newRelationType + """</Type>
-                                        <Target>""" + target.id + """</Target>
-                                        </properties>
-                                        </relation>"""
-                    newRelationXML = ElementTree.fromstring(newRelationXMLString)
-                    newRelation = ThymeMLRelation(newRelationXML, data.annotations, documentContents)
-
-                    relationAlreadyExists = False
-                    for relation in tlinkRelations:
-                        if relation.properties["Source"].id == source.id and relation.properties["Target"].id == target.id and relation.properties["Type"] == newRelationType:
-                            relationAlreadyExists = True
-                            break
-                        
-                    if not relationAlreadyExists:
-                        # print "\tApplying temporal closure"
-
-                        # print "\t\tR1: " + relation1.properties["Source"].id + " " + relation1.properties["Type"] + " " + relation1.properties["Target"].id
-                        # print "\t\t    " + str(relation1.properties["Source"].spansContent) + " " + relation1.properties["Type"] + " " + str(relation1.properties["Target"].spansContent)
-                        # if "OriginalSource" in relation1.properties or "OriginalTarget" in relation1.properties:
-                        #     originalSource = relation1.properties["OriginalSource"] if "OriginalSource" in relation1.properties else relation1.properties["Source"]
-                        #     originalTarget = relation1.properties["OriginalTarget"] if "OriginalTarget" in relation1.properties else relation1.properties["Target"]
-                        #     print "\t\t    " + originalSource.id + " " + len(relation.properties["Type"])*" " + " " + originalTarget.id
-                        #     print "\t\t    " + str(originalSource.spansContent) + " " + relation1.properties["Type"] + " " + str(originalTarget.spansContent)
-
-                        # print "\t\tR2: " + relation2.properties["Source"].id + " " + relation2.properties["Type"] + " " + relation2.properties["Target"].id
-                        # print "\t\t    " + str(relation2.properties["Source"].spansContent) + " " + relation2.properties["Type"] + " " + str(relation2.properties["Target"].spansContent)
-                        # if "OriginalSource" in relation2.properties or "OriginalTarget" in relation2.properties:
-                        #     originalSource = relation2.properties["OriginalSource"] if "OriginalSource" in relation2.properties else relation2.properties["Source"]
-                        #     originalTarget = relation2.properties["OriginalTarget"] if "OriginalTarget" in relation2.properties else relation2.properties["Target"]
-                        #     print "\t\t    " + originalSource.id + " " + len(relation.properties["Type"])*" " + " " + originalTarget.id
-                        #     print "\t\t    " + str(originalSource.spansContent) + " " + relation2.properties["Type"] + " " + str(originalTarget.spansContent)
-
-                        # print "\t\tR3: " + newRelation.properties["Source"].id + " " + newRelation.properties["Type"] + " " + newRelation.properties["Target"].id
-                        # print "\t\t    " + str(newRelation.properties["Source"].spansContent) + " " + newRelation.properties["Type"] + " " + str(newRelation.properties["Target"].spansContent)
-                        # if "OriginalSource" in newRelation.properties or "OriginalTarget" in newRelation.properties:
-                        #     originalSource = newRelation.properties["OriginalSource"] if "OriginalSource" in newRelation.properties else newRelation.properties["Source"]
-                        #     originalTarget = newRelation.properties["OriginalTarget"] if "OriginalTarget" in newRelation.properties else newRelation.properties["Target"]
-                        #     print "\t\t    " + originalSource.id + " " + len(relation.properties["Type"])*" " + " " + originalTarget.id
-                        #     print "\t\t    " + str(originalSource.spansContent) + " " + relanewRelationtion2.properties["Type"] + " " + str(originalTarget.spansContent)
-
-                        foundImplicitRelation = True
-                        tlinkRelations.append(newRelation)
-                        implicitRelationCount += 1
-
-                # else: # There should be exactly 4 unique annotations (0 overlapping references)
-                    # print ""
-                    # print "\t\tRelations have nothing in common"
-
-                    # if len(uniqueReferences) is not 4:
-                        # print "\tERROR: There should always be 4 unique annotations when there is no relationship between the 2 relations. Found (" + str(len(uniqueReferences)) + ")"
-
-    print "\tCreated " + str(implicitRelationCount) + " new TLINK relations for a total of " + str(len(tlinkRelations))
+    # mergeCoreferentEventsInTemporalRelations(alinkRelations, coreferenceIndex)
+
+    instrumentation.stage("cycleCheck")
+    report.text(functools.partial(_renderDivider, 1))
+    report.text("Checking BEFORE/CONTAINS relations for cycles...")
+    cycles = TemporalCycleCheck(tlinkRelations, compiledDocument).run()
+    for cycle in cycles:
+        report.record("cycle", {"relations": [_relationFields(relation) for relation in cycle]},
+                      functools.partial(_renderCycle, cycle), ITEMS)
+    if len(cycles) == 0:
+        report.text("\tNone Found")
+
+    instrumentation.stage("closure")
+    report.text(functools.partial(_renderDivider, 1))
+    if runClosure:
+        report.text("Performing temporal closure...")
+
+        newRelationID = str(relationCount + 1) + "@" + documentName + "@gold"
+        annotatedRelationCount = len(tlinkRelations)
+        closure = closureEngine(tlinkRelations, data.annotations, documentContents, newRelationID)
+        (implicitRelationCount, conflictingRelationPairs) = closure.run()
+        instrumentation.count("closureRounds", closure.rounds)
+        instrumentation.count("pairsExamined", closure.pairsExamined)
+        instrumentation.count("derivedRelations", implicitRelationCount)
+
+        _count(report, "derivedRelations", implicitRelationCount, "\tCreated " + str(implicitRelationCount) + " new TLINK relations for a total of " + str(len(tlinkRelations)))
+
+        if exportPath is not None:
+            instrumentation.stage("export")
+            derivedRelations = tlinkRelations[annotatedRelationCount:]
+            data.to_file(exportPath, exportedAnnotations(data.annotations, derivedRelations, closure.derivations, closureEngine.__name__, documentName), indent="\t")
+            report.record("export", collections.OrderedDict([("path", exportPath), ("derivedRelations", len(derivedRelations))]),
+                          "\tWrote the document with the derived TLINK relations to " + exportPath)
+    else:
+        report.text("Skipping temporal closure, counting the cycles as conflicts")
+        conflictingRelationPairs = []
     
-    printSectionDivider(1)
-    print "Found (" + str(len(conflictingRelationPairs)) + ") conflicting relation(s)..."
+    instrumentation.stage("conflictReport")
+    report.text(functools.partial(_renderDivider, 1))
+    report.text("Found (" + str(len(conflictingRelationPairs)) + ") conflicting relation(s)...")
 
     temporalClosureConflictCount = 0
     identityCoreferenceResolutionConflictCount = 0
@@ -327,82 +212,193 @@ def processDocumentThymeMLData(xmlPath, documentName, documentContents):
 
         identityCoreferenceConflict = type(relation1.properties["Source"]) is ThymeMLRelation or type(relation2.properties["Target"]) is ThymeMLRelation 
         if identityCoreferenceConflict:
-            print "\tConflict (due to identity coreference chain):"
             identityCoreferenceResolutionConflictCount += 1
         else:
-            print "\tConflict (due to temporal closure):"
             temporalClosureConflictCount += 1
-        print "\t\tR1: " + relation1.properties["Source"].id + " " + relation1.properties["Type"] + " " + relation1.properties["Target"].id
-        print "\t\t\t" + str(relation1.properties["Source"].spansContent) + " " + relation1.properties["Type"] + " " + str(relation1.properties["Target"].spansContent)
-        if ("OriginalSource" in relation1.properties or "OriginalTarget" in relation1.properties):
-            originalSource = relation1.properties["OriginalSource"] if "OriginalSource" in relation1.properties else relation1.properties["Source"]
-            originalTarget = relation1.properties["OriginalTarget"] if "OriginalTarget" in relation1.properties else relation1.properties["Target"]
-            print "\t\t    " + originalSource.id + " " + len(relation.properties["Type"])*" " + " " + originalTarget.id
-            print "\t\t\t" + str(originalSource.spansContent) + " " + relation1.properties["Type"] + " " + str(originalTarget.spansContent)
-
-        print "\t\tR2: " + relation2.properties["Source"].id + " " + relation2.properties["Type"] + " " + relation2.properties["Target"].id
-        print "\t\t\t" + str(relation2.properties["Source"].spansContent) + " " + relation2.properties["Type"] + " " + str(relation2.properties["Target"].spansContent)
-        if ("OriginalSource" in relation2.properties or "OriginalTarget" in relation2.properties):
-            originalSource = relation2.properties["OriginalSource"] if "OriginalSource" in relation2.properties else relation2.properties["Source"]
-            originalTarget = relation2.properties["OriginalTarget"] if "OriginalTarget" in relation2.properties else relation2.properties["Target"]
-            print "\t\t    " + originalSource.id + " " + len(relation.properties["Type"])*" " + " " + originalTarget.id
-            print "\t\t\t" + str(originalSource.spansContent) + " " + relation2.properties["Type"] + " " + str(originalTarget.spansContent)
-
-    printSectionDivider(1)
+        report.record("conflict",
+                      {"cause": "identityCoreference" if identityCoreferenceConflict else "temporalClosure",
+                       "relations": [_relationFields(relation1), _relationFields(relation2)]},
+                      functools.partial(_renderConflict, relation1, relation2, identityCoreferenceConflict), ITEMS)
+
+    if not runClosure:
+        for cycle in cycles:
+            if any("OriginalSource" in relation.properties or "OriginalTarget" in relation.properties for relation in cycle):
+                identityCoreferenceResolutionConflictCount += 1
+            else:
+                temporalClosureConflictCount += 1
+
+    instrumentation.stage("selfReference")
+    report.text(functools.partial(_renderDivider, 1))
     selfReferentialRelations = []
-    print "Searching for self-referential temporal relations"
+    report.text("Searching for self-referential temporal relations")
     for relation in tlinkRelations:
         if relation.properties["Source"] is relation.properties["Target"]:
             selfReferentialRelations.append(relation)
-            print "\t\t R: " + relation.properties["Source"].id + " " + relation.properties["Type"] + " " + relation.properties["Target"].id
-            print "\t\t\t" + str(relation.properties["Source"].spansContent) + " " + relation.properties["Type"] + " " + str(relation.properties["Source"].spansContent)
-            if "OriginalSource" in relation.properties or "OriginalTarget" in relation.properties:
-                originalSource = relation.properties["OriginalSource"] if "OriginalSource" in relation.properties else relation.properties["Source"]
-                originalTarget = relation.properties["OriginalTarget"] if "OriginalTarget" in relation.properties else relation.properties["Target"]
-                print "\t\t    " + originalSource.id + " " + len(relation.properties["Type"])*" " + " " + originalTarget.id
-                print "\t\t\t" + str(originalSource.spansContent) + " " + relation.properties["Type"] + " " + str(originalTarget.spansContent)
+            report.record("selfReference", _relationFields(relation), functools.partial(_renderSelfReference, relation), ITEMS)
     if len(selfReferentialRelations) == 0:
-        print "\tNone Found"
+        report.text("\tNone Found")
     
     selfReferentialTemporalRelationCount = len(selfReferentialRelations)
-    totalConflictCount = temporalClosureConflictCount + identityCoreferenceResolutionConflictCount + selfReferentialTemporalRelationCount
+    instrumentation.end()
+    report.record("rootCauses",
+                  collections.OrderedDict([("temporalClosure", temporalClosureConflictCount),
+                                           ("identityCoreference", identityCoreferenceResolutionConflictCount),
+                                           ("selfReferential", selfReferentialTemporalRelationCount)]),
+                  functools.partial(printRootCauses, temporalClosureConflictCount, identityCoreferenceResolutionConflictCount, selfReferentialTemporalRelationCount))
 
-    printSectionDivider(1)
-    print "Root Causes of Temporal Inconsistencies"
-    print ""
-    if totalConflictCount > 0:
-        print "Temporal Closure\t\t\t\t\t" + str(temporalClosureConflictCount) + "/" + str(totalConflictCount) + "\t(" + str(100*temporalClosureConflictCount/totalConflictCount) + "%)"
-        print "Identity-Coreference Chain Resolution\t\t\t" + str(identityCoreferenceResolutionConflictCount + selfReferentialTemporalRelationCount) + "/" + str(totalConflictCount) + "\t(" + str(100*(identityCoreferenceResolutionConflictCount + selfReferentialTemporalRelationCount)/totalConflictCount) + "%)"
-        print "\tSelf-Referential Relations\t\t\t" + str(selfReferentialTemporalRelationCount) + "/" + str(totalConflictCount) + "\t|----(" + str(100*selfReferentialTemporalRelationCount/totalConflictCount) + "%)"
-        print "\tRelation Conflicts\t\t\t\t" + str(identityCoreferenceResolutionConflictCount) + "/" + str(totalConflictCount) + "\t|----(" + str(100*identityCoreferenceResolutionConflictCount/totalConflictCount) + "%)"
-    else:
-        print "No temporal inconsistencies found"
-    
     return (temporalClosureConflictCount, identityCoreferenceResolutionConflictCount, selfReferentialTemporalRelationCount)
 
-def mergeCoreferentEventsInTemporalRelations(temporalRelations, coreferenceChains):
+def mergeCoreferentEventsInTemporalRelations(temporalRelations, coreferenceIndex, mergeOverlappingChains=False):
+    """
+    :return int: number of Source/Target annotations replaced with their coreference chain
+    """
 
     replaced = 0
-    total = 0
 
     for temporalRelation in temporalRelations:
 
-        for coreferenceChain in coreferenceChains:
-
-            references = coreferenceChain.allReferences
-
-            # Source
-            if temporalRelation.properties["Source"] in references:
-                # print "Found TLINK relation with Source belonging to a coreference chain relation"
-                temporalRelation.properties["OriginalSource"] = temporalRelation.properties["Source"] 
-                temporalRelation.properties["Source"] = coreferenceChain
-                replaced += 1
+        # Source
+        coreferenceChain = coreferenceIndex.chainOf(temporalRelation.properties["Source"], "Identical", mergeOverlappingChains)
+        if coreferenceChain is not None:
+            # print "Found TLINK relation with Source belonging to a coreference chain relation"
+            temporalRelation.properties["OriginalSource"] = temporalRelation.properties["Source"]
+            temporalRelation.properties["Source"] = coreferenceChain
+            replaced += 1
+
+        # Target
+        coreferenceChain = coreferenceIndex.chainOf(temporalRelation.properties["Target"], "Identical", mergeOverlappingChains)
+        if coreferenceChain is not None:
+            # print "Found TLINK relation with Target belonging to a coreference chain relation"
+            temporalRelation.properties["OriginalTarget"] = temporalRelation.properties["Target"]
+            temporalRelation.properties["Target"] = coreferenceChain
+            replaced += 1
+
+    return replaced
+
+def exportedAnnotations(annotations, derivedRelations, derivations, engineName, documentName):
+    """
+    Generates the annotations of a document closed by a temporal closure engine, one element at a time (see
+    ThymeMLData.to_file).
+
+    The TLINKs merged with coreference chains are written with their original Source/Target. Derived TLINKs get an
+    id ending with @closure, and their provenance in their properties: <Derived> (the closure engine) and one
+    <DerivedFrom> per TLINK they were composed from, when the engine records it. Their Source/Target is the
+    coreference chain (Identical relation) of a merged annotation.
+
+    :param ThymeMLAnnotations annotations: the annotations of the document
+    :param list derivedRelations: the TLINK relations derived by the closure engine, in derivation order
+    :param dict derivations: id(derived relation) -> relations it was derived from, see the closure engines
+    :param str engineName: name of the closure engine, e.g. TemporalClosure
+    :return iterator: <entity> and <relation> elements
+    """
+    for annotation in annotations:
+        properties = annotation.properties
+        if "OriginalSource" not in properties and "OriginalTarget" not in properties:
+            yield annotation.xml
+            continue
+        annotationXML = copy.deepcopy(annotation.xml)
+        propertiesXML = annotationXML.find("properties")
+        for (name, originalName) in [("Source", "OriginalSource"), ("Target", "OriginalTarget")]:
+            originalXML = propertiesXML.find(originalName)
+            if originalXML is not None:
+                propertiesXML.find(name).text = originalXML.text
+                propertiesXML.remove(originalXML)
+        yield annotationXML
+
+    relationCount = annotations.count_class(ThymeMLRelation)
+    exportedIDs = {} # id(derived relation) -> id it is exported with
+    for (position, relation) in enumerate(derivedRelations):
+        relationID = str(relationCount + position + 1) + "@r@" + documentName + "@closure"
+        exportedIDs[id(relation)] = relationID
+
+        relationXML = ElementTree.Element("relation")
+        ElementTree.SubElement(relationXML, "id").text = relationID
+        ElementTree.SubElement(relationXML, "type").text = "TLINK"
+        ElementTree.SubElement(relationXML, "parentsType").text = "TemporalRelations"
+        propertiesXML = ElementTree.SubElement(relationXML, "properties")
+        ElementTree.SubElement(propertiesXML, "Source").text = relation.properties["Source"].id
+        ElementTree.SubElement(propertiesXML, "Type").text = relation.properties["Type"]
+        ElementTree.SubElement(propertiesXML, "Target").text = relation.properties["Target"].id
+        ElementTree.SubElement(propertiesXML, "Derived").text = engineName
+        for premise in derivations.get(id(relation), ()):
+            ElementTree.SubElement(propertiesXML, "DerivedFrom").text = exportedIDs.get(id(premise), premise.id)
+        yield relationXML
+
+def printRootCauses(temporalClosureConflictCount, identityCoreferenceResolutionConflictCount, selfReferentialTemporalRelationCount, out=None, verbosity=DETAIL):
 
-            # Target
-            if temporalRelation.properties["Target"] in references:
-                # print "Found TLINK relation with Target belonging to a coreference chain relation"
-                temporalRelation.properties["OriginalTarget"] = temporalRelation.properties["Target"]
-                temporalRelation.properties["Target"] = coreferenceChain
-                replaced += 1
+    totalConflictCount = temporalClosureConflictCount + identityCoreferenceResolutionConflictCount + selfReferentialTemporalRelationCount
 
-    print "\tTemporal Relation Components Replaced with Coreference Chains " + str(replaced) + "/" + str(len(temporalRelations)*2)
\ No newline at end of file
+    printSectionDivider(1, out)
+    print >> out, "Root Causes of Temporal Inconsistencies"
+    print >> out, ""
+    if totalConflictCount > 0:
+        print >> out, "Temporal Closure\t\t\t\t\t" + str(temporalClosureConflictCount) + "/" + str(totalConflictCount) + "\t(" + str(100*temporalClosureConflictCount/totalConflictCount) + "%)"
+        print >> out, "Identity-Coreference Chain Resolution\t\t\t" + str(identityCoreferenceResolutionConflictCount + selfReferentialTemporalRelationCount) + "/" + str(totalConflictCount) + "\t(" + str(100*(identityCoreferenceResolutionConflictCount + selfReferentialTemporalRelationCount)/totalConflictCount) + "%)"
+        print >> out, "\tSelf-Referential Relations\t\t\t" + str(selfReferentialTemporalRelationCount) + "/" + str(totalConflictCount) + "\t|----(" + str(100*selfReferentialTemporalRelationCount/totalConflictCount) + "%)"
+        print >> out, "\tRelation Conflicts\t\t\t\t" + str(identityCoreferenceResolutionConflictCount) + "/" + str(totalConflictCount) + "\t|----(" + str(100*identityCoreferenceResolutionConflictCount/totalConflictCount) + "%)"
+    else:
+        print >> out, "No temporal inconsistencies found"
+
+# Records of the report, see Report
+
+def _count(report, name, value, line):
+    report.record("count", collections.OrderedDict([("name", name), ("value", value)]), line)
+
+def _error(report, message):
+    report.record("error", {"message": message}, message)
+
+def _relationFields(relation):
+    fields = collections.OrderedDict([
+        ("id", relation.id),
+        ("source", relation.properties["Source"].id),
+        ("type", relation.properties["Type"]),
+        ("target", relation.properties["Target"].id)])
+    if "OriginalSource" in relation.properties:
+        fields["originalSource"] = relation.properties["OriginalSource"].id
+    if "OriginalTarget" in relation.properties:
+        fields["originalTarget"] = relation.properties["OriginalTarget"].id
+    return fields
+
+def _renderDivider(depth, out, verbosity):
+    printSectionDivider(depth, out)
+
+def _renderRelation(relation, indentation, out, verbosity):
+    print >> out, indentation + relation.properties["Source"].id + " " + relation.properties["Type"] + " " + relation.properties["Target"].id
+    if verbosity < DETAIL:
+        return
+    print >> out, "\t\t\t" + str(relation.properties["Source"].spansContent) + " " + relation.properties["Type"] + " " + str(relation.properties["Target"].spansContent)
+    if ("OriginalSource" in relation.properties or "OriginalTarget" in relation.properties):
+        originalSource = relation.properties["OriginalSource"] if "OriginalSource" in relation.properties else relation.properties["Source"]
+        originalTarget = relation.properties["OriginalTarget"] if "OriginalTarget" in relation.properties else relation.properties["Target"]
+        print >> out, "\t\t    " + originalSource.id + " " + len(relation.properties["Type"])*" " + " " + originalTarget.id
+        print >> out, "\t\t\t" + str(originalSource.spansContent) + " " + relation.properties["Type"] + " " + str(originalTarget.spansContent)
+
+def _renderCorefTypeMix(references, out, verbosity):
+    printSectionDivider(2, out)
+    print >> out, "\tCoreference chain with multiple types:"
+    for reference in references:
+        print >> out, "\t\t" + reference.type + ": " + (str(reference.spansContent) if verbosity >= DETAIL else reference.id)
+
+def _renderCycle(cycle, out, verbosity):
+    print >> out, "\tCycle (" + ", ".join(relation.id for relation in cycle) + "):"
+    for relation in cycle:
+        print >> out, "\t\tR: " + relation.properties["Source"].id + " " + relation.properties["Type"] + " " + relation.properties["Target"].id
+
+def _renderConflict(relation1, relation2, identityCoreferenceConflict, out, verbosity):
+    if identityCoreferenceConflict:
+        print >> out, "\tConflict (due to identity coreference chain):"
+    else:
+        print >> out, "\tConflict (due to temporal closure):"
+    _renderRelation(relation1, "\t\tR1: ", out, verbosity)
+    _renderRelation(relation2, "\t\tR2: ", out, verbosity)
+
+def _renderSelfReference(relation, out, verbosity):
+    print >> out, "\t\t R: " + relation.properties["Source"].id + " " + relation.properties["Type"] + " " + relation.properties["Target"].id
+    if verbosity < DETAIL:
+        return
+    print >> out, "\t\t\t" + str(relation.properties["Source"].spansContent) + " " + relation.properties["Type"] + " " + str(relation.properties["Source"].spansContent)
+    if "OriginalSource" in relation.properties or "OriginalTarget" in relation.properties:
+        originalSource = relation.properties["OriginalSource"] if "OriginalSource" in relation.properties else relation.properties["Source"]
+        originalTarget = relation.properties["OriginalTarget"] if "OriginalTarget" in relation.properties else relation.properties["Target"]
+        print >> out, "\t\t    " + originalSource.id + " " + len(relation.properties["Type"])*" " + " " + originalTarget.id
+        print >> out, "\t\t\t" + str(originalSource.spansContent) + " " + relation.properties["Type"] + " " + str(originalTarget.spansContent)
\ No newline at end of file
@@ -0,0 +1,116 @@
+import re
+import sys
+import mmap
+import array
+import bisect
+
+# Lead bytes of the UTF-8 sequences of non-ASCII characters
+_LEAD_BYTE = re.compile(b"[\xc0-\xff]")
+
+# Characters outside the BMP are two code units (a surrogate pair) of unicode strings on narrow Python builds
+_ASTRAL_CODE_UNITS = 2 if sys.maxunicode == 0xffff else 1
+
+def _extraBytes(leadByte):
+    """
+    :return int: bytes of the UTF-8 sequence starting with the lead byte, minus its code units in a unicode string
+    """
+    if leadByte < 0xe0:
+        return 1
+    elif leadByte < 0xf0:
+        return 2
+    return 4 - _ASTRAL_CODE_UNITS
+
+class DocumentText(object):
+    '''
+    Text of a UTF-8 document, memory mapped and decoded on demand.
+
+    Annotations only slice the document (see spansContent), so the text of a document is never decoded as a whole:
+    the file is mapped read-only, and a slice decodes the bytes of its characters. The pages of the mapped file
+    are shared by every process reading the same document (e.g. the workers of a batch run), and are released by
+    the operating system when memory is needed.
+
+    Character offsets are mapped to byte offsets with an index of the non-ASCII characters: the byte offset of a
+    character is its character offset plus the extra bytes of the non-ASCII characters before it. ASCII documents
+    have an empty index.
+    '''
+
+    def __init__(self, path, cacheSpans=True):
+        """
+        :param str path: path of the UTF-8 document
+        :param bool cacheSpans: keep the decoded text of every slice, for the annotations sharing spans
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # Empty files can't be mapped
+            self._map = b""
+        self._spanCache = {} if cacheSpans else None
+
+        self._characterOffsets = array.array("l") # character offset of every non-ASCII character
+        self._extraBytes = array.array("l") # extra bytes of the non-ASCII characters up to (and including) it
+        extraBytes = 0
+        for match in _LEAD_BYTE.finditer(self._map):
+            byteOffset = match.start()
+            self._characterOffsets.append(byteOffset - extraBytes)
+            extraBytes += _extraBytes(ord(self._map[byteOffset:byteOffset + 1]))
+            self._extraBytes.append(extraBytes)
+        self._length = len(self._map) - extraBytes
+
+    def _byteOffset(self, characterOffset):
+        position = bisect.bisect_left(self._characterOffsets, characterOffset)
+        return characterOffset + (self._extraBytes[position - 1] if position > 0 else 0)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, key):
+        """
+        :param key: a character offset, or a slice of character offsets (without step)
+        :return unicode: the decoded characters
+        """
+        if isinstance(key, slice):
+            (start, end, step) = key.indices(self._length)
+            if step != 1:
+                raise ValueError("slices of a document can't have a step")
+        else:
+            start = key + self._length if key < 0 else key
+            if not 0 <= start < self._length:
+                raise IndexError("document offset out of range")
+            end = start + 1
+        if end <= start:
+            return u""
+
+        if self._spanCache is not None:
+            text = self._spanCache.get((start, end))
+            if text is None:
+                text = self._spanCache[(start, end)] = self._map[self._byteOffset(start):self._byteOffset(end)].decode("utf-8")
+            return text
+        return self._map[self._byteOffset(start):self._byteOffset(end)].decode("utf-8")
+
+    def count(self, substring):
+        """
+        :param unicode substring: text to count (e.g. a line break)
+        :return int: number of non-overlapping occurrences of the text in the document, as unicode.count
+        """
+        encoded = substring.encode("utf-8")
+        if not encoded:
+            return self._length + 1
+        occurrences = 0
+        position = self._map.find(encoded)
+        while position >= 0:
+            occurrences += 1
+            position = self._map.find(encoded, position + len(encoded))
+        return occurrences
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+        self._spanCache = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
@@ -0,0 +1,299 @@
+import collections
+
+from thymeml import * # THYME-ML object model
+from TemporalClosure import newTemporalRelation
+
+'''
+Point-based reasoning over the start and end points of annotations, after Freksa's semi-intervals.
+
+Every annotation (EVENT, TIMEX3 or coreference chain) is split into a start point and an end point, with start < end.
+Every TLINK becomes a conjunction of point constraints:
+
+    x BEFORE y      end(x) < start(y)
+    x CONTAINS y    start(x) < start(y), end(y) < end(x)
+    x BEGINS-ON y   start(x) = end(y)
+    x ENDS-ON y     end(x) = start(y)
+    x OVERLAP y     start(x) < end(y), start(y) < end(x)
+
+OVERLAP is relaxed to "the intervals share a moment" (Freksa's "contemporary"), which also holds when one interval
+contains the other, so it never reports a conflict that Allen's OVERLAPS/OVERLAPPED-BY would not.
+'''
+
+# TLINK type -> point constraints ((interval, point), relation, (interval, point)), X being the Source and Y the Target
+(X, Y) = (0, 1)
+(START, END) = (0, 1)
+LESS = "<"
+EQUAL = "="
+
+POINT_CONSTRAINTS = {
+    "BEFORE": [((X, END), LESS, (Y, START))],
+    "CONTAINS": [((X, START), LESS, (Y, START)), ((Y, END), LESS, (X, END))],
+    "BEGINS-ON": [((X, START), EQUAL, (Y, END))],
+    "ENDS-ON": [((X, END), EQUAL, (Y, START))],
+    "OVERLAP": [((X, START), LESS, (Y, END)), ((Y, START), LESS, (X, END))],
+}
+
+class EndpointClosure(object):
+    '''
+    Temporal closure engine based on the graph of start and end points.
+
+    A conjunction of <, <= and = constraints between points is inconsistent exactly when a cycle of the point graph
+    contains a strict (<) edge, so one pass of Tarjan's strongly connected components algorithm decides consistency
+    in O(V + E). Points of the same component are equal. The components are then visited in reverse topological
+    order to collect, as bitsets, the components every component precedes (strictly or not), the longest-path
+    information from which the derived TLINKs are read.
+
+    Conflicts are reported as pairs of annotated TLINKs of a cycle with a strict edge, as in the other engines.
+    '''
+
+    def __init__(self, tlinkRelations, annotations, documentContents, newRelationID):
+        """
+        :param list tlinkRelations: TLINK relations to close; derived relations are appended to this list
+        :param ThymeMLAnnotations annotations: the annotations used to resolve the Source/Target of derived relations
+        :param unicode documentContents: text of the document
+        :param str newRelationID: id given to every derived relation
+        """
+        self.tlinkRelations = tlinkRelations
+        self.annotations = annotations
+        self.documentContents = documentContents
+        self.newRelationID = newRelationID
+
+        self.conflictingRelationPairs = []
+        self.implicitRelationCount = 0
+        self.rounds = 0 # passes over the point graph
+        self.pairsExamined = 0 # pairs of annotations checked for a derived relation
+        self.derivations = {} # Not tracked, derived relations follow from the whole constraint network
+
+        self._intervals = [] # index -> annotation (entity or coreference chain)
+        self._intervalIndex = {} # id(annotation) -> index
+        self._edges = [] # (point, point, strict, relation), the points of interval i are 2i (start) and 2i + 1 (end)
+        self._annotatedPairs = set() # (i, j) with i < j, intervals with a TLINK between them
+
+        for relation in self.tlinkRelations:
+            self._add(relation)
+
+    def run(self):
+        """
+        Checks the consistency of the point graph, and creates a TLINK for every unannotated pair of annotations
+        whose relation is entailed by the point constraints.
+
+        :return tuple: (implicit relation count, conflicting relation pairs)
+        """
+        self.rounds += 1
+        pointCount = 2 * len(self._intervals)
+        successors = [[] for _ in range(pointCount)]
+        for (edgeIndex, (u, v, strict, relation)) in enumerate(self._edges):
+            successors[u].append(edgeIndex)
+
+        (component, components) = self._stronglyConnectedComponents(successors)
+        inconsistent = self._reportConflicts(successors, component)
+
+        # Components are numbered in reverse topological order, so successors are complete before their predecessors
+        precedes = [0] * len(components) # component -> bitset of the components it precedes or equals (<=)
+        strictlyPrecedes = [0] * len(components) # component -> bitset of the components it strictly precedes (<)
+        for c in range(len(components)):
+            reach = 1 << c
+            strictReach = 0
+            for point in components[c]:
+                for edgeIndex in successors[point]:
+                    (_, v, strict, _) = self._edges[edgeIndex]
+                    d = component[v]
+                    if d == c:
+                        continue
+                    reach |= precedes[d]
+                    strictReach |= precedes[d] if strict else strictlyPrecedes[d]
+            precedes[c] = reach
+            strictlyPrecedes[c] = strictReach
+
+        self._derive(component, components, precedes, strictlyPrecedes, inconsistent)
+        return (self.implicitRelationCount, self.conflictingRelationPairs)
+
+    def _interval(self, annotation):
+        key = id(annotation)
+        if key not in self._intervalIndex:
+            index = len(self._intervals)
+            self._intervalIndex[key] = index
+            self._intervals.append(annotation)
+            self._edges.append((2 * index, 2 * index + 1, True, None)) # start < end
+        return self._intervalIndex[key]
+
+    def _add(self, relation):
+        constraints = POINT_CONSTRAINTS.get(relation.properties["Type"])
+        if constraints is None:
+            return
+        source = relation.properties["Source"]
+        target = relation.properties["Target"]
+        if source is target: # Self-referential relations are reported on their own
+            return
+
+        intervals = (self._interval(source), self._interval(target))
+        self._annotatedPairs.add((min(intervals), max(intervals)))
+        for ((uInterval, uPoint), pointRelation, (vInterval, vPoint)) in constraints:
+            (u, v) = (2 * intervals[uInterval] + uPoint, 2 * intervals[vInterval] + vPoint)
+            if pointRelation == LESS:
+                self._edges.append((u, v, True, relation))
+            else:
+                self._edges.append((u, v, False, relation))
+                self._edges.append((v, u, False, relation))
+
+    def _stronglyConnectedComponents(self, successors):
+        '''
+        Iterative Tarjan over the points.
+
+        :return tuple: (point -> component, component -> points), components in reverse topological order
+        '''
+        pointCount = len(successors)
+        index = [None] * pointCount
+        lowlink = [0] * pointCount
+        onStack = [False] * pointCount
+        component = [None] * pointCount
+        components = []
+        stack = []
+        counter = 0
+
+        for root in range(pointCount):
+            if index[root] is not None:
+                continue
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            onStack[root] = True
+            work = [(root, iter(successors[root]))]
+
+            while work:
+                (point, edges) = work[-1]
+                for edgeIndex in edges:
+                    successor = self._edges[edgeIndex][1]
+                    if index[successor] is None:
+                        index[successor] = lowlink[successor] = counter
+                        counter += 1
+                        stack.append(successor)
+                        onStack[successor] = True
+                        work.append((successor, iter(successors[successor])))
+                        break
+                    elif onStack[successor]:
+                        lowlink[point] = min(lowlink[point], index[successor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[point])
+                    if lowlink[point] == index[point]:
+                        members = []
+                        while True:
+                            member = stack.pop()
+                            onStack[member] = False
+                            component[member] = len(components)
+                            members.append(member)
+                            if member == point:
+                                break
+                        components.append(members)
+
+        return (component, components)
+
+    def _reportConflicts(self, successors, component):
+        '''
+        Reports, for every strict TLINK edge inside a component, the TLINKs of a cycle through that edge (unless the
+        TLINK was already part of a reported cycle). The start < end edges are only used for the components without
+        a strict TLINK edge, e.g. the cycles of BEGINS-ON/ENDS-ON relations.
+
+        :return set: the inconsistent components
+        '''
+        inconsistent = set()
+        reportedRelations = set()
+        reportedPairs = set()
+        for (u, v, strict, relation) in sorted(self._edges, key=lambda edge: edge[3] is None): # TLINK edges first
+            if not strict or component[u] != component[v]:
+                continue
+            if relation is None and component[u] in inconsistent:
+                continue
+            inconsistent.add(component[u])
+            if relation is not None and id(relation) in reportedRelations:
+                continue
+
+            relations = [relation] + self._path(successors, component, v, u)
+            cycle = []
+            for cycleRelation in relations:
+                if cycleRelation is not None and all(cycleRelation is not other for other in cycle):
+                    cycle.append(cycleRelation)
+            reportedRelations.update(id(cycleRelation) for cycleRelation in cycle)
+            if len(cycle) < 2:
+                continue
+            pair = (cycle[0], cycle[1])
+            if (id(pair[0]), id(pair[1])) not in reportedPairs:
+                reportedPairs.add((id(pair[0]), id(pair[1])))
+                self.conflictingRelationPairs.append(pair)
+        return inconsistent
+
+    def _path(self, successors, component, start, goal):
+        '''
+        :return list: the relations (None for start < end edges) of a shortest path from start to goal within the
+            component of start
+        '''
+        previous = {start: None}
+        queue = collections.deque([start])
+        while queue:
+            point = queue.popleft()
+            if point == goal:
+                break
+            for edgeIndex in successors[point]:
+                successor = self._edges[edgeIndex][1]
+                if successor not in previous and component[successor] == component[start]:
+                    previous[successor] = edgeIndex
+                    queue.append(successor)
+
+        relations = []
+        point = goal
+        while previous.get(point) is not None:
+            (u, _, _, relation) = self._edges[previous[point]]
+            relations.append(relation)
+            point = u
+        relations.reverse()
+        return relations
+
+    def _derive(self, component, components, precedes, strictlyPrecedes, inconsistent):
+        # Annotations whose points are in a component: only they can be related to the points a point precedes
+        intervalsByComponent = collections.defaultdict(list)
+        for point in range(len(component)):
+            intervalsByComponent[component[point]].append(point // 2)
+
+        def before(p, q): # point p < point q
+            return strictlyPrecedes[component[p]] >> component[q] & 1
+        def equal(p, q):
+            return component[p] == component[q]
+
+        for i in range(len(self._intervals)):
+            (si, ei) = (2 * i, 2 * i + 1)
+            if component[si] in inconsistent or component[ei] in inconsistent:
+                continue
+            candidates = set()
+            reach = precedes[component[si]] | precedes[component[ei]]
+            while reach:
+                lowest = reach & -reach
+                candidates.update(intervalsByComponent.get(lowest.bit_length() - 1, ()))
+                reach ^= lowest
+
+            for j in sorted(candidates):
+                if j == i or (min(i, j), max(i, j)) in self._annotatedPairs:
+                    continue
+                (sj, ej) = (2 * j, 2 * j + 1)
+                if component[sj] in inconsistent or component[ej] in inconsistent:
+                    continue
+                self.pairsExamined += 1
+
+                # Every entailed relation of (i, j) is found from i or from j, derive it only once
+                if before(ei, sj):
+                    relationType = "BEFORE"
+                elif before(si, sj) and before(ej, ei):
+                    relationType = "CONTAINS"
+                elif equal(ei, sj):
+                    relationType = "ENDS-ON"
+                elif equal(si, ej):
+                    relationType = "BEGINS-ON"
+                elif before(si, sj) and before(sj, ei) and before(ei, ej):
+                    relationType = "OVERLAP"
+                else:
+                    continue
+                self._annotatedPairs.add((min(i, j), max(i, j)))
+                self.tlinkRelations.append(newTemporalRelation(self.newRelationID, self._intervals[i], relationType, self._intervals[j], self.annotations, self.documentContents))
+                self.implicitRelationCount += 1
@@ -0,0 +1,87 @@
+import os
+import time
+import collections
+
+def _cpuTime():
+    (user, system) = os.times()[:2]
+    return user + system
+
+class Instrumentation(object):
+    '''
+    Wall and CPU time per stage, and counters, of the check of a document.
+
+    Stages are laps: starting a stage ends the one before it, so the stages of processDocumentThymeMLData can be
+    marked without restructuring it. A disabled instance ignores every call, so the instrumentation can stay in
+    place in production runs.
+    '''
+
+    def __init__(self, enabled=True):
+        """
+        :param bool enabled: False ignores every call (see NO_INSTRUMENTATION)
+        """
+        self.enabled = enabled
+        self.stages = collections.OrderedDict() # stage -> [wall time, CPU time] in seconds
+        self.counters = collections.OrderedDict() # counter -> value
+        self._stage = None
+        self._wallStart = 0.0
+        self._cpuStart = 0.0
+
+    def stage(self, name):
+        """
+        Ends the current stage (if any) and starts the stage with the given name. Time spent in a stage that is
+        started several times is summed.
+
+        :param str name: name of the stage, e.g. load
+        """
+        if not self.enabled:
+            return
+        (wall, cpu) = (time.time(), _cpuTime())
+        if self._stage is not None:
+            times = self.stages.setdefault(self._stage, [0.0, 0.0])
+            times[0] += wall - self._wallStart
+            times[1] += cpu - self._cpuStart
+        (self._stage, self._wallStart, self._cpuStart) = (name, wall, cpu)
+
+    def end(self):
+        """
+        Ends the current stage.
+        """
+        if self.enabled and self._stage is not None:
+            self.stage(None)
+
+    def count(self, name, value=1):
+        """
+        :param str name: name of the counter, e.g. closureRounds
+        :param int value: amount added to the counter
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self):
+        """
+        :return dict: {"stages": {stage: {"wall": seconds, "cpu": seconds}}, "counters": {counter: value}}, or None
+            when disabled
+        """
+        if not self.enabled:
+            return None
+        self.end()
+        return {
+            "stages": collections.OrderedDict((name, {"wall": wall, "cpu": cpu}) for (name, (wall, cpu)) in self.stages.items()),
+            "counters": collections.OrderedDict(self.counters),
+        }
+
+    def add(self, record):
+        """
+        Sums the stages and counters of a record (see record) into this instance.
+        """
+        if not self.enabled or record is None:
+            return
+        for (name, times) in record["stages"].items():
+            total = self.stages.setdefault(name, [0.0, 0.0])
+            total[0] += times["wall"]
+            total[1] += times["cpu"]
+        for (name, value) in record["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+# Shared disabled instance, the default of processDocumentThymeMLData
+NO_INSTRUMENTATION = Instrumentation(enabled=False)
@@ -0,0 +1,281 @@
+import collections
+
+from thymeml import * # THYME-ML object model
+from TemporalClosure import newTemporalRelation
+
+'''
+Allen's interval algebra with bitmask-encoded relations.
+
+Every constraint between two intervals is a disjunction of Allen's 13 basic relations, stored as a 13 bit mask.
+The basic relations are ordered so that the inverse of bit i is bit 12 - i.
+'''
+
+ALLEN_RELATIONS = ["BEFORE", "MEETS", "OVERLAPS", "STARTS", "DURING", "FINISHES", "EQUALS",
+                   "FINISHED-BY", "CONTAINS", "STARTED-BY", "OVERLAPPED-BY", "MET-BY", "AFTER"]
+
+(BEFORE, MEETS, OVERLAPS, STARTS, DURING, FINISHES, EQUALS,
+ FINISHED_BY, CONTAINS, STARTED_BY, OVERLAPPED_BY, MET_BY, AFTER) = [1 << i for i in range(len(ALLEN_RELATIONS))]
+
+ALL = (1 << len(ALLEN_RELATIONS)) - 1
+
+# THYME Annotation Guidelines only support 5 temporal relation TLINK types,
+# and merge Allen's "Overlaps" and "Overlapped-By" into the single type "OVERLAP"
+THYME_TO_ALLEN = collections.OrderedDict([
+    ("BEFORE", BEFORE),
+    ("CONTAINS", CONTAINS),
+    ("OVERLAP", OVERLAPS | OVERLAPPED_BY),
+    ("BEGINS-ON", MET_BY),
+    ("ENDS-ON", MEETS),
+])
+
+def _basicRelation(x, y):
+    (xStart, xEnd) = x
+    (yStart, yEnd) = y
+    if xEnd < yStart:
+        return BEFORE
+    elif xEnd == yStart:
+        return MEETS
+    elif yEnd < xStart:
+        return AFTER
+    elif yEnd == xStart:
+        return MET_BY
+    elif xStart == yStart and xEnd == yEnd:
+        return EQUALS
+    elif xStart == yStart:
+        return STARTS if xEnd < yEnd else STARTED_BY
+    elif xEnd == yEnd:
+        return FINISHES if xStart > yStart else FINISHED_BY
+    elif xStart > yStart and xEnd < yEnd:
+        return DURING
+    elif xStart < yStart and xEnd > yEnd:
+        return CONTAINS
+    elif xStart < yStart:
+        return OVERLAPS
+    return OVERLAPPED_BY
+
+def _compositionTable():
+    # Three intervals have at most 6 distinct endpoints, so enumerating intervals over 6 points realizes every
+    # combination of basic relations
+    intervals = [(start, end) for start in range(6) for end in range(start + 1, 6)]
+    table = dict(((r1, r2), 0) for r1 in range(len(ALLEN_RELATIONS)) for r2 in range(len(ALLEN_RELATIONS)))
+    for x in intervals:
+        for y in intervals:
+            r1 = _basicRelation(x, y).bit_length() - 1
+            for z in intervals:
+                r2 = _basicRelation(y, z).bit_length() - 1
+                table[(r1, r2)] |= _basicRelation(x, z)
+    return [[table[(r1, r2)] for r2 in range(len(ALLEN_RELATIONS))] for r1 in range(len(ALLEN_RELATIONS))]
+
+# COMPOSITION_TABLE[r1][r2] is the mask of x ? z given the basic relations x r1 y and y r2 z
+COMPOSITION_TABLE = _compositionTable()
+
+_INVERSES = [sum(1 << (len(ALLEN_RELATIONS) - 1 - i) for i in range(len(ALLEN_RELATIONS)) if mask & (1 << i))
+             for mask in range(ALL + 1)]
+
+_compositions = {}
+
+def inverse(mask):
+    """
+    :param int mask: relations of x to y
+    :return int: relations of y to x
+    """
+    return _INVERSES[mask]
+
+def compose(mask1, mask2):
+    """
+    :param int mask1: relations of x to y
+    :param int mask2: relations of y to z
+    :return int: relations of x to z
+    """
+    key = (mask1, mask2)
+    if key not in _compositions:
+        result = 0
+        for r1 in range(len(ALLEN_RELATIONS)):
+            if mask1 & (1 << r1):
+                for r2 in range(len(ALLEN_RELATIONS)):
+                    if mask2 & (1 << r2):
+                        result |= COMPOSITION_TABLE[r1][r2]
+                        if result == ALL:
+                            break
+        _compositions[key] = result
+    return _compositions[key]
+
+def toThymeType(mask):
+    """
+    :param int mask: relations of x to y
+    :return tuple: (THYME TLINK type, reversed) such that x TYPE y (or y TYPE x when reversed) holds,
+        or None when the mask can not be expressed as a THYME TLINK
+    """
+    if mask == 0:
+        return None
+    for (thymeType, thymeMask) in THYME_TO_ALLEN.items():
+        if mask & thymeMask == mask:
+            return (thymeType, False)
+        if mask & inverse(thymeMask) == mask:
+            return (thymeType, True)
+    return None
+
+class AllenClosure(object):
+    '''
+    Temporal closure engine based on path consistency (PC-2) over Allen's interval algebra.
+
+    Every TLINK is mapped into the algebra and added to the network in turn, and the network is propagated with a
+    queue of revised edges before the next TLINK is added. The refined edges are then mapped back to THYME TLINKs.
+    Unlike TemporalClosure, OVERLAP takes part in the reasoning.
+
+    A TLINK whose propagation empties the constraint of an edge is inconsistent with the TLINKs added before it: it
+    is reported once, paired with the earlier annotated TLINK that the emptied constraint came from, and its
+    revisions are rolled back, so the network stays consistent and the derived TLINKs only follow from the TLINKs
+    that were kept.
+    '''
+
+    def __init__(self, tlinkRelations, annotations, documentContents, newRelationID):
+        """
+        :param list tlinkRelations: TLINK relations to close; derived relations are appended to this list
+        :param ThymeMLAnnotations annotations: the annotations used to resolve the Source/Target of derived relations
+        :param unicode documentContents: text of the document
+        :param str newRelationID: id given to every derived relation
+        """
+        self.tlinkRelations = tlinkRelations
+        self.annotations = annotations
+        self.documentContents = documentContents
+        self.newRelationID = newRelationID
+
+        self.conflictingRelationPairs = []
+        self.implicitRelationCount = 0
+        self.rounds = 0 # revised edges taken from the queue
+        self.pairsExamined = 0 # (edge, neighbor) paths composed
+        self.derivations = {} # Not tracked, derived relations follow from the whole constraint network
+
+        self._nodes = [] # index -> annotation (entity or coreference chain)
+        self._nodeIndex = {} # id(annotation) -> index
+        self._constraints = {} # (i, j) -> mask of i to j, stored in both directions
+        self._reasons = {} # (i, j) -> annotated TLINK the constraint of (i, j) is blamed on, stored in both directions
+        self._neighbors = collections.defaultdict(set) # i -> nodes j with a constraint other than ALL
+        self._annotatedEdges = set() # (i, j) with i < j, annotations with a TLINK between them
+        self._revisions = [] # ((i, j), previous mask, previous reason) of the TLINK being added, to roll it back
+        self._queue = collections.deque()
+        self._queued = set()
+
+    def run(self):
+        """
+        Adds the TLINKs to the network one at a time, and creates a TLINK for every unannotated pair of annotations
+        whose inferred relation can be expressed as a THYME TLINK.
+
+        :return tuple: (implicit relation count, conflicting relation pairs)
+        """
+        for relation in list(self.tlinkRelations):
+            self._add(relation)
+
+        for (i, j) in sorted(self._constraints):
+            if i > j or (i, j) in self._annotatedEdges:
+                continue
+            thymeType = toThymeType(self._constraints[(i, j)])
+            if thymeType is None:
+                continue
+            (relationType, isReversed) = thymeType
+            (source, target) = (self._nodes[j], self._nodes[i]) if isReversed else (self._nodes[i], self._nodes[j])
+            self.tlinkRelations.append(newTemporalRelation(self.newRelationID, source, relationType, target, self.annotations, self.documentContents))
+            self.implicitRelationCount += 1
+
+        return (self.implicitRelationCount, self.conflictingRelationPairs)
+
+    def _node(self, annotation):
+        key = id(annotation)
+        if key not in self._nodeIndex:
+            self._nodeIndex[key] = len(self._nodes)
+            self._nodes.append(annotation)
+        return self._nodeIndex[key]
+
+    def _add(self, relation):
+        relationType = relation.properties["Type"]
+        if relationType not in THYME_TO_ALLEN:
+            return
+        source = relation.properties["Source"]
+        target = relation.properties["Target"]
+        if source is target: # Self-referential relations are reported on their own
+            return
+
+        (i, j) = (self._node(source), self._node(target))
+        self._annotatedEdges.add((min(i, j), max(i, j)))
+        self._revisions = []
+        conflictingRelation = self._revise(i, j, THYME_TO_ALLEN[relationType], relation, relation)
+        while conflictingRelation is None and self._queue:
+            conflictingRelation = self._propagate(relation)
+
+        if conflictingRelation is not None:
+            self._rollback()
+            self.conflictingRelationPairs.append((conflictingRelation, relation))
+
+    def _propagate(self, relation):
+        """
+        Composes the next revised edge of the queue with the edges of its nodes.
+
+        :return ThymeMLRelation: the TLINK the relation being added conflicts with, or None
+        """
+        (i, j) = self._queue.popleft()
+        self._queued.discard((i, j))
+        mask = self._constraints[(i, j)]
+        self.rounds += 1
+        self.pairsExamined += len(self._neighbors[i]) + len(self._neighbors[j]) - 2 # Every neighbor but i and j
+
+        for k in list(self._neighbors[j]):
+            if k != i:
+                reason = self._blame(relation, (i, j), (j, k))
+                conflictingRelation = self._revise(i, k, compose(mask, self._constraints[(j, k)]), reason, relation)
+                if conflictingRelation is not None:
+                    return conflictingRelation
+        for k in list(self._neighbors[i]):
+            if k != j:
+                reason = self._blame(relation, (k, i), (i, j))
+                conflictingRelation = self._revise(k, j, compose(self._constraints[(k, i)], mask), reason, relation)
+                if conflictingRelation is not None:
+                    return conflictingRelation
+        return None
+
+    def _blame(self, relation, edge1, edge2):
+        # A composed constraint is blamed on an earlier TLINK of its path, if any
+        reason = self._reasons[edge1]
+        return reason if reason is not relation else self._reasons[edge2]
+
+    def _revise(self, i, j, mask, reason, relation):
+        """
+        Refines the constraint of (i, j) with the mask.
+
+        :param ThymeMLRelation reason: the annotated TLINK the refinement is blamed on
+        :param ThymeMLRelation relation: the TLINK being added
+        :return ThymeMLRelation: the TLINK the relation being added conflicts with if the constraint became empty,
+            or None
+        """
+        current = self._constraints.get((i, j), ALL)
+        refined = current & mask
+        if refined == current:
+            return None
+        if refined == 0:
+            previousReason = self._reasons[(i, j)]
+            return previousReason if previousReason is not relation else reason
+
+        self._revisions.append(((i, j), current, self._reasons.get((i, j))))
+        self._constraints[(i, j)] = refined
+        self._constraints[(j, i)] = inverse(refined)
+        self._reasons[(i, j)] = self._reasons[(j, i)] = reason
+        self._neighbors[i].add(j)
+        self._neighbors[j].add(i)
+        if (i, j) not in self._queued and (j, i) not in self._queued:
+            self._queued.add((i, j))
+            self._queue.append((i, j))
+        return None
+
+    def _rollback(self):
+        self._queue.clear()
+        self._queued.clear()
+        for ((i, j), mask, reason) in reversed(self._revisions):
+            if mask == ALL:
+                del self._constraints[(i, j)], self._constraints[(j, i)], self._reasons[(i, j)], self._reasons[(j, i)]
+                self._neighbors[i].discard(j)
+                self._neighbors[j].discard(i)
+            else:
+                self._constraints[(i, j)] = mask
+                self._constraints[(j, i)] = inverse(mask)
+                self._reasons[(i, j)] = self._reasons[(j, i)] = reason
+        self._revisions = []
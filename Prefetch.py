@@ -0,0 +1,114 @@
+import sys
+import threading
+import collections
+import Queue
+
+class _Pending(object):
+    '''
+    An item of a Prefetcher, loaded by one of its threads.
+    '''
+    __slots__ = ("item", "loaded", "error", "done")
+
+    def __init__(self, item):
+        self.item = item
+        self.loaded = None
+        self.error = None # sys.exc_info() of the load, re-raised when the item is reached
+        self.done = threading.Event()
+
+class Prefetcher(object):
+    '''
+    Loads the upcoming items of a sequence on background threads while the current one is being used, e.g. reads and
+    parses the next documents of the corpus while a document is checked.
+
+    At most `depth` items are loaded ahead of the item being used, so memory holds at most depth + 1 loaded items.
+    Items come back in the order of the sequence, whatever order their loads finish in. An exception raised by a load
+    is raised again when its item is reached, so errors surface at the same item as with a sequential loop.
+
+    Reading files releases the interpreter lock, so the loads overlap the work of the main thread even though
+    parsing itself does not run in parallel with it.
+    '''
+
+    def __init__(self, load, items, depth=2, threadCount=None, discard=None):
+        """
+        :param load: called with an item (on a background thread), returns the loaded item
+        :param iterable items: the items to load, in order
+        :param int depth: number of items loaded ahead (0 loads every item when it is reached, without threads)
+        :param int threadCount: number of loading threads (defaults to depth)
+        :param discard: called with the loaded items that are never used, when the iteration stops early (e.g. to
+            close their files)
+        """
+        self.load = load
+        self.depth = depth
+        self.discard = discard
+        self._items = iter(items)
+        self._pending = collections.deque() # _Pending items, in order, being loaded or loaded
+        self._queue = Queue.Queue() # _Pending items to load, None stops a thread
+        self._threads = []
+        self._closed = False
+        if depth > 0:
+            for _ in range(threadCount or depth):
+                thread = threading.Thread(target=self._run, name="Prefetcher")
+                thread.daemon = True # Never keeps an interrupted run alive
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            pending = self._queue.get()
+            if pending is None:
+                return
+            try:
+                pending.loaded = self.load(pending.item)
+            except BaseException:
+                pending.error = sys.exc_info()
+            pending.done.set()
+
+    def _submit(self):
+        # Queues the next item, returns False when there is none left
+        for item in self._items:
+            pending = _Pending(item)
+            self._pending.append(pending)
+            self._queue.put(pending)
+            return True
+        return False
+
+    def __iter__(self):
+        """
+        :return iterator: (item, loaded item) pairs, in the order of the items
+        """
+        try:
+            if self.depth <= 0:
+                for item in self._items:
+                    yield (item, self.load(item))
+                return
+
+            while len(self._pending) <= self.depth and self._submit():
+                pass
+            while self._pending:
+                pending = self._pending[0]
+                while not pending.done.wait(0.1): # A timeout keeps the wait interruptible (Ctrl+C)
+                    pass
+                self._pending.popleft()
+                if pending.error is not None:
+                    raise pending.error[0], pending.error[1], pending.error[2]
+                yield (pending.item, pending.loaded)
+                self._submit() # Once the item is used, so that only depth items are loaded ahead of it
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stops the threads, and discards the items loaded but not used.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        while self._pending:
+            pending = self._pending.popleft()
+            pending.done.wait()
+            if pending.error is None and self.discard is not None:
+                self.discard(pending.loaded)
+        for thread in self._threads:
+            thread.join() # Still running at interpreter shutdown, a thread fails in Queue.get
@@ -0,0 +1,85 @@
+import sys
+import json
+import collections
+from StringIO import StringIO
+
+# Verbosity levels, every record is rendered at its level and above
+SUMMARY = 0 # sections, counts and root causes
+ITEMS = 1 # one entry per conflict, cycle, self-referential relation, ... with the ids of the annotations
+DETAIL = 2 # the text of the annotations, and the original annotations of merged coreference chains
+
+VERBOSITY_LEVELS = collections.OrderedDict([("summary", SUMMARY), ("items", ITEMS), ("detail", DETAIL)])
+
+class Report(object):
+    '''
+    Records of the check of a document, rendered once the check is done.
+
+    A record has a kind (e.g. count, conflict), JSON-ready fields (ids, types and counts), a verbosity level, and
+    a renderer for the text report. Renderers are only called for the records that are actually rendered, so the
+    expensive parts of the text report (e.g. the text of the annotations of every conflict) are skipped at lower
+    verbosity levels, and never computed for JSON Lines. Text-only records (sections, dividers) have no kind and
+    are not part of the JSON Lines.
+    '''
+
+    def __init__(self, documentName):
+        """
+        :param str documentName: name of the document, e.g. ID001_clinic_001
+        """
+        self.documentName = documentName
+        self._records = [] # (verbosity, kind, fields, text line or renderer)
+
+    def text(self, line, verbosity=SUMMARY):
+        """
+        :param line: a line of the text report, or a renderer called with (out, verbosity)
+        """
+        self._records.append((verbosity, None, None, line))
+
+    def record(self, kind, fields, render, verbosity=SUMMARY):
+        """
+        :param str kind: kind of the record, e.g. conflict
+        :param dict fields: JSON-ready fields of the record
+        :param render: the line of the text report, a renderer called with (out, verbosity), or None
+        :param int verbosity: lowest verbosity level the record is rendered at
+        """
+        self._records.append((verbosity, kind, fields, render))
+
+    def records(self, kind=None):
+        """
+        :param str kind: only return records of this kind
+        :return list: the fields of the records (of that kind)
+        """
+        return [fields for (_, recordKind, fields, _) in self._records
+                if recordKind is not None and (kind is None or recordKind == kind)]
+
+    def writeText(self, out, verbosity=DETAIL):
+        """
+        Renders the text report in memory, and writes it to out at once.
+
+        :param out: file to write to (None writes to stdout)
+        :param int verbosity: see VERBOSITY_LEVELS
+        """
+        buffer = StringIO()
+        for (recordVerbosity, _, _, render) in self._records:
+            if recordVerbosity > verbosity:
+                continue
+            if callable(render):
+                render(buffer, verbosity)
+            elif render is not None: # Records without a line are only part of the JSON Lines
+                print >> buffer, render
+        (out if out is not None else sys.stdout).write(buffer.getvalue())
+
+    def writeJSONLines(self, out, verbosity=DETAIL):
+        """
+        Writes one JSON object per record: {"document": ..., "kind": ..., <fields>}
+
+        :param out: file to write to
+        :param int verbosity: see VERBOSITY_LEVELS
+        """
+        lines = []
+        for (recordVerbosity, kind, fields, _) in self._records:
+            if kind is None or recordVerbosity > verbosity:
+                continue
+            record = collections.OrderedDict([("document", self.documentName), ("kind", kind)])
+            record.update(fields)
+            lines.append(json.dumps(record) + "\n")
+        out.write("".join(lines))
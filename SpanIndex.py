@@ -0,0 +1,132 @@
+from thymeml import * # THYME-ML object model
+
+class SpanIndex(object):
+    '''
+    Static interval index over the character spans of the entities of a document.
+
+    Spans are kept in arrays sorted by start offset, and the arrays are read as an implicit balanced binary tree
+    (the middle of every range is the root of that range) in which every node also stores the largest end offset
+    of its subtree. A query only descends into the subtrees that can still hold an overlapping span, so point,
+    range and overlap queries cost O(log n) per span found instead of a scan over every entity.
+
+    Spans are half-open ranges [start, end) of character offsets, as in ThymeMLEntity.spans. Entities with
+    discontinuous spans are indexed once per span, and returned once per query. The index is not updated when
+    annotations are added or their spans rewritten: build a new one.
+    '''
+
+    def __init__(self, entities):
+        """
+        :param iterable entities: the entities to index, e.g. data.annotations.select_class(ThymeMLEntity)
+        """
+        entries = []
+        for (position, entity) in enumerate(entities):
+            for span in entity.spans:
+                if len(span) == 2:
+                    entries.append((span[0], span[1], position, entity))
+        entries.sort(key=lambda entry: (entry[0], entry[1], entry[2]))
+
+        self._starts = [entry[0] for entry in entries]
+        self._ends = [entry[1] for entry in entries]
+        self._positions = [entry[2] for entry in entries]
+        self._entities = [entry[3] for entry in entries]
+        self._maxEnds = list(self._ends)
+        self._buildMaxEnds(0, len(entries))
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _buildMaxEnds(self, lo, hi):
+        if lo >= hi:
+            return -1
+        mid = (lo + hi) // 2
+        self._maxEnds[mid] = max(self._ends[mid], self._buildMaxEnds(lo, mid), self._buildMaxEnds(mid + 1, hi))
+        return self._maxEnds[mid]
+
+    def _search(self, start, end):
+        '''
+        :return list: indexes of the spans overlapping [start, end), in increasing order
+        '''
+        found = []
+        ranges = [(0, len(self._starts))]
+        while ranges:
+            (lo, hi) = ranges.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self._maxEnds[mid] <= start: # Every span of this subtree ends before the query
+                continue
+            ranges.append((lo, mid))
+            if self._starts[mid] < end: # Otherwise mid and every span right of it start after the query
+                if self._ends[mid] > start:
+                    found.append(mid)
+                ranges.append((mid + 1, hi))
+        found.sort()
+        return found
+
+    def _unique(self, indexes, exclude=None):
+        entities = []
+        seen = set()
+        for index in indexes:
+            entity = self._entities[index]
+            if entity is not exclude and id(entity) not in seen:
+                seen.add(id(entity))
+                entities.append(entity)
+        return entities
+
+    def covering(self, offset):
+        """
+        :param int offset: a character offset in the document
+        :return list: the entities with a span containing the offset, ordered by span start
+        """
+        return self._unique(self._search(offset, offset + 1))
+
+    def overlapping(self, start, end):
+        """
+        :param int start: start of the character range
+        :param int end: end of the character range (excluded)
+        :return list: the entities with a span sharing at least one character with the range, ordered by span start
+        """
+        return self._unique(self._search(start, end))
+
+    def within(self, start, end):
+        """
+        :param int start: start of the character range
+        :param int end: end of the character range (excluded)
+        :return list: the entities with a span inside the range, ordered by span start
+        """
+        return self._unique(index for index in self._search(start, end)
+                            if self._starts[index] >= start and self._ends[index] <= end)
+
+    def overlappingEntities(self, entity, entityType=None):
+        """
+        :param ThymeMLEntity entity: an entity (indexed or not)
+        :param str entityType: only return entities of this type, e.g. EVENT
+        :return list: the other entities with a span overlapping one of the spans of the entity
+        """
+        indexes = set()
+        for span in entity.spans:
+            if len(span) == 2:
+                indexes.update(self._search(span[0], span[1]))
+        return [other for other in self._unique(sorted(indexes), exclude=entity)
+                if entityType is None or other.type == entityType]
+
+    def overlappingPairs(self, entityType=None):
+        """
+        :param str entityType: only consider entities of this type, e.g. EVENT
+        :return list: (entity, other entity) for every pair of distinct entities with overlapping spans, each pair
+            once, in the order of the entities given to the index
+        """
+        pairs = {} # (position, other position) -> (entity, other entity)
+        for index in range(len(self._starts)):
+            entity = self._entities[index]
+            if entityType is not None and entity.type != entityType:
+                continue
+            for otherIndex in self._search(self._starts[index], self._ends[index]):
+                other = self._entities[otherIndex]
+                if other is entity or (entityType is not None and other.type != entityType):
+                    continue
+                if self._positions[index] < self._positions[otherIndex]:
+                    pairs[(self._positions[index], self._positions[otherIndex])] = (entity, other)
+                else:
+                    pairs[(self._positions[otherIndex], self._positions[index])] = (other, entity)
+        return [pairs[key] for key in sorted(pairs)]
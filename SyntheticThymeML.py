@@ -0,0 +1,177 @@
+import os
+import random
+import itertools
+import argparse
+import codecs
+from xml.sax.saxutils import escape
+
+'''
+Generator of synthetic THYME documents (source text and ThymeML XML) with tunable sizes, for benchmarks.
+
+Every EVENT and TIMEX3 gets a random interval on a hidden timeline, and TLINKs are derived from the intervals, so the
+generated TLINKs are consistent except for the ones deliberately flipped at the conflict rate. The members of an
+Identical coreference chain share the same interval, so merging them does not introduce conflicts either.
+'''
+
+WORDS = ["patient", "reports", "pain", "colonoscopy", "biopsy", "tumor", "resection", "follow-up", "scan", "history",
+         "chemotherapy", "surgery", "visit", "lesion", "treatment", "diagnosis", "symptoms", "today", "week", "month"]
+
+XML_NAME_SUFFIX = ".Thyme2v1-withindoc.ogormant.inprogress.xml"
+
+def _interval(rng, timelineLength):
+    start = rng.randint(0, timelineLength - 2)
+    return (start, rng.randint(start + 1, min(timelineLength, start + 1 + timelineLength // 10)))
+
+def _tlinkType(interval1, interval2):
+    """
+    :return tuple: (THYME TLINK type, reversed) such that interval1 TYPE interval2 (or interval2 TYPE interval1 when
+        reversed) holds, or None when no THYME type holds exactly, i.e. when the intervals share their start or their
+        end (CONTAINS and OVERLAP are strict in the closure engines, see EndpointClosure.POINT_CONSTRAINTS)
+    """
+    ((start1, end1), (start2, end2)) = (interval1, interval2)
+    if end1 < start2:
+        return ("BEFORE", False)
+    elif end2 < start1:
+        return ("BEFORE", True)
+    elif end1 == start2:
+        return ("ENDS-ON", False)
+    elif end2 == start1:
+        return ("ENDS-ON", True)
+    elif start1 == start2 or end1 == end2:
+        return None
+    elif start1 < start2 and end2 < end1:
+        return ("CONTAINS", False)
+    elif start2 < start1 and end1 < end2:
+        return ("CONTAINS", True)
+    return ("OVERLAP", False)
+
+def generateDocument(documentName, entityCount=200, tlinkDensity=1.0, chainSize=3, chainFraction=0.2, conflictRate=0.02, seed=None):
+    """
+    :param str documentName: name of the document, used in the annotation ids, e.g. ID001_clinic_001
+    :param int entityCount: number of EVENT, TIMEX3 and Markable entities (and one DOCTIME)
+    :param float tlinkDensity: number of TLINKs per EVENT/TIMEX3
+    :param int chainSize: number of EVENTs in every Identical coreference chain
+    :param float chainFraction: fraction of the EVENTs that belong to a coreference chain
+    :param float conflictRate: fraction of the TLINKs whose direction is flipped, which makes them conflict
+    :param seed: seed of the random generator (None for a random document)
+    :return tuple: (document text, ThymeML XML)
+    """
+    rng = random.Random(seed)
+    timelineLength = max(10, entityCount)
+
+    # Text: one word per token, the entities are single tokens
+    tokens = [rng.choice(WORDS) for _ in range(entityCount * 3 + 1)]
+    offsets = []
+    textParts = []
+    position = 0
+    for (i, token) in enumerate(tokens):
+        offsets.append((position, position + len(token)))
+        separator = "\n" if i % 12 == 11 else " "
+        textParts.append(token + separator)
+        position += len(token) + len(separator)
+    documentContents = u"".join(textParts)
+    tokenPositions = rng.sample(range(1, len(tokens)), entityCount)
+
+    entityIDs = itertools.count(1)
+    relationIDs = itertools.count(1)
+    entityID = lambda: "%d@e@%s@gold" % (next(entityIDs), documentName)
+    relationID = lambda: "%d@r@%s@gold" % (next(relationIDs), documentName)
+
+    entities = [] # (id, span, type, properties)
+    entities.append((entityID(), offsets[0], "DOCTIME", []))
+    timeline = [] # (id, interval) of the EVENTs and TIMEX3s
+    events = []
+    for tokenPosition in tokenPositions:
+        draw = rng.random()
+        if draw < 0.1:
+            entity = (entityID(), offsets[tokenPosition], "TIMEX3", [("Class", "DATE")])
+            timeline.append((entity[0], _interval(rng, timelineLength)))
+        elif draw < 0.35:
+            entity = (entityID(), offsets[tokenPosition], "Markable", [])
+        else:
+            entity = (entityID(), offsets[tokenPosition], "EVENT", [("DocTimeRel", "BEFORE"), ("Polarity", "POS")])
+            events.append(entity[0])
+        entities.append(entity)
+
+    # The members of a coreference chain share one interval
+    intervals = dict(timeline)
+    relations = [] # (id, type, parents type, properties)
+    rng.shuffle(events)
+    chainedEventCount = int(len(events) * chainFraction) // max(chainSize, 2) * max(chainSize, 2)
+    for chainStart in range(0, chainedEventCount, max(chainSize, 2)):
+        members = events[chainStart:chainStart + max(chainSize, 2)]
+        interval = _interval(rng, timelineLength)
+        for member in members:
+            intervals[member] = interval
+        properties = [("FirstInstance", members[0])] + [("Coreferring_String", member) for member in members[1:]]
+        relations.append((relationID(), "Identical", "CorefChains", properties))
+    for event in events[chainedEventCount:]:
+        intervals[event] = _interval(rng, timelineLength)
+
+    timelineIDs = sorted(intervals, key=lambda annotationID: int(annotationID.split("@")[0]))
+    for _ in range(int(len(timelineIDs) * tlinkDensity)):
+        (source, target) = rng.sample(timelineIDs, 2)
+        tlinkType = _tlinkType(intervals[source], intervals[target])
+        if tlinkType is None:
+            continue
+        (relationType, isReversed) = tlinkType
+        if rng.random() < conflictRate and relationType != "OVERLAP":
+            isReversed = not isReversed
+        if isReversed:
+            (source, target) = (target, source)
+        relations.append((relationID(), "TLINK", "TemporalRelations", [("Source", source), ("Type", relationType), ("Target", target)]))
+
+    xmlParts = ["<?xml version='1.0' encoding='UTF-8'?>\n<data>\n<info>\n<savetime>00:00:00 01-01-2016</savetime>\n"
+                "  <progress>completed</progress>\n</info>\n\n<schema path=\"./\" protocol=\"file\">temporal.schema.xml</schema>\n<annotations>\n"]
+    for (annotationID, span, entityType, properties) in entities:
+        xmlParts.append("\n<entity>\n<id>%s</id>\n<span>%d,%d</span>\n<type>%s</type>\n<parentsType>TemporalEntities</parentsType>\n<properties>\n" % (annotationID, span[0], span[1], entityType))
+        xmlParts.extend("<%s>%s</%s>\n" % (name, escape(value), name) for (name, value) in properties)
+        xmlParts.append("</properties>\n</entity>\n")
+    for (annotationID, relationType, parentsType, properties) in relations:
+        xmlParts.append("\n<relation>\n<id>%s</id>\n<type>%s</type>\n<parentsType>%s</parentsType>\n<properties>\n" % (annotationID, relationType, parentsType))
+        xmlParts.extend("<%s>%s</%s>\n" % (name, escape(value), name) for (name, value) in properties)
+        xmlParts.append("</properties>\n</relation>\n")
+    xmlParts.append("</annotations>\n\n</data>")
+
+    return (documentContents, "".join(xmlParts))
+
+def writeDocument(documentDirectory, xmlDirectory, documentName, **options):
+    """
+    Writes a synthetic document in the layout read by TermProject.main:
+    <documentDirectory>/<name>/<name> and <xmlDirectory>/<name>/<name>.Thyme2v1-withindoc.ogormant.inprogress.xml
+
+    :param options: see generateDocument
+    :return tuple: (document path, XML path)
+    """
+    (documentContents, xml) = generateDocument(documentName, **options)
+
+    documentPath = os.path.join(documentDirectory, documentName, documentName)
+    xmlPath = os.path.join(xmlDirectory, documentName, documentName + XML_NAME_SUFFIX)
+    for path in (documentPath, xmlPath):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+    with codecs.open(documentPath, "w", "utf-8") as f:
+        f.write(documentContents)
+    with open(xmlPath, "w") as f:
+        f.write(xml)
+    return (documentPath, xmlPath)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic THYME documents")
+    parser.add_argument("directory", help="output directory (documents in <directory>/text/, XML in <directory>/xml/)")
+    parser.add_argument("--documents", type=int, default=10, help="number of documents (default: 10)")
+    parser.add_argument("--entities", type=int, default=200, help="entities per document (default: 200)")
+    parser.add_argument("--tlink-density", type=float, default=1.0, help="TLINKs per EVENT/TIMEX3 (default: 1.0)")
+    parser.add_argument("--chain-size", type=int, default=3, help="EVENTs per coreference chain (default: 3)")
+    parser.add_argument("--chain-fraction", type=float, default=0.2, help="fraction of EVENTs in coreference chains (default: 0.2)")
+    parser.add_argument("--conflict-rate", type=float, default=0.02, help="fraction of flipped TLINKs (default: 0.02)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first document (default: 0)")
+    args = parser.parse_args()
+
+    for i in range(args.documents):
+        documentName = "ID%03d_clinic_%03d" % (i + 1, i + 1)
+        writeDocument(os.path.join(args.directory, "text"), os.path.join(args.directory, "xml"), documentName,
+                      entityCount=args.entities, tlinkDensity=args.tlink_density, chainSize=args.chain_size,
+                      chainFraction=args.chain_fraction, conflictRate=args.conflict_rate, seed=args.seed + i)
+    print "Generated " + str(args.documents) + " documents in " + args.directory
@@ -0,0 +1,281 @@
+import bisect
+
+from thymeml import * # THYME-ML object model
+
+def newTemporalRelation(relationID, source, relationType, target, annotations, documentContents):
+    """
+    Creates a TLINK relation that is not part of the annotations (e.g. one derived by temporal closure).
+
+    :param str relationID: id of the new relation
+    :param ThymeMLAnnotation source: the Source annotation
+    :param str relationType: the THYME TLINK type, e.g. BEFORE
+    :param ThymeMLAnnotation target: the Target annotation
+    :param ThymeMLAnnotations annotations: the annotations used to resolve Source and Target
+    :param unicode documentContents: text of the document
+    """
+    newRelationXML = ElementTree.Element("relation")
+    ElementTree.SubElement(newRelationXML, "id").text = relationID
+    ElementTree.SubElement(newRelationXML, "type").text = "TLINK"
+    ElementTree.SubElement(newRelationXML, "parentsType").text = "TemporalRelations"
+    propertiesXML = ElementTree.SubElement(newRelationXML, "properties")
+    ElementTree.SubElement(propertiesXML, "Source").text = source.id
+    ElementTree.SubElement(propertiesXML, "Type").text = relationType
+    ElementTree.SubElement(propertiesXML, "Target").text = target.id
+    return ThymeMLRelation(newRelationXML, annotations, documentContents)
+
+class TemporalClosure(object):
+    '''
+    Indexed worklist engine for the TLINK temporal closure.
+
+    The closure used to re-scan every (i, j) pair of TLINK relations after each round. Only pairs of relations
+    that share an annotation can ever compose or conflict, so relations are indexed by the equality class of
+    their endpoints and each relation is only composed with the relations in its endpoint buckets. Every
+    relation also remembers how far down the relation list it has already been composed, so newly derived
+    relations form the worklist of the next round instead of triggering a full re-scan.
+
+    Pairs are still visited in the same order as the original nested loop, so the derived TLINKs (and their
+    order) and the conflicting relation pairs are exactly the same as before.
+    '''
+
+    def __init__(self, tlinkRelations, annotations, documentContents, newRelationID):
+        """
+        :param list tlinkRelations: TLINK relations to close; derived relations are appended to this list
+        :param ThymeMLAnnotations annotations: the annotations used to resolve the Source/Target of derived relations
+        :param unicode documentContents: text of the document
+        :param str newRelationID: id given to every derived relation
+        """
+        self.tlinkRelations = tlinkRelations
+        self.annotations = annotations
+        self.documentContents = documentContents
+        self.newRelationID = newRelationID
+
+        self.conflictingRelationPairs = []
+        self.implicitRelationCount = 0
+        self.rounds = 0 # passes over the relation list
+        self.pairsExamined = 0 # pairs of relations composed
+        self.derivations = {} # id(derived relation) -> (relation, relation) it was composed from
+
+        self._conflictingRelationPairSet = set()
+        self._existingRelations = set() # (Source id, Target id, Type) of every TLINK
+        self._equalityClasses = {} # annotation -> equality class (same notion of equality as set())
+        self._referenceClass = {} # id(reference) -> (reference, equality class)
+        self._relationsByClass = {} # equality class -> sorted indexes of relations with an endpoint in that class
+        self._selfLoopRelations = [] # sorted indexes of relations whose endpoints are in the same class
+        self._endpoints = [] # index -> (source, target, type, source class, target class) or None
+        self._composedUpTo = [] # index -> every relation below this index has been composed with it
+
+        for relation in self.tlinkRelations:
+            self._index(relation)
+
+    def run(self):
+        """
+        Derives implicit TLINK relations until no new relation can be found.
+
+        :return tuple: (implicit relation count, conflicting relation pairs)
+        """
+        foundImplicitRelation = True
+        while foundImplicitRelation:
+            foundImplicitRelation = False
+            self.rounds += 1
+
+            i = 0
+            while i < len(self.tlinkRelations):
+                start = max(i + 1, self._composedUpTo[i])
+                if self._endpoints[i] is not None and start < len(self.tlinkRelations):
+                    for j in self._partners(i, start):
+                        self.pairsExamined += 1
+                        if self._compose(i, j):
+                            foundImplicitRelation = True
+                self._composedUpTo[i] = len(self.tlinkRelations)
+                i += 1
+
+        return (self.implicitRelationCount, self.conflictingRelationPairs)
+
+    def _classOf(self, reference):
+        key = id(reference)
+        if key not in self._referenceClass:
+            equalityClass = self._equalityClasses.setdefault(reference, len(self._equalityClasses))
+            self._referenceClass[key] = (reference, equalityClass)
+        return self._referenceClass[key][1]
+
+    def _index(self, relation):
+        index = len(self._endpoints)
+        self._composedUpTo.append(0)
+
+        allReferences = relation.allReferences
+        if len(allReferences) != 2:
+            self._endpoints.append(None) # Never composed, there should always be 4 annotations to compare
+            return
+
+        source = relation.properties["Source"]
+        target = relation.properties["Target"]
+        relationType = relation.properties["Type"]
+        sourceClass = self._classOf(allReferences[0])
+        targetClass = self._classOf(allReferences[1])
+        self._endpoints.append((source, target, relationType, sourceClass, targetClass))
+
+        self._relationsByClass.setdefault(sourceClass, []).append(index)
+        if targetClass != sourceClass:
+            self._relationsByClass.setdefault(targetClass, []).append(index)
+        else:
+            self._selfLoopRelations.append(index)
+
+        if hasattr(source, "id") and hasattr(target, "id"):
+            self._existingRelations.add((source.id, target.id, relationType))
+
+    def _partners(self, i, start):
+        '''
+        Yields, in increasing order, the indexes j >= start of the relations that share an endpoint class with
+        relation i. Relations appended while iterating are picked up as well. Two self-referential relations are
+        always partners, since their four references only hold two unique annotations.
+        '''
+        (_, _, _, sourceClass, targetClass) = self._endpoints[i]
+        buckets = [self._relationsByClass[sourceClass]]
+        if targetClass != sourceClass:
+            buckets.append(self._relationsByClass[targetClass])
+        else:
+            buckets.append(self._selfLoopRelations)
+
+        j = start
+        while True:
+            nextIndex = None
+            for bucket in buckets:
+                position = bisect.bisect_left(bucket, j)
+                if position < len(bucket) and (nextIndex is None or bucket[position] < nextIndex):
+                    nextIndex = bucket[position]
+            if nextIndex is None:
+                return
+            yield nextIndex
+            j = nextIndex + 1
+
+    def _compose(self, i, j):
+        """
+        Looks for a conflict or an implicit relation between the relations at index i and j (i < j).
+
+        :return bool: True if a new relation was derived
+        """
+        relation1 = self.tlinkRelations[i]
+        relation2 = self.tlinkRelations[j]
+        (source1, target1, type1, sourceClass1, targetClass1) = self._endpoints[i]
+        (source2, target2, type2, sourceClass2, targetClass2) = self._endpoints[j]
+
+        uniqueReferences = len(set((sourceClass1, targetClass1, sourceClass2, targetClass2)))
+
+        if uniqueReferences == 2: # Complete overlap... look for conflicts (2 overlapping references)
+
+            referenceAlignment = source1 is source2  # x R1 y, x R2 y
+
+            if type1 == "OVERLAP" or type2 == "OVERLAP": # Do not support conflict discovery for relation type "OVERLAP"
+                return False
+
+            relationConflict = False
+            if referenceAlignment:
+                relationConflict = type1 != type2
+            else:
+                relationConflict = (type1 == "BEGINS-ON" and type2 == "ENDS-ON") or (type2 == "BEGINS-ON" and type1 == "ENDS-ON")
+
+            # Relation Conflict
+            if relationConflict:
+                relationPair = (relation1, relation2)
+                if relationPair not in self._conflictingRelationPairSet:
+                    self._conflictingRelationPairSet.add(relationPair)
+                    self.conflictingRelationPairs.append(relationPair)
+            return False
+
+        elif uniqueReferences != 3: # Relations have nothing in common
+            return False
+
+        # Create new explicit relation (1 overlapping reference)
+
+        '''
+        We use Allen's Transitivity Table for the Twelve Temporal Relations, except that
+        THYME Annotation Guidelines only support 5 different temporal relation TLINK types:
+            "BEFORE", "CONTAINS", "OVERLAP", "BEGINS-ON", "ENDS-ON"
+        Therefore we first do some magic to convert THYME TLINK types to Allen's relations
+        when the events are reversed, and then once the temporal closure is complete, we convert
+        Allen's relation types back to THYME relation types. In this way, we can support the following types:
+            "BEFORE", "AFTER", "DURING", "CONTAINS", "OVERLAP", "BEGINS-ON", "ENDS-ON"
+        Since THYME Annotation Guidelines merge Allen's "Overlaps" and "Overlapped-By" into a single type,
+        therefore we do not apply temporal closure to temporal relation TLINKs of type "OVERLAP"
+        '''
+
+        # x R1 y, y R2 z # None reversed
+        newRelationType = ""
+        relation1Reversed = False
+        relation2Reversed = False
+        if source1 is source2: # y R1 x, y R2 z # 1st reversed
+            relation1Reversed = True
+        elif target1 is target2: # x R1 y, z R2 y # 2nd reversed
+            relation2Reversed = True
+        elif source1 is target2: # y R1 x, z R2 y # 1st/2nd reversed
+            relation1Reversed = True
+            relation2Reversed = True
+
+        # Reverse the relation if necessary, since ThymeML does not use AFTER or DURING relations
+        relation1Resolved = type1
+        if type1 == "BEFORE" and relation1Reversed:
+            relation1Resolved = "AFTER"
+        elif type1 == "CONTAINS" and relation1Reversed:
+            relation1Resolved = "DURING"
+
+        relation2Resolved = relation2.type
+        if type2 == "BEFORE" and relation2Reversed:
+            relation2Resolved = "AFTER"
+        elif type2 == "CONTAINS" and relation2Reversed:
+            relation2Resolved = "DURING"
+
+        # Temporal closure
+        if relation1Resolved == "BEFORE":
+            if relation2Resolved in ["BEFORE", "CONTAINS", "ENDS-ON"]:
+                newRelationType = "BEFORE"
+        if relation1Resolved == "AFTER":
+            if relation2Resolved in ["AFTER", "CONTAINS", "BEGINS-ON"]:
+                newRelationType = "AFTER"
+        if relation1Resolved == "DURING":
+            if relation2Resolved in ["BEFORE", "ENDS-ON"]:
+                newRelationType = "BEFORE"
+            elif relation2Resolved in ["AFTER", "BEGINS-ON"]:
+                newRelationType = "AFTER"
+            elif relation2Resolved in ["DURING"]:
+                newRelationType = "DURING"
+        elif relation1Resolved == "CONTAINS":
+            if relation2Resolved in ["CONTAINS"]:
+                newRelationType = "CONTAINS"
+        elif relation1Resolved == "ENDS-ON":
+            if relation2Resolved in ["BEFORE", "CONTAINS", "ENDS-ON"]:
+                newRelationType = "BEFORE"
+        elif relation1Resolved == "BEGINS-ON":
+            if relation2Resolved in ["AFTER", "CONTAINS", "BEGINS-ON"]:
+                newRelationType = "AFTER"
+
+        if newRelationType == "":
+            return False
+
+        # Reverse the relation again if necessary, since ThymeML does not use AFTER or DURING relations
+        shouldReverseNewRelation = False
+        if newRelationType == "AFTER":
+            newRelationType = "BEFORE"
+            shouldReverseNewRelation = True
+        elif newRelationType == "DURING":
+            newRelationType = "CONTAINS"
+            shouldReverseNewRelation = True
+
+        source = target1 if relation1Reversed else source1
+        target = source2 if relation2Reversed else target2
+
+        if shouldReverseNewRelation:
+            tempReference = source
+            source = target
+            target = tempReference
+
+        if (source.id, target.id, newRelationType) in self._existingRelations:
+            return False
+
+        # Create new temporal relation
+        newRelation = newTemporalRelation(self.newRelationID, source, newRelationType, target, self.annotations, self.documentContents)
+        self.derivations[id(newRelation)] = (relation1, relation2)
+
+        self.tlinkRelations.append(newRelation)
+        self._index(newRelation)
+        self.implicitRelationCount += 1
+        return True
@@ -0,0 +1,143 @@
+import array
+
+from thymeml import * # THYME-ML object model
+from CompiledDocument import NO_REFERENCE
+
+# TLINK types that order the start points of their Source and Target strictly, and whether the order is reversed
+# (AFTER and DURING are not annotated, but may appear once relations are reversed)
+STRICT_ORDER_TYPES = {
+    "BEFORE": False,
+    "CONTAINS": False,
+    "AFTER": True,
+    "DURING": True,
+}
+
+class TemporalCycleCheck(object):
+    '''
+    Linear-time pre-check for inconsistent TLINKs, run before the temporal closure.
+
+    Both "x BEFORE y" and "x CONTAINS y" imply that x starts strictly before y, so any cycle in the directed graph
+    of BEFORE/CONTAINS relations (x -> y) can not be satisfied, whatever the other relations are. A single pass of
+    Tarjan's strongly connected components algorithm finds every such cycle in O(V + E). Each strongly connected
+    component is reported once, with all the strict-order relations between its annotations, instead of listing
+    every elementary cycle (which can be exponentially many).
+
+    The graph is read from the columns of the CompiledDocument, whose codes identify annotations, so the check should
+    run after coreferent events have been replaced by their coreference chain (and the compiled references refreshed).
+    Self-referential relations (Source is Target) are left to the self-referential check, and relations whose Source
+    or Target does not resolve to an annotation can not be ordered and are skipped.
+    '''
+
+    def __init__(self, tlinkRelations, compiledDocument):
+        """
+        :param list tlinkRelations: TLINK relations to check, relations of the compiled document
+        :param CompiledDocument compiledDocument: the compiled annotations of the document
+        """
+        self.tlinkRelations = tlinkRelations
+        self.compiledDocument = compiledDocument
+
+        self._nodes = [] # index -> code of the annotation (entity or coreference chain)
+        self._nodeIndex = array.array("l", [NO_REFERENCE]) * len(compiledDocument.annotations) # code -> index
+        self._successors = [] # index -> indexes of the annotations it starts before
+        self._edges = [] # (source index, target index, relation) of every strict-order relation
+
+        strictOrderTypes = dict((compiledDocument.temporalTypes.find(temporalType), isReversed)
+                                for (temporalType, isReversed) in STRICT_ORDER_TYPES.items())
+        strictOrderTypes.pop(NO_REFERENCE, None)
+        for relation in self.tlinkRelations:
+            self._add(relation, strictOrderTypes)
+
+    def run(self):
+        """
+        :return list: one list of relations (in the order of tlinkRelations) per cycle
+        """
+        componentOf = {}
+        for (componentIndex, component) in enumerate(self._stronglyConnectedComponents()):
+            if len(component) > 1:
+                for node in component:
+                    componentOf[node] = componentIndex
+
+        cycles = {} # component -> relations, in the order of the first relation of each cycle
+        order = []
+        for (i, j, relation) in self._edges:
+            componentIndex = componentOf.get(i)
+            if componentIndex is not None and componentOf.get(j) == componentIndex:
+                if componentIndex not in cycles:
+                    cycles[componentIndex] = []
+                    order.append(componentIndex)
+                cycles[componentIndex].append(relation)
+        return [cycles[componentIndex] for componentIndex in order]
+
+    def _node(self, code):
+        index = self._nodeIndex[code]
+        if index == NO_REFERENCE:
+            index = self._nodeIndex[code] = len(self._nodes)
+            self._nodes.append(code)
+            self._successors.append([])
+        return index
+
+    def _add(self, relation, strictOrderTypes):
+        compiledDocument = self.compiledDocument
+        relationIndex = compiledDocument.relationIndex(compiledDocument.codeOf(relation))
+        if relationIndex == NO_REFERENCE:
+            raise ValueError("relation {0} is not part of the compiled document".format(relation.id))
+        isReversed = strictOrderTypes.get(compiledDocument.relationTemporalTypes[relationIndex])
+        if isReversed is None:
+            return
+        source = compiledDocument.relationSources[relationIndex]
+        target = compiledDocument.relationTargets[relationIndex]
+        if source == target or source == NO_REFERENCE or target == NO_REFERENCE:
+            return
+        (i, j) = (self._node(target), self._node(source)) if isReversed else (self._node(source), self._node(target))
+        self._successors[i].append(j)
+        self._edges.append((i, j, relation))
+
+    def _stronglyConnectedComponents(self):
+        '''
+        Iterative Tarjan (the graphs of long notes are deeper than the recursion limit).
+        '''
+        nodeCount = len(self._nodes)
+        index = [None] * nodeCount
+        lowlink = [0] * nodeCount
+        onStack = [False] * nodeCount
+        stack = []
+        components = []
+        counter = 0
+
+        for root in range(nodeCount):
+            if index[root] is not None:
+                continue
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            onStack[root] = True
+            work = [(root, iter(self._successors[root]))]
+
+            while work:
+                (node, successors) = work[-1]
+                for successor in successors:
+                    if index[successor] is None:
+                        index[successor] = lowlink[successor] = counter
+                        counter += 1
+                        stack.append(successor)
+                        onStack[successor] = True
+                        work.append((successor, iter(self._successors[successor])))
+                        break
+                    elif onStack[successor]:
+                        lowlink[node] = min(lowlink[node], index[successor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            onStack[member] = False
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component)
+
+        return components
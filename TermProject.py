@@ -1,113 +1,273 @@
 import os
 import sys
-import gc
-from os import listdir # Directory
-from os.path import isfile, join # Directory
-import codecs # Reading file with utf-8 encoding
+import json
+import collections
+import argparse
+import multiprocessing
+import codecs # Writing files with utf-8 encoding
+from StringIO import StringIO
 from DocumentProcessor import *
+from BatchManifest import BatchManifest, hashOfFile, checkerModules, checkerVersion
+from Corpus import Corpus, DOCUMENT_KINDS
+from Instrumentation import Instrumentation
+from Report import Report, VERBOSITY_LEVELS, DETAIL
+from DocumentText import DocumentText
+from Prefetch import Prefetcher
 
-def contentsOfFile(filename):
-    file = codecs.open(filename, "r", "utf-8")
-    content = file.read()
-    return content
+def loadDocument(task):
+    """
+    Reads the text and parses the XML of a document, so that it can be loaded ahead of its check (see Prefetcher).
+
+    :param tuple task: see processDocument
+    :return tuple: (DocumentText, ThymeMLData, instrumentation record or None), the DocumentText is closed by
+        processDocument
+    """
+    (documentName, documentPath, xmlPath, cacheDirectory) = task[:4]
+    profile = task[6]
+    instrumentation = Instrumentation(profile)
+
+    instrumentation.stage("readText")
+    documentContents = DocumentText(documentPath) # Spans are decoded when the report is rendered
+    try:
+        instrumentation.stage("load")
+        data = ThymeMLData.from_file(xmlPath, documentContents, cache_dir=cacheDirectory)
+    except BaseException:
+        documentContents.close()
+        raise
+    return (documentContents, data, instrumentation.record())
+
+def discardLoadedDocument(loadedDocument):
+    loadedDocument[0].close()
+
+def waitForResults(results):
+    """
+    Yields the results of Pool.imap. Waiting for a result without a timeout ignores KeyboardInterrupt in Python 2, so
+    the results are waited for in short steps, and an interrupted run stops its workers instead of hanging.
+
+    :param results: the iterator returned by Pool.imap
+    """
+    while True:
+        try:
+            yield results.next(timeout=1)
+        except multiprocessing.TimeoutError:
+            continue
+        except StopIteration:
+            return
+
+def processDocument(task, loadedDocument=None):
+    """
+    Checks a single document and collects its report instead of printing it, so that documents can be processed in
+    worker processes.
+
+    :param tuple task: (document name, document path, XML path, cache directory, run closure, closure engine name,
+        profile, report format, verbosity, export path)
+    :param tuple loadedDocument: the document loaded ahead by loadDocument (None loads it now)
+    :return tuple: (document name, (temporal closure, identity coreference, self-referential) conflict counts, rendered
+        report, instrumentation record or None)
+    """
+    (documentName, documentPath, xmlPath, cacheDirectory, runClosure, engineName, profile, reportFormat, verbosity, exportPath) = task
+    if loadedDocument is None:
+        loadedDocument = loadDocument(task)
+    (documentContents, data, loadRecord) = loadedDocument
+    instrumentation = Instrumentation(profile)
+    instrumentation.add(loadRecord) # Wall times of prefetched loads overlap the check of the previous document
+
+    report = Report(documentName)
+    report.record("document", {"path": documentPath, "xml": xmlPath}, "Document: " + documentPath)
+
+    with documentContents:
+        lineCount = documentContents.count(u'\n')
+        report.record("count", collections.OrderedDict([("name", "lines"), ("value", lineCount)]), "\tNumber of Lines: " + str(lineCount))
+        report.record("count", collections.OrderedDict([("name", "characters"), ("value", len(documentContents))]), "\tNumber of Characters: " + str(len(documentContents)))
+
+        report.text("\tXML: " + xmlPath)
+
+        conflictCounts = processDocumentThymeMLData(xmlPath, documentName, documentContents, CLOSURE_ENGINES[engineName], cacheDirectory=cacheDirectory, runClosure=runClosure, instrumentation=instrumentation, report=report, exportPath=exportPath, data=data)
+
+        instrumentation.stage("report")
+        rendered = StringIO()
+        if reportFormat == "jsonl":
+            report.writeJSONLines(rendered, verbosity)
+        else:
+            report.writeText(rendered, verbosity)
+
+    return (documentName, conflictCounts, rendered.getvalue(), instrumentation.record())
 
 # Convert XML to Python objects (either specialized classes or dictionary)
-def main():
+def main(workerCount=None, cacheDirectory="./cache/", runClosure=True, engineName="TemporalClosure", profile=False, reportFormat="text", verbosity=DETAIL,
+         kinds=("clinic",), annotators=("ogormant",), rescan=False, exportDirectory=None, prefetchDepth=2):
+    """
+    :param int workerCount: number of worker processes checking documents in parallel (defaults to the number of CPUs,
+        1 checks every document in this process)
+    :param str cacheDirectory: directory of the compiled copies of the XML files (None always parses the XML files)
+    :param bool runClosure: False only runs the BEFORE/CONTAINS cycle pre-check instead of the temporal closure
+    :param str engineName: temporal closure engine, see DocumentProcessor.CLOSURE_ENGINES
+    :param bool profile: time the stages of every check and count the closure work, see Instrumentation
+    :param str reportFormat: format of the reports, text (<document>-processed.txt) or jsonl (<document>-processed.jsonl)
+    :param int verbosity: level of detail of the reports, see Report.VERBOSITY_LEVELS
+    :param tuple kinds: kinds of documents to check, see Corpus.DOCUMENT_KINDS
+    :param tuple annotators: annotators whose XML files are checked (None checks the first XML file of every document)
+    :param bool rescan: list every corpus folder again, even if the cached listing (output/corpus.json) is current
+    :param str exportDirectory: if given, every checked document is written to <exportDirectory>/<document>/ with the
+        TLINKs derived by the closure, see DocumentProcessor.exportedAnnotations
+    :param int prefetchDepth: number of documents hashed, and (when checking in this process) read and parsed, on
+        background threads ahead of the current one, see Prefetcher (0 loads every document when it is reached)
+    """
 
     documentDirectory = "./Tim-Round1/THYME-Analysis/"
     xmlDirectory = "./Tim-Round2/thyme2mergedfiles/"
     outputDirectory = "./output/"
     
-    allFolders = [f for f in listdir(xmlDirectory) if not isfile(join(xmlDirectory, f))]
-    # onlyfiles = [f for f in os.listdir(currentDir) if os.path.isfile(join(currentDir, f))]
-    
-    print "XML Directory: " + xmlDirectory
-    print "\tFound " + str(len(allFolders)) + " Folders"
+    if not os.path.exists(outputDirectory):
+        os.makedirs(outputDirectory)
 
-    clinicFolders = []
-    for folder in allFolders:
-        if "_path_" not in folder:
-            clinicFolders.append(folder) # filter out folder like "ID001_path_002"
+    print "XML Directory: " + xmlDirectory
+    corpus = Corpus(documentDirectory, xmlDirectory, outputDirectory + "corpus.json", rescan)
+    print "\tFound " + str(len(corpus.xmlFolders)) + " Folders" + ("" if corpus.rescanned else " (cached listing)")
 
-    print "\tFound " + str(len(clinicFolders)) + " Clinic Folders"
+    documents = corpus.documents(kinds, annotators)
+    documentsByName = collections.OrderedDict() # Tim confirmed that currently we are not doing cross-document annotation
+    for document in documents:
+        documentsByName.setdefault(document.name, document) # First XML file (in name order) of every document
+    print "\tFound " + str(len(documentsByName)) + " " + "/".join(kind.capitalize() for kind in kinds) + " Folders"
+    if len(documents) > len(documentsByName):
+        print "\tIgnoring " + str(len(documents) - len(documentsByName)) + " additional XML files, select an annotator with --annotator"
 
     print "Document Root Directory: " + documentDirectory
 
     print "Generating THYME data model for each document and XML pair"
     print "Output directory: " + outputDirectory
 
-    orig_stdout = sys.stdout
-
-    temporalClosureConflictTotalCount = 0
-    identityCoreferenceResolutionConflictTotalCount = 0
-    selfReferentialTemporalRelationTotalCount = 0
-    for i, folder in enumerate(clinicFolders): # Tim confirmed that currently we are not doing cross-document annotation
+    # Documents are only re-checked when their XML, their text or the checker itself changed since the last run
+    manifest = BatchManifest(outputDirectory + "manifest.json", checkerVersion(checkerModules(sys.modules[__name__]), (runClosure, engineName, reportFormat, verbosity, exportDirectory)))
+    outputSuffix = "-processed.jsonl" if reportFormat == "jsonl" else "-processed.txt"
 
-        sys.stdout = orig_stdout
-
-        documentName = folder # document name is same as folder, e.g. ID001_clinic_001
-        documentPath = documentDirectory + folder + "/" + documentName
+    documentsWithText = []
+    for (documentName, document) in documentsByName.items(): # document name is same as folder, e.g. ID001_clinic_001
+        if document.textPath is None:
+            print "\tMissing text of " + documentName
+            continue
 
         # if documentName not in ["ID014_clinic_042", "ID023_clinic_067", "ID025_clinic_075", "ID067_clinic_197"]:
         #     continue
 
-        outputPath = outputDirectory + documentName + "-processed.txt"
-        print "\tProcessing " + documentName + " (" + str(i + 1) + " of " + str(len(clinicFolders)) + ")"
-            
-        if os.path.isfile(outputPath): # Don't process documents that already have generated output files
+        documentsWithText.append(document)
+
+    documentNames = []
+    inputHashes = {}
+    tasks = []
+    hashedDocuments = Prefetcher(lambda document: (hashOfFile(document.xmlPath), hashOfFile(document.textPath)), documentsWithText, prefetchDepth)
+    for (document, (xmlHash, textHash)) in hashedDocuments:
+        (documentName, documentPath, xmlPath) = (document.name, document.textPath, document.xmlPath)
+        documentNames.append(documentName)
+        inputHashes[documentName] = (xmlHash, textHash)
+
+        exportPath = None
+        if exportDirectory is not None and runClosure:
+            exportPath = os.path.join(exportDirectory, documentName, os.path.basename(xmlPath))
+            if not os.path.isdir(os.path.dirname(exportPath)):
+                os.makedirs(os.path.dirname(exportPath))
+
+        outputPath = outputDirectory + documentName + outputSuffix
+        if (os.path.isfile(outputPath) and (exportPath is None or os.path.isfile(exportPath)) and
+                manifest.isCurrent(documentName, xmlHash, textHash)): # Don't re-check unchanged documents
             continue
 
-        dir = os.path.dirname(outputPath)
-        if not os.path.exists(dir):
-            os.makedirs(dir)
+        tasks.append((documentName, documentPath, xmlPath, cacheDirectory, runClosure, engineName, profile, reportFormat, verbosity, exportPath))
+
+    print "\tSkipping " + str(len(documentNames) - len(tasks)) + " unchanged documents"
 
-        f = file(outputPath, 'w')
-        sys.stdout = f
+    if workerCount is None:
+        workerCount = multiprocessing.cpu_count()
 
-        f = open(outputPath, 'w')
-        print "Document: " + documentPath
+    pool = None
+    loadedDocuments = None
+    if workerCount > 1 and len(tasks) > 1:
+        print "Checking documents with " + str(workerCount) + " worker processes"
+        pool = multiprocessing.Pool(workerCount, maxtasksperchild=16)
+        results = waitForResults(pool.imap(processDocument, tasks)) # Reports come back in document order
+    else:
+        # The next documents are read and parsed while a document is checked
+        loadedDocuments = Prefetcher(loadDocument, tasks, prefetchDepth, discard=discardLoadedDocument)
+        results = (processDocument(task, loadedDocument) for (task, loadedDocument) in loadedDocuments)
+
+    totalInstrumentation = Instrumentation(profile)
+    profileFile = open(outputDirectory + "profile.jsonl", "w") if profile else None # One JSON record per checked document
+    try:
+        for i, (documentName, conflictCounts, report, record) in enumerate(results):
+
+            print "\tProcessed " + documentName + " (" + str(i + 1) + " of " + str(len(tasks)) + ")"
 
-        documentContents = contentsOfFile(documentPath)
+            outputPath = outputDirectory + documentName + outputSuffix
+            with codecs.open(outputPath, 'w', "utf-8") as f:
+                f.write(report)
 
-        print "\tNumber of Lines: " + str(documentContents.count('\n'))
-        print "\tNumber of Characters: " + str(len(documentContents))
+            (xmlHash, textHash) = inputHashes[documentName]
+            manifest.record(documentName, xmlHash, textHash, conflictCounts)
 
-        xmlPath = xmlDirectory + folder + "/" + documentName + ".Thyme2v1-withindoc.ogormant.inprogress.xml"
-        
-        print "\tXML: " + xmlPath
+            if record is not None:
+                profileFile.write(json.dumps(collections.OrderedDict([("document", documentName)] + record.items())) + "\n")
+                totalInstrumentation.add(record)
+        if pool is not None:
+            pool.close()
+    except BaseException:
+        if pool is not None:
+            pool.terminate() # Do not wait for the workers to check the remaining documents
+        raise
+    finally:
+        manifest.save() # Keep the documents checked so far when the run is interrupted
+        if profileFile is not None:
+            profileFile.close()
+        if pool is not None:
+            pool.join()
+        if loadedDocuments is not None:
+            loadedDocuments.close()
 
-        (temporalClosureConflictCount, identityCoreferenceResolutionConflictCount, selfReferentialTemporalRelationCount) = processDocumentThymeMLData(xmlPath, documentName, documentContents)
+    # Totals cover every document, including the unchanged ones whose counts come from the manifest
+    temporalClosureConflictTotalCount = 0
+    identityCoreferenceResolutionConflictTotalCount = 0
+    selfReferentialTemporalRelationTotalCount = 0
+    for documentName in documentNames:
+        (temporalClosureConflictCount, identityCoreferenceResolutionConflictCount, selfReferentialTemporalRelationCount) = manifest.conflictCounts(documentName)
         temporalClosureConflictTotalCount += temporalClosureConflictCount
         identityCoreferenceResolutionConflictTotalCount += identityCoreferenceResolutionConflictCount
         selfReferentialTemporalRelationTotalCount += selfReferentialTemporalRelationCount
-        
-        xmlPath = None
-        data = None
-        _XMLWrapper = None
-        documentContents = None
-        
-        f.close()
-        
-        gc.collect()
-
-    sys.stdout = orig_stdout
+
     print "Done with processing all documents"
 
-    totalConflictCount = temporalClosureConflictTotalCount + identityCoreferenceResolutionConflictTotalCount + selfReferentialTemporalRelationTotalCount
+    if profile:
+        printSectionDivider(1)
+        print "Profile of the " + str(len(tasks)) + " checked documents (wall/CPU seconds)"
+        print ""
+        for (stage, (wall, cpu)) in totalInstrumentation.stages.items():
+            print "\t" + stage + "\t" + ("%.3f" % wall) + "\t" + ("%.3f" % cpu)
+        for (counter, value) in totalInstrumentation.counters.items():
+            print "\t" + counter + "\t" + str(value)
 
-    printSectionDivider(1)
-    print "Root Causes of Temporal Inconsistencies"
-    print ""
-    if totalConflictCount > 0:
-        print "Temporal Closure\t\t\t\t\t" + str(temporalClosureConflictTotalCount) + "/" + str(totalConflictCount) + "\t(" + str(100*temporalClosureConflictTotalCount/totalConflictCount) + "%)"
-        print "Identity-Coreference Chain Resolution\t\t\t" + str(identityCoreferenceResolutionConflictTotalCount + selfReferentialTemporalRelationTotalCount) + "/" + str(totalConflictCount) + "\t(" + str(100*(identityCoreferenceResolutionConflictTotalCount + selfReferentialTemporalRelationTotalCount)/totalConflictCount) + "%)"
-        print "\tSelf-Referential Relations\t\t\t" + str(selfReferentialTemporalRelationTotalCount) + "/" + str(totalConflictCount) + "\t|----(" + str(100*selfReferentialTemporalRelationTotalCount/totalConflictCount) + "%)"
-        print "\tRelation Conflicts\t\t\t\t" + str(identityCoreferenceResolutionConflictTotalCount) + "/" + str(totalConflictCount) + "\t|----(" + str(100*identityCoreferenceResolutionConflictTotalCount/totalConflictCount) + "%)"
-    else:
-        print "No temporal inconsistencies found"
+    printRootCauses(temporalClosureConflictTotalCount, identityCoreferenceResolutionConflictTotalCount, selfReferentialTemporalRelationTotalCount)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check THYME annotations for temporal inconsistencies")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--prefetch", type=int, default=2, metavar="DEPTH", help="number of documents loaded on background threads ahead of the one being checked (default: 2, 0 disables)")
+    parser.add_argument("--cache-dir", default="./cache/", help="directory of the compiled copies of the XML files (default: ./cache/)")
+    parser.add_argument("--no-cache", action="store_true", help="always parse the XML files")
+    parser.add_argument("--profile", action="store_true", help="time the stages of every check (written to output/profile.jsonl)")
+    parser.add_argument("--format", choices=["text", "jsonl"], default="text", help="format of the reports (default: text)")
+    parser.add_argument("--verbosity", choices=list(VERBOSITY_LEVELS), default="detail", help="level of detail of the reports (default: detail)")
+    parser.add_argument("--quick", action="store_true", help="only check BEFORE/CONTAINS relations for cycles, without the temporal closure")
+    parser.add_argument("--engine", choices=list(CLOSURE_ENGINES), default="TemporalClosure", help="temporal closure engine (default: TemporalClosure)")
+    parser.add_argument("--kind", action="append", choices=DOCUMENT_KINDS, help="kind of documents to check, can be repeated (default: clinic)")
+    parser.add_argument("--annotator", action="append", help="annotator of the XML files to check, can be repeated (default: ogormant)")
+    parser.add_argument("--any-annotator", action="store_true", help="check the first XML file of every document, whatever its annotator")
+    parser.add_argument("--rescan", action="store_true", help="list every corpus folder again, e.g. after files were added to or removed from existing folders (by default, only the two corpus directories are checked for changes)")
+    parser.add_argument("--export", metavar="DIRECTORY", default=None, help="write every checked document with the TLINKs derived by the closure to DIRECTORY/<document>/")
+    args = parser.parse_args()
 
-print "Starting..."
-main()
+    print "Starting..."
+    annotators = None if args.any_annotator else tuple(args.annotator or ["ogormant"])
+    main(args.workers, None if args.no_cache else args.cache_dir, not args.quick, args.engine, args.profile, args.format, VERBOSITY_LEVELS[args.verbosity],
+         tuple(args.kind or ["clinic"]), annotators, args.rescan, args.export, args.prefetch)
 
 '''
 # Create timeline...
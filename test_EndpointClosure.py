@@ -0,0 +1,46 @@
+import unittest
+
+from EndpointClosure import *
+from test_IntervalAlgebra import document, TEXT
+
+def close(tlinks):
+    """
+    :return tuple: (the derived TLINKs as (Source, Type, Target) names, the conflicting pairs as relation ids)
+    """
+    data = document(tlinks)
+    tlinkRelations = list(data.annotations.select_type("TLINK"))
+    closure = EndpointClosure(tlinkRelations, data.annotations, TEXT, "5@r@doc@gold")
+    (_, conflictingRelationPairs) = closure.run()
+    derived = set((relation.properties["Source"].id[0], relation.properties["Type"], relation.properties["Target"].id[0])
+                  for relation in tlinkRelations[len(tlinks):])
+    return (derived, [(relation1.id, relation2.id) for (relation1, relation2) in conflictingRelationPairs])
+
+class EndpointClosureTest(unittest.TestCase):
+
+    def test_point_constraints(self):
+        self.assertEqual(POINT_CONSTRAINTS["ENDS-ON"], [((X, END), EQUAL, (Y, START))])
+        self.assertEqual(POINT_CONSTRAINTS["BEGINS-ON"], [((X, START), EQUAL, (Y, END))])
+
+    def test_chain_derives_relations(self):
+        (derived, conflicts) = close([("a", "ENDS-ON", "b"), ("b", "BEFORE", "c"), ("c", "CONTAINS", "d")])
+        self.assertEqual(derived, set([("a", "BEFORE", "c"), ("a", "BEFORE", "d"), ("b", "BEFORE", "d")]))
+        self.assertEqual(conflicts, [])
+
+    def test_ends_on_is_the_inverse_of_begins_on(self):
+        self.assertEqual(close([("a", "ENDS-ON", "b"), ("b", "BEGINS-ON", "a")]), (set(), []))
+        self.assertEqual(close([("a", "ENDS-ON", "b"), ("a", "BEGINS-ON", "b")])[1], [("1@r@doc@gold", "2@r@doc@gold")])
+
+    def test_overlap_holds_when_one_interval_contains_the_other(self):
+        self.assertEqual(close([("a", "OVERLAP", "b"), ("b", "CONTAINS", "a")])[1], [])
+
+    def test_cycle_is_one_conflict(self):
+        (_, conflicts) = close([("a", "BEFORE", "b"), ("b", "BEFORE", "c"), ("c", "BEFORE", "a")])
+        self.assertEqual(len(conflicts), 1)
+
+    def test_inconsistent_points_are_not_used_for_derivation(self):
+        (derived, conflicts) = close([("a", "BEFORE", "b"), ("b", "BEFORE", "a"), ("b", "BEFORE", "c")])
+        self.assertEqual(conflicts, [("1@r@doc@gold", "2@r@doc@gold")])
+        self.assertEqual(derived, set())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+
+from thymeml import * # THYME-ML object model
+from IntervalAlgebra import *
+
+TEXT = u"abc def ghi jkl"
+
+def document(tlinks):
+    """
+    :param list tlinks: (Source, Type, Target) of every TLINK, the annotations being EVENTs named a, b, c and d
+    :return ThymeMLData: a document with the four EVENTs and the TLINKs
+    """
+    entities = ["<entity><id>{0}@e@doc@gold</id><span>{1},{2}</span><type>EVENT</type><parentsType>TemporalEntities</parentsType><properties /></entity>".format(name, 4 * i, 4 * i + 3)
+                for (i, name) in enumerate("abcd")]
+    relations = ["<relation><id>{0}@r@doc@gold</id><type>TLINK</type><parentsType>TemporalRelations</parentsType><properties><Source>{1}@e@doc@gold</Source><Type>{2}</Type><Target>{3}@e@doc@gold</Target></properties></relation>".format(i + 1, source, relationType, target)
+                 for (i, (source, relationType, target)) in enumerate(tlinks)]
+    content = '<?xml version="1.0" encoding="UTF-8"?>\n<data>\n<annotations>\n' + "\n".join(entities + relations) + "\n</annotations>\n</data>\n"
+    return ThymeMLData.from_compiled(ThymeMLData.compile(content), TEXT)
+
+def close(tlinks):
+    """
+    :return tuple: (the derived TLINKs as (Source, Type, Target) names, the conflicting pairs as relation ids)
+    """
+    data = document(tlinks)
+    tlinkRelations = list(data.annotations.select_type("TLINK"))
+    closure = AllenClosure(tlinkRelations, data.annotations, TEXT, "5@r@doc@gold")
+    (_, conflictingRelationPairs) = closure.run()
+    derived = set((relation.properties["Source"].id[0], relation.properties["Type"], relation.properties["Target"].id[0])
+                  for relation in tlinkRelations[len(tlinks):])
+    return (derived, [(relation1.id, relation2.id) for (relation1, relation2) in conflictingRelationPairs])
+
+class AlgebraTest(unittest.TestCase):
+
+    def test_composition(self):
+        self.assertEqual(compose(BEFORE, BEFORE), BEFORE)
+        self.assertEqual(compose(MEETS, MEETS), BEFORE)
+        self.assertEqual(compose(STARTS, MEETS), BEFORE)
+        self.assertEqual(compose(CONTAINS, CONTAINS), CONTAINS)
+        self.assertEqual(compose(OVERLAPS, OVERLAPS), BEFORE | MEETS | OVERLAPS)
+        self.assertEqual(compose(BEFORE, AFTER), ALL)
+        self.assertEqual(compose(BEFORE | MEETS, BEFORE), BEFORE)
+        for i in range(len(ALLEN_RELATIONS)):
+            self.assertEqual(compose(EQUALS, 1 << i), 1 << i)
+
+    def test_inverse(self):
+        self.assertEqual(inverse(BEFORE), AFTER)
+        self.assertEqual(inverse(MEETS), MET_BY)
+        self.assertEqual(inverse(STARTS), STARTED_BY)
+        self.assertEqual(inverse(CONTAINS), DURING)
+        self.assertEqual(inverse(EQUALS), EQUALS)
+        self.assertEqual(inverse(BEFORE | CONTAINS), AFTER | DURING)
+        for mask in range(ALL + 1):
+            self.assertEqual(inverse(inverse(mask)), mask)
+
+    def test_thyme_types(self):
+        self.assertEqual(THYME_TO_ALLEN["OVERLAP"], OVERLAPS | OVERLAPPED_BY)
+        self.assertEqual(THYME_TO_ALLEN["ENDS-ON"], MEETS)
+        self.assertEqual(THYME_TO_ALLEN["BEGINS-ON"], MET_BY)
+        self.assertEqual(toThymeType(BEFORE), ("BEFORE", False))
+        self.assertEqual(toThymeType(AFTER), ("BEFORE", True))
+        self.assertEqual(toThymeType(DURING), ("CONTAINS", True))
+        self.assertEqual(toThymeType(OVERLAPS), ("OVERLAP", False))
+        self.assertEqual(toThymeType(OVERLAPPED_BY), ("OVERLAP", False))
+        self.assertEqual(toThymeType(MET_BY), ("BEGINS-ON", False))
+        self.assertEqual(toThymeType(MEETS), ("BEGINS-ON", True)) # x ENDS-ON y is y BEGINS-ON x
+        self.assertIsNone(toThymeType(STARTS))
+        self.assertIsNone(toThymeType(BEFORE | CONTAINS))
+        self.assertIsNone(toThymeType(0))
+
+class AllenClosureTest(unittest.TestCase):
+
+    def test_chain_derives_relations(self):
+        (derived, conflicts) = close([("a", "ENDS-ON", "b"), ("b", "BEFORE", "c"), ("c", "CONTAINS", "d")])
+        self.assertEqual(derived, set([("a", "BEFORE", "c"), ("a", "BEFORE", "d"), ("b", "BEFORE", "d")]))
+        self.assertEqual(conflicts, [])
+
+    def test_ends_on_is_the_inverse_of_begins_on(self):
+        self.assertEqual(close([("a", "ENDS-ON", "b"), ("b", "BEGINS-ON", "a")])[1], [])
+        self.assertEqual(close([("a", "ENDS-ON", "b"), ("a", "BEGINS-ON", "b")])[1], [("1@r@doc@gold", "2@r@doc@gold")])
+
+    def test_cycle_is_one_conflict(self):
+        (_, conflicts) = close([("a", "BEFORE", "b"), ("b", "BEFORE", "c"), ("c", "BEFORE", "a")])
+        self.assertEqual(len(conflicts), 1)
+        (conflictingRelation, relation) = conflicts[0]
+        self.assertIn(conflictingRelation, ["1@r@doc@gold", "2@r@doc@gold"]) # Annotated TLINKs only
+        self.assertEqual(relation, "3@r@doc@gold")
+
+    def test_inconsistent_relation_is_not_used_for_derivation(self):
+        (derived, conflicts) = close([("a", "BEFORE", "b"), ("b", "BEFORE", "a"), ("b", "BEFORE", "c")])
+        self.assertEqual(conflicts, [("1@r@doc@gold", "2@r@doc@gold")])
+        self.assertEqual(derived, set([("a", "BEFORE", "c")]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from thymeml import * # THYME-ML object model
+
+# Two TLINKs referring to each other (A -> B -> A), as in documents with self-referential relations
+CYCLIC_DOCUMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<data>
+<annotations>
+<entity><id>1@e@doc@gold</id><span>0,3</span><type>EVENT</type><parentsType>TemporalEntities</parentsType><properties /></entity>
+<entity><id>2@e@doc@gold</id><span>4,7</span><type>EVENT</type><parentsType>TemporalEntities</parentsType><properties /></entity>
+<relation><id>3@r@doc@gold</id><type>TLINK</type><parentsType>TemporalRelations</parentsType><properties><Source>4@r@doc@gold</Source><Type>BEFORE</Type><Target>1@e@doc@gold</Target></properties></relation>
+<relation><id>4@r@doc@gold</id><type>TLINK</type><parentsType>TemporalRelations</parentsType><properties><Source>3@r@doc@gold</Source><Type>BEFORE</Type><Target>2@e@doc@gold</Target></properties></relation>
+</annotations>
+</data>
+"""
+
+class CyclicFingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "doc.xml")
+        with open(self.path, "w") as xml_file:
+            xml_file.write(CYCLIC_DOCUMENT)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self):
+        data = ThymeMLData.from_file(self.path, u"abc def")
+        return (data.annotations.select_id("3@r@doc@gold"), data.annotations.select_id("4@r@doc@gold"), data.annotations)
+
+    def test_fingerprint_does_not_depend_on_traversal_order(self):
+        (a1, b1, _) = self.load()
+        (a2, b2, _) = self.load()
+        a1.fingerprint # The cycle is entered from A in the first document...
+        b2.fingerprint # ...and from B in the second
+        self.assertEqual(b1.spans, b2.spans)
+        self.assertEqual(a1.spans, a2.spans)
+        self.assertEqual(b1, b2)
+        self.assertEqual(a1, a2)
+        self.assertEqual(hash(b1), hash(b2))
+        self.assertEqual(hash(a1), hash(a2))
+        self.assertNotEqual(a1, b1)
+
+    def test_hash_is_stable_across_unrelated_changes(self):
+        (a, b, annotations) = self.load()
+        a.fingerprint
+        hashes = (hash(a), hash(b))
+        entity = annotations.select_id("2@e@doc@gold")
+        entity.spans = entity.spans # No-op change, invalidates the cached fingerprints
+        b.fingerprint
+        self.assertEqual((hash(a), hash(b)), hashes)
+        self.assertIn(b, set([a, b]))
+
+class IndexOrderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "doc.xml")
+        with open(self.path, "w") as xml_file:
+            xml_file.write(CYCLIC_DOCUMENT)
+        self.annotations = ThymeMLData.from_file(self.path, u"abc def").annotations
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def ids(self, annotations):
+        return [annotation.id for annotation in annotations]
+
+    def test_setting_the_type_keeps_document_order(self):
+        first = self.annotations.select_id("1@e@doc@gold")
+        first.type = "EVENT"
+        self.assertEqual(self.ids(self.annotations.select_type("EVENT")), ["1@e@doc@gold", "2@e@doc@gold"])
+        first.parents_type = "TemporalEntities"
+        self.assertEqual(self.ids(self.annotations.select_parents_type("TemporalEntities")), ["1@e@doc@gold", "2@e@doc@gold"])
+
+    def test_changed_type_is_indexed_in_document_order(self):
+        relation = self.annotations.select_id("4@r@doc@gold")
+        relation.type = "EVENT"
+        self.assertEqual(self.ids(self.annotations.select_type("EVENT")), ["1@e@doc@gold", "2@e@doc@gold", "4@r@doc@gold"])
+        self.annotations.select_id("1@e@doc@gold").type = "TLINK"
+        self.assertEqual(self.ids(self.annotations.select_type("TLINK")), ["1@e@doc@gold", "3@r@doc@gold"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,7 @@
 import collections
 import functools
+import hashlib
+import marshal
 import os
 import re
 import sys
@@ -9,6 +11,42 @@ try:
 except ImportError:
     import xml.etree.ElementTree as ElementTree
 
+try:
+    from os import scandir # Python 3.5+
+except ImportError:
+    try:
+        from scandir import scandir # Backport, pip install scandir
+    except ImportError:
+        scandir = None
+
+
+class _DirEntry(object):
+    # Subset of os.DirEntry used when scandir is not available, is_dir/is_file/stat stat the entry
+    def __init__(self, dir_path, name):
+        self.name = name
+        self.path = os.path.join(dir_path, name)
+
+    def stat(self):
+        return os.stat(self.path)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+
+if scandir is None:
+    def scandir(path='.'):
+        """
+        :param str path: path of a directory
+        :return iterator: an iterator of the entries of the directory, see os.scandir
+        """
+        return iter([_DirEntry(path, name) for name in os.listdir(path)])
+
 
 def walk(root, xml_name_regex="[.]xml$"):
     """
@@ -18,17 +56,25 @@ def walk(root, xml_name_regex="[.]xml$"):
         directory relative to root, text-file-name is the name of the ThymeML text file, and xml-file-names is a list
         of names of ThymeML XML files
     """
-    for dir_path, dir_names, file_names in os.walk(root):
-        if not dir_names:
-            sub_dir = ''
-            if dir_path.startswith(root):
-                sub_dir = dir_path[len(root):]
-                if sub_dir.startswith(os.path.sep):
-                    sub_dir = sub_dir[len(os.path.sep):]
-            xml_names = [file_name for file_name in file_names if re.search(xml_name_regex, file_name) is not None]
+    xml_name_pattern = re.compile(xml_name_regex)
+    pending = [(root, '')]
+    while pending:
+        dir_path, sub_dir = pending.pop()
+        dir_entries = []
+        file_names = []
+        for entry in scandir(dir_path): # File types come with the entries, no stat per entry on most platforms
+            if entry.is_dir():
+                dir_entries.append(entry)
+            else:
+                file_names.append(entry.name)
+        if not dir_entries:
+            xml_names = [file_name for file_name in file_names if xml_name_pattern.search(file_name) is not None]
             if xml_names:
                 text_name = os.path.basename(dir_path)
                 yield sub_dir, text_name, xml_names
+        for entry in reversed(dir_entries): # Visited in listing order, and symbolic links not followed, as os.walk does
+            if not entry.is_symlink():
+                pending.append((entry.path, os.path.join(sub_dir, entry.name)))
 
 
 def walk_ThymeML_to_ThymeML(root, xml_name_regex="[.]xml$"):
@@ -50,12 +96,234 @@ def walk_flat_to_ThymeML(text_dir):
         yield '', file_name, file_name, []
 
 
+# Marks a field of an annotation that has not been decoded from its XML yet
+_NOT_DECODED = object()
+
+# Key of the references of a relation in the cache of its properties, see ThymeMLRelation.allReferences
+_ALL_REFERENCES = object()
+
+# Bump whenever the layout of cached documents changes
+_CACHE_FORMAT = 1
+
+
+def _intern(text):
+    # Interned strings are written once per compiled copy by marshal, and shared again when it is loaded
+    if type(text) is str and len(text) < 64:
+        return intern(text)
+    return text
+
+
+def _encode_element(elem):
+    return (_intern(elem.tag), dict(elem.attrib) or None, _intern(elem.text), _intern(elem.tail),
+            tuple(_encode_element(child) for child in elem))
+
+
+def _decode_element(record):
+    (tag, attrib, text, tail, children) = record
+    elem = ElementTree.Element(tag, attrib or {})
+    elem.text = text
+    elem.tail = tail
+    elem.extend([_decode_element(child) for child in children])
+    return elem
+
+
+def _record_findtext(record, tag):
+    # Same result as Element.findtext(tag) on the decoded element
+    for child in record[4]:
+        if child[0] == tag:
+            return child[2] if child[2] is not None else ""
+    return None
+
+
+class _RecordElement(object):
+    """
+    Read-only stand-in for a property element of an annotation loaded from a compiled copy, until the XML of the
+    annotation is decoded.
+    """
+    __slots__ = ("tag", "text")
+
+    def __init__(self, record):
+        self.tag = record[0]
+        self.text = record[2]
+
+    def append(self, elem):
+        pass # The decoded XML gets the duplicated property element, see ThymeMLProperties._index
+
+
+class _ReferenceGraph(object):
+    """
+    Strongly connected components of the graph of annotations and the annotations their (single-valued) properties
+    refer to, found with one pass of Tarjan's algorithm over everything reachable from the roots.
+    """
+
+    def __init__(self, roots, follow_lists=False):
+        """
+        :param iterable roots: the annotations to start from
+        :param bool follow_lists: also follow the annotations of list-valued properties (e.g. Coreferring_String)
+        """
+        self._node_index = {}  # id(annotation) -> node
+        self._annotations = []  # node -> annotation
+        self._component = []  # node -> component
+        self.cycles = []  # annotations of every component that contains a cycle, in discovery order
+        self._reaches_cycle = []  # component -> a cycle can be reached from the component
+
+        successors = []  # node -> nodes referred to
+        index = []
+        low_link = []
+        on_stack = []
+        stack = []
+        cyclic_components = []
+
+        def visit(annotation):
+            node = len(self._annotations)
+            self._node_index[id(annotation)] = node
+            self._annotations.append(annotation)
+            self._component.append(None)
+            successors.append([])
+            index.append(node)
+            low_link.append(node)
+            on_stack.append(True)
+            stack.append(node)
+            return node
+
+        for root in roots:
+            if id(root) in self._node_index:
+                continue
+            work = [(visit(root), _referenced_annotations(root, follow_lists))]
+            while work:
+                node, references = work[-1]
+                for reference in references:
+                    successor = self._node_index.get(id(reference))
+                    if successor is None:
+                        successor = visit(reference)
+                        successors[node].append(successor)
+                        work.append((successor, _referenced_annotations(reference, follow_lists)))
+                        break
+                    successors[node].append(successor)
+                    if on_stack[successor]:
+                        low_link[node] = min(low_link[node], index[successor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low_link[parent] = min(low_link[parent], low_link[node])
+                    if low_link[node] == index[node]:
+                        # Components are completed after every component they refer to
+                        component = len(self._reaches_cycle)
+                        members = []
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = False
+                            self._component[member] = component
+                            members.append(member)
+                            if member == node:
+                                break
+                        cyclic = len(members) > 1 or node in successors[node]
+                        reaches_cycle = cyclic
+                        for member in members:
+                            for successor in successors[member]:
+                                if self._component[successor] != component and self._reaches_cycle[self._component[successor]]:
+                                    reaches_cycle = True
+                        self._reaches_cycle.append(reaches_cycle)
+                        if cyclic:
+                            cyclic_components.append(sorted(members))
+
+        for members in sorted(cyclic_components):
+            self.cycles.append([self._annotations[member] for member in members])
+
+    def reaches_cycle(self, annotation):
+        """
+        :return bool: True if following the properties from the annotation leads to a cycle, None if the
+            annotation is not in the graph
+        """
+        node = self._node_index.get(id(annotation))
+        if node is None:
+            return None
+        return self._reaches_cycle[self._component[node]]
+
+    def component(self, annotation):
+        """
+        :return int: the strongly connected component of the annotation, None if the annotation is not in the graph
+        """
+        node = self._node_index.get(id(annotation))
+        if node is None:
+            return None
+        return self._component[node]
+
+
+class _Fingerprint(object):
+    """
+    The values ThymeMLAnnotation.__eq__ compares: spans, type, parents type and properties, with the annotations the
+    properties refer to replaced by their own fingerprint. The hash is computed once, and equality checks identity
+    and the hash before the values, so comparing two annotations stops at the annotations they share instead of
+    walking everything they refer to.
+    """
+    __slots__ = ("spans", "type", "parents_type", "properties", "_hash")
+
+    def __init__(self, spans, type, parents_type, properties):
+        """
+        :param tuple properties: sorted (name, value) pairs, list values as tuples
+        """
+        self.spans = spans
+        self.type = type
+        self.parents_type = parents_type
+        self.properties = properties
+        self._hash = hash((spans, type, parents_type, properties))
+
+    def __eq__(self, other):
+        return self is other or (
+            isinstance(other, _Fingerprint) and
+            self._hash == other._hash and
+            self.spans == other.spans and
+            self.type == other.type and
+            self.parents_type == other.parents_type and
+            self.properties == other.properties)
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self):
+        return self._hash
+
+
+def _fingerprint_value(value, graph, component):
+    if isinstance(value, ThymeMLAnnotation):
+        if graph.component(value) == component: # Part of a cycle with the annotation being fingerprinted
+            return ("id", value.id)
+        return value.fingerprint
+    if type(value) is list:
+        return tuple(_fingerprint_value(item, graph, component) for item in value)
+    return value
+
+
+def _referenced_annotations(annotation, follow_lists=False):
+    # List-valued properties (e.g. Coreferring_String) are only followed if follow_lists
+    for name in annotation.properties:
+        value = annotation.properties[name]
+        if isinstance(value, ThymeMLAnnotation):
+            yield value
+        elif follow_lists and type(value) is list:
+            for item in value:
+                if isinstance(item, ThymeMLAnnotation):
+                    yield item
+
+
 class _XMLWrapper(object):
+    __slots__ = ("_xml",)
+
     def __init__(self, xml):
         """
         :param xml.etree.ElementTree.Element xml: the XML element to be wrapped in an object
         """
-        self.xml = xml
+        self._xml = xml
+
+    @property
+    def xml(self):
+        return self._xml
+
+    @xml.setter
+    def xml(self, value):
+        self._xml = value
 
     def __repr__(self):
         if self.xml is not None:
@@ -67,6 +335,57 @@ class _XMLWrapper(object):
         return result
 
 
+def _escape_text(text):
+    return text.replace(u"&", u"&amp;").replace(u"<", u"&lt;").replace(u">", u"&gt;")
+
+
+def _escape_attribute(value):
+    return _escape_text(value).replace(u"\"", u"&quot;").replace(u"\n", u"&#10;")
+
+
+def _indented_tail(tail, parent_level, is_last, indent):
+    # Tail of a child element once indented, see ThymeMLData.indent
+    if indent is None or (tail and tail.strip()):
+        return tail
+    return u"\n" + indent * (parent_level if is_last else parent_level + 1)
+
+
+def _start_tag(elem, chunks, end=u">"):
+    chunks.append(u"<" + elem.tag)
+    for name, value in sorted(elem.items()):
+        chunks.append(u" {0}=\"{1}\"".format(name, _escape_attribute(value)))
+    chunks.append(end)
+
+
+def _serialize(elem, level, indent, tail, chunks):
+    """
+    Appends the serialization of an element (as ElementTree writes it) and of the given tail.
+
+    :param int level: depth of the element in the document, for the indentation
+    :param str indent: see ThymeMLData.to_file
+    """
+    if elem.tag is ElementTree.Comment:
+        chunks.append(u"<!--{0}-->".format(elem.text or u""))
+    elif elem.tag is ElementTree.ProcessingInstruction:
+        chunks.append(u"<?{0}?>".format(elem.text or u""))
+    else:
+        children = list(elem)
+        text = elem.text
+        if indent is not None and children and (not text or not text.strip()):
+            text = u"\n" + indent * (level + 1)
+        if not text and not children:
+            _start_tag(elem, chunks, u" />")
+        else:
+            _start_tag(elem, chunks)
+            if text:
+                chunks.append(_escape_text(text))
+            for position, child in enumerate(children):
+                _serialize(child, level + 1, indent, _indented_tail(child.tail, level, position == len(children) - 1, indent), chunks)
+            chunks.append(u"</" + elem.tag + u">")
+    if tail:
+        chunks.append(_escape_text(tail))
+
+
 class ThymeMLData(_XMLWrapper):
     def __init__(self, xml=None, document=None):
         """
@@ -77,13 +396,151 @@ class ThymeMLData(_XMLWrapper):
         _XMLWrapper.__init__(self, xml)
         self.annotations = ThymeMLAnnotations(self.xml.find("annotations"), self, document)
 
+    @property
+    def xml(self):
+        annotations = getattr(self, "annotations", None)
+        if annotations is not None and annotations._pending:
+            annotations.xml # Puts the XML of annotations loaded from a compiled copy in the tree
+        return self._xml
+
+    @xml.setter
+    def xml(self, value):
+        self._xml = value
+
     @classmethod
-    def from_file(cls, xml_path, document):
+    def from_file(cls, xml_path, document, tags=None, parents_types=None, cache_dir=None):
+        """
+        Loads the XML file incrementally: every <entity> and <relation> is wrapped as soon as it has been parsed and
+        is then detached from the parsed tree, so memory only holds the annotations that are kept.
+
+        :param str xml_path: path of the ThymeML XML file
+        :param unicode document: text of the annotated document (or an object sliced the same way, e.g. a DocumentText)
+        :param tags: if given, only annotations with these tags ("entity", "relation") are loaded
+        :param parents_types: if given, only annotations with these parentsType (e.g. "TemporalRelations",
+            "CorefChains") are loaded
+        :param str cache_dir: if given (and nothing is filtered out), the parsed document is loaded from, or saved
+            to, a compiled copy in this directory, see from_cached_file
+        """
+        if cache_dir is not None and tags is None and parents_types is None:
+            return cls.from_cached_file(xml_path, document, cache_dir)
+
+        data = cls(None, document)
+        root = None
         try:
-            return cls(ElementTree.parse(xml_path).getroot(), document)
+            for _, elem in ElementTree.iterparse(xml_path):
+                root = elem
+                if elem.tag == "entity" or elem.tag == "relation":
+                    if ((tags is None or elem.tag in tags) and
+                            (parents_types is None or elem.findtext("parentsType") in parents_types)):
+                        if data.annotations.xml is None:
+                            data.annotations.xml = ElementTree.SubElement(data.xml, "annotations")
+                        data.annotations.xml.append(elem)
+                        data.annotations._add_parsed(elem, document)
+                    else:
+                        elem.clear()
+                elif elem.tag == "annotations":
+                    if data.annotations.xml is None:
+                        data.annotations.xml = ElementTree.SubElement(data.xml, "annotations")
+                    data.annotations.xml.text = elem.text
+                    data.annotations.xml.tail = elem.tail
+                    elem.clear() # Kept annotations have been moved to data.annotations
         except ElementTree.ParseError as e:
             raise ValueError("invalid XML file {0}: {1}".format(xml_path, e))
 
+        # Copy the rest of the document (e.g. <info>, <schema>) around the annotations
+        data.xml.tag = root.tag
+        data.xml.attrib.update(root.attrib)
+        data.xml.text = root.text
+        position = 0
+        for child in root:
+            if child.tag == "annotations":
+                position = len(data.xml)
+            else:
+                data.xml.insert(position, child)
+                position += 1
+        return data
+
+    @classmethod
+    def from_cached_file(cls, xml_path, document, cache_dir):
+        """
+        Loads the compiled copy of the XML file from the cache directory when the copy was made from the same file
+        path, size, modification time and content hash. Otherwise the XML file is parsed and its compiled copy is
+        (re)written first.
+
+        Loading a compiled copy does not parse any XML: annotations are created from their compiled records, and
+        the XML element of an annotation is only decoded when it is needed (e.g. to modify or write it).
+
+        :param str xml_path: path of the ThymeML XML file
+        :param unicode document: text of the annotated document (or an object sliced the same way, e.g. a DocumentText)
+        :param str cache_dir: directory of the compiled copies
+        """
+        with open(xml_path, "rb") as xml_file:
+            content = xml_file.read()
+        stat = os.stat(xml_path)
+        abs_path = os.path.abspath(xml_path)
+        key = (abs_path, stat.st_size, stat.st_mtime, hashlib.md5(content).hexdigest())
+        cache_path = os.path.join(cache_dir, hashlib.md5(abs_path.encode("utf-8")).hexdigest() + ".thymeml-cache")
+
+        compiled = None
+        try:
+            with open(cache_path, "rb") as cache_file:
+                (cache_format, cached_key, compiled) = marshal.loads(cache_file.read())
+            if cache_format != _CACHE_FORMAT or cached_key != key:
+                compiled = None
+        except (IOError, EOFError, ValueError, TypeError):
+            compiled = None # Missing or unreadable compiled copy
+
+        if compiled is None:
+            compiled = cls.compile(content, xml_path)
+
+            if not os.path.isdir(cache_dir):
+                try:
+                    os.makedirs(cache_dir)
+                except OSError:
+                    pass # Created by another process in the meantime
+            temp_path = "{0}.{1}.tmp".format(cache_path, os.getpid())
+            with open(temp_path, "wb") as cache_file:
+                marshal.dump((_CACHE_FORMAT, key, compiled), cache_file, 2)
+            os.rename(temp_path, cache_path) # Atomic, so concurrent readers never see a partial copy
+
+        return cls.from_compiled(compiled, document)
+
+    @staticmethod
+    def compile(content, xml_path=None):
+        """
+        Parses a ThymeML XML file into its compiled form: nested tuples that marshal can store, and from which any
+        number of independent documents can be created (see from_compiled).
+
+        :param str content: contents of the XML file
+        :param str xml_path: path of the XML file, for error messages
+        :return tuple: (compiled <data> element without its annotations, compiled <entity> and <relation> elements)
+        """
+        try:
+            root = ElementTree.fromstring(content)
+        except ElementTree.ParseError as e:
+            raise ValueError("invalid XML file {0}: {1}".format(xml_path, e))
+        annotations_elem = root.find("annotations")
+        annotation_records = []
+        if annotations_elem is not None:
+            annotation_records = [_encode_element(annotation_elem) for annotation_elem in annotations_elem]
+            del annotations_elem[:] # Annotations are compiled separately
+        return (_encode_element(root), annotation_records)
+
+    @classmethod
+    def from_compiled(cls, compiled, document):
+        """
+        Creates a document from a compiled XML file, without parsing any XML. The compiled form is not modified, so
+        it can be kept to create the document again.
+
+        :param tuple compiled: see compile
+        :param unicode document: text of the annotated document (or an object sliced the same way, e.g. a DocumentText)
+        """
+        (root_record, annotation_records) = compiled
+        data = cls(_decode_element(root_record), document)
+        for annotation_record in annotation_records:
+            data.annotations._add_record(annotation_record, document)
+        return data
+
     def indent(self, string="\t"):
         # http://effbot.org/zone/element-lib.htm#prettyprint
         def _indent(elem, level=0):
@@ -102,8 +559,63 @@ class ThymeMLData(_XMLWrapper):
                     elem.tail = i
         _indent(self.xml)
 
-    def to_file(self, xml_path):
-        ElementTree.ElementTree(self.xml).write(xml_path, encoding="UTF-8", xml_declaration=True)
+    def to_file(self, xml_path, annotations=None, indent=None):
+        """
+        Writes the document one annotation at a time, so that annotations that are not part of the document (e.g.
+        relations derived by a temporal closure) can be generated while the file is written, instead of being added
+        to the tree first.
+
+        :param str xml_path: path of the XML file
+        :param annotations: if given, an iterable of the <entity> and <relation> elements written in <annotations>
+            instead of the annotations of the document
+        :param str indent: if given, whitespace-only text is replaced with line breaks and this indentation (as
+            indent does, but without modifying the tree)
+        """
+        root = self._xml
+        annotations_elem = self.annotations._xml
+        if annotations is None:
+            annotations = (annotation.xml for annotation in self.annotations)
+        if annotations_elem is None:
+            annotations_elem = ElementTree.Element("annotations")
+            children = list(root) + [annotations_elem]
+        else:
+            children = list(root)
+
+        with open(xml_path, "wb") as xml_file:
+            write = lambda chunks: xml_file.write(u"".join(chunks).encode("utf-8"))
+            xml_file.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+            chunks = []
+            _start_tag(root, chunks)
+            text = root.text
+            if indent is not None and (not text or not text.strip()):
+                text = u"\n" + indent
+            if text:
+                chunks.append(_escape_text(text))
+            for position, child in enumerate(children):
+                tail = _indented_tail(child.tail, 0, position == len(children) - 1, indent)
+                if child is not annotations_elem:
+                    _serialize(child, 1, indent, tail, chunks)
+                    continue
+
+                # <annotations> is written one annotation at a time
+                _start_tag(child, chunks)
+                if child.text and (indent is None or child.text.strip()):
+                    chunks.append(_escape_text(child.text)) # Otherwise every annotation is preceded by its indentation
+                write(chunks)
+                for annotation_elem in annotations:
+                    chunks = []
+                    if indent is not None:
+                        chunks.append(u"\n" + indent * 2)
+                    _serialize(annotation_elem, 2, indent, None if indent is not None else annotation_elem.tail, chunks)
+                    write(chunks)
+                chunks = [u"\n" + indent] if indent is not None else []
+                chunks.append(u"</" + child.tag + u">")
+                if tail:
+                    chunks.append(_escape_text(tail))
+            chunks.append(u"</" + root.tag + u">")
+            if indent is not None:
+                chunks.append(u"\n")
+            write(chunks)
 
 
 class ThymeMLAnnotations(_XMLWrapper):
@@ -111,19 +623,97 @@ class ThymeMLAnnotations(_XMLWrapper):
         _XMLWrapper.__init__(self, xml)
         self._data = _data
         self._id_to_annotation = collections.OrderedDict()
+        # secondary indexes, each mapping a key to the annotations with that key (by object id, in insertion order)
+        self._type_index = collections.defaultdict(collections.OrderedDict)
+        self._parents_type_index = collections.defaultdict(collections.OrderedDict)
+        self._class_index = collections.defaultdict(collections.OrderedDict)
+        self._positions = {}  # id(annotation) -> position in document order, keeps the indexes ordered when reindexed
+        self._next_position = 0
+        self._reference_graph = None  # _ReferenceGraph of every annotation, built on demand
+        self._fingerprint_graph = None  # _ReferenceGraph following list values too, see ThymeMLAnnotation.fingerprint
+        self._fingerprint_graph_revision = None
+        self._generation = 0  # changes whenever ids may resolve to other annotations, see ThymeMLProperties._cached
+        self._revision = 0  # changes whenever any annotation changes, see ThymeMLAnnotation.fingerprint
+        self._pending = [] # annotations loaded from a compiled copy whose XML is not in self.xml yet
         if self.xml is not None:
             for annotation_elem in self.xml:
-                if annotation_elem.tag == "entity":
-                    annotation = ThymeMLEntity(annotation_elem, self, document)
-                elif annotation_elem.tag == "relation":
-                    annotation = ThymeMLRelation(annotation_elem, self, document)
-                else:
-                    raise ValueError("invalid tag: {0}".format(annotation_elem.tag))
-                while annotation.id in self._id_to_annotation:
-                    # raise ValueError("duplicate id: {0}".format(annotation.id))
-                    print "\t\tDuplicate annotation id (" + annotation.id + "). Appending disambiguation suffix..."
-                    annotation.id += "(d)"
-                self._id_to_annotation[annotation.id] = annotation
+                self._add_parsed(annotation_elem, document)
+
+    @property
+    def xml(self):
+        if self._pending:
+            pending = self._pending
+            self._pending = []
+            for annotation in pending:
+                self._xml.append(annotation.xml)
+        return self._xml
+
+    @xml.setter
+    def xml(self, value):
+        self._xml = value
+
+    def _add_parsed(self, annotation_elem, document):
+        """
+        :param xml.etree.ElementTree.Element annotation_elem: an <entity> or <relation> element of this collection
+        """
+        if annotation_elem.tag == "entity":
+            annotation = ThymeMLEntity(annotation_elem, self, document)
+        elif annotation_elem.tag == "relation":
+            annotation = ThymeMLRelation(annotation_elem, self, document)
+        else:
+            raise ValueError("invalid tag: {0}".format(annotation_elem.tag))
+        self._register(annotation)
+
+    def _add_record(self, annotation_record, document):
+        """
+        :param tuple annotation_record: a compiled <entity> or <relation> element, see ThymeMLData.compile
+        """
+        if annotation_record[0] == "entity":
+            annotation = ThymeMLEntity(None, self, document, _record=annotation_record)
+        elif annotation_record[0] == "relation":
+            annotation = ThymeMLRelation(None, self, document, _record=annotation_record)
+        else:
+            raise ValueError("invalid tag: {0}".format(annotation_record[0]))
+        self._pending.append(annotation)
+        self._register(annotation)
+
+    def _register(self, annotation):
+        while annotation.id in self._id_to_annotation:
+            # raise ValueError("duplicate id: {0}".format(annotation.id))
+            print "\t\tDuplicate annotation id (" + annotation.id + "). Appending disambiguation suffix..."
+            annotation.id += "(d)"
+        self._id_to_annotation[annotation.id] = annotation
+        self._positions[id(annotation)] = self._next_position
+        self._next_position += 1
+        self._index(annotation)
+        self._reference_graph = None
+        self._generation += 1
+        self._revision += 1
+
+    def _index(self, annotation):
+        key = id(annotation)
+        position = self._positions[key]
+        for (index, index_key) in ((self._type_index, annotation.type),
+                                   (self._parents_type_index, annotation.parents_type),
+                                   (self._class_index, type(annotation))):
+            entries = index[index_key]
+            if entries and self._positions[next(reversed(entries))] > position:
+                # Reindexed (e.g. its type changed): put it back at its position in document order
+                entries[key] = annotation
+                ordered = sorted(entries.items(), key=lambda item: self._positions[item[0]])
+                entries.clear()
+                entries.update(ordered)
+            else:
+                entries[key] = annotation
+
+    def _unindex(self, annotation):
+        key = id(annotation)
+        self._type_index[annotation.type].pop(key, None)
+        self._parents_type_index[annotation.parents_type].pop(key, None)
+        self._class_index[type(annotation)].pop(key, None)
+
+    def _contains(self, annotation):
+        return self._id_to_annotation.get(annotation.id) is annotation
 
     def __iter__(self):
         return iter(self._id_to_annotation.values())
@@ -141,6 +731,12 @@ class ThymeMLAnnotations(_XMLWrapper):
             self.xml = ElementTree.SubElement(self._data.xml, "annotations")
         self.xml.append(annotation.xml)
         self._id_to_annotation[annotation.id] = annotation
+        self._positions[id(annotation)] = self._next_position
+        self._next_position += 1
+        self._index(annotation)
+        self._reference_graph = None
+        self._generation += 1
+        self._revision += 1
 
     def remove(self, annotation):
         """
@@ -150,57 +746,187 @@ class ThymeMLAnnotations(_XMLWrapper):
             raise ValueError("no id defined for {0}".format(annotation))
         self.xml.remove(annotation.xml)
         del self._id_to_annotation[annotation.id]
+        self._unindex(annotation)
+        del self._positions[id(annotation)]
+        self._reference_graph = None
+        self._generation += 1
+        self._revision += 1
 
     def select_id(self, id):
         return self._id_to_annotation[id]
 
     def select_type(self, type_name):
-        for annotation in self:
-            if annotation.type == type_name:
-                yield annotation
+        """
+        :param str type_name: e.g. EVENT, TIMEX3, TLINK or Identical
+        :return iterator: the annotations of that type, in document order
+        """
+        return iter(self._type_index.get(type_name, {}).values())
+
+    def count_type(self, type_name):
+        return len(self._type_index.get(type_name, ()))
+
+    def select_parents_type(self, parents_type):
+        """
+        :param str parents_type: e.g. TemporalEntities, TemporalRelations or CorefChains
+        :return iterator: the annotations with that parents type, in document order
+        """
+        return iter(self._parents_type_index.get(parents_type, {}).values())
+
+    def count_parents_type(self, parents_type):
+        return len(self._parents_type_index.get(parents_type, ()))
+
+    def select_class(self, annotation_class):
+        """
+        :param type annotation_class: ThymeMLEntity or ThymeMLRelation (subclasses are not included)
+        :return iterator: the annotations of exactly that class, in document order
+        """
+        return iter(self._class_index.get(annotation_class, {}).values())
+
+    def count_class(self, annotation_class):
+        return len(self._class_index.get(annotation_class, ()))
+
+    def _references(self):
+        if self._reference_graph is None:
+            self._reference_graph = _ReferenceGraph(self)
+        return self._reference_graph
+
+    def _fingerprint_references(self):
+        if self._fingerprint_graph_revision != self._revision:
+            self._fingerprint_graph = _ReferenceGraph(self, True)
+            self._fingerprint_graph_revision = self._revision
+        return self._fingerprint_graph
 
     def find_self_referential(self):
+        """
+        :return ThymeMLAnnotation: the first annotation whose properties lead to a cycle, or None
+        """
+        references = self._references()
         for annotation in self:
-            if annotation.is_self_referential():
+            if references.reaches_cycle(annotation):
                 return annotation
 
+    def reference_cycles(self):
+        """
+        :return list: the annotations of every group of annotations whose properties refer to each other in a cycle
+            (an annotation referring to itself is a group of its own)
+        """
+        return [list(cycle) for cycle in self._references().cycles]
+
 
 @functools.total_ordering
 class ThymeMLAnnotation(_XMLWrapper):
-    def __init__(self, xml, _annotations, document):
+    # Fields are decoded from the XML on first access and cached until one of the setters writes them
+    __slots__ = ("_annotations", "document", "properties", "_id", "_type", "_parents_type", "_record", "_fingerprint",
+                 "_fingerprint_revision")
+
+    def __init__(self, xml, _annotations, document, _record=None):
         """
         :param xml.etree.ElementTree.Element xml: xml definition of this annotation
         :param ThymeMLAnnotations _annotations: the annotations collection containing this annotation
+        :param tuple _record: compiled xml definition of this annotation, decoded on demand (instead of xml)
         """
         _XMLWrapper.__init__(self, xml)
         self._annotations = _annotations
         self.document = document
-        self.properties = ThymeMLProperties(self.xml.find("properties"), self)
+        self._record = _record
+        self._id = _NOT_DECODED
+        self._type = _NOT_DECODED
+        self._parents_type = _NOT_DECODED
+        self._fingerprint = None
+        self._fingerprint_revision = None
+        if _record is None:
+            self.properties = ThymeMLProperties(self.xml.find("properties"), self)
+        else:
+            property_records = ()
+            for child in _record[4]:
+                if child[0] == "properties":
+                    property_records = child[4]
+                    break
+            self.properties = ThymeMLProperties(None, self, [_RecordElement(record) for record in property_records])
+
+    @property
+    def xml(self):
+        if self._xml is None and self._record is not None:
+            self._xml = _decode_element(self._record)
+            self._record = None
+            self.properties._attach(self._xml.find("properties"))
+        return self._xml
+
+    @xml.setter
+    def xml(self, value):
+        self._xml = value
+
+    def _findtext(self, tag):
+        if self._xml is None and self._record is not None:
+            return _record_findtext(self._record, tag)
+        return self.xml.findtext(tag)
 
     def __eq__(self, other):
-        return (
-            isinstance(other, ThymeMLAnnotation) and
-            self.spans == other.spans and
-            self.type == other.type and
-            self.parents_type == other.parents_type and
-            self.properties == other.properties)
+        if self is other:
+            return True
+        if not isinstance(other, ThymeMLAnnotation):
+            return False
+        # The cached fingerprints are read directly, equality is checked for every element of `in` on a list
+        annotations = self._annotations
+        if (annotations is not None and annotations is other._annotations and
+                self._fingerprint_revision == annotations._revision == other._fingerprint_revision):
+            fingerprint = self._fingerprint
+            other_fingerprint = other._fingerprint
+        else:
+            fingerprint = self.fingerprint
+            other_fingerprint = other.fingerprint
+        return fingerprint._hash == other_fingerprint._hash and fingerprint == other_fingerprint
 
     def __ne__(self, other):
         return not (self == other)
 
     def __hash__(self):
+        # Spans, type and parents type only: the fingerprint is only computed when hashes collide
         result = hash(self.spans)
         result = 31 * result + hash(self.type)
         result = 31 * result + hash(self.parents_type)
-        # result = 31 * result + hash(self.properties)
         return result
 
+    @property
+    def fingerprint(self):
+        """
+        The spans, type, parents type and properties of this annotation (and, recursively, of the annotations its
+        properties refer to), which equal annotations share. Fingerprints of annotations in a collection are cached
+        until one of its annotations changes.
+
+        The annotations in a cycle of references with this one (its strongly connected component, list values
+        included) are represented by their id instead, so the fingerprint does not depend on which annotation of the
+        cycle was fingerprinted first, and the references followed always lead out of the cycle.
+
+        :return _Fingerprint: the fingerprint
+        """
+        annotations = self._annotations
+        if annotations is not None and self._fingerprint_revision == annotations._revision:
+            return self._fingerprint
+
+        if annotations is not None and annotations._contains(self):
+            graph = annotations._fingerprint_references()
+        else:
+            graph = _ReferenceGraph([self], True)
+        component = graph.component(self)
+        properties = tuple((name, _fingerprint_value(self.properties[name], graph, component)) for name in sorted(self.properties))
+        fingerprint = _Fingerprint(self._fingerprint_spans(properties), self.type, self.parents_type, properties)
+        if annotations is not None:
+            self._fingerprint = fingerprint
+            self._fingerprint_revision = annotations._revision
+        return fingerprint
+
+    def _fingerprint_spans(self, properties):
+        return self.spans
+
     def __lt__(self, other):
         return self.spans < other.spans
 
     @property
     def id(self):
-        return self.xml.findtext("id")
+        if self._id is _NOT_DECODED:
+            self._id = self._findtext("id")
+        return self._id
 
     @id.setter
     def id(self, value):
@@ -208,28 +934,55 @@ class ThymeMLAnnotation(_XMLWrapper):
         if id_elem is None:
             id_elem = ElementTree.SubElement(self.xml, "id")
         id_elem.text = value
+        self._id = _NOT_DECODED
+        if self._annotations is not None:
+            self._annotations._reference_graph = None
+            self._annotations._generation += 1
+            self._annotations._revision += 1
 
     @property
     def type(self):
-        return self.xml.findtext("type")
+        if self._type is _NOT_DECODED:
+            self._type = self._findtext("type")
+        return self._type
 
     @type.setter
     def type(self, value):
+        indexed = self._annotations is not None and self._annotations._contains(self)
+        if indexed:
+            self._annotations._unindex(self)
         type_elem = self.xml.find("type")
         if type_elem is None:
             type_elem = ElementTree.SubElement(self.xml, "type")
         type_elem.text = value
+        self._type = _NOT_DECODED
+        self.properties._invalidate()
+        if self._annotations is not None:
+            self._annotations._revision += 1
+        if indexed:
+            self._annotations._index(self)
 
     @property
     def parents_type(self):
-        return self.xml.findtext("parentsType")
+        if self._parents_type is _NOT_DECODED:
+            self._parents_type = self._findtext("parentsType")
+        return self._parents_type
 
     @parents_type.setter
     def parents_type(self, value):
+        indexed = self._annotations is not None and self._annotations._contains(self)
+        if indexed:
+            self._annotations._unindex(self)
         parents_type_elem = self.xml.find("parentsType")
         if parents_type_elem is None:
             parents_type_elem = ElementTree.SubElement(self.xml, "parentsType")
         parents_type_elem.text = value
+        self._parents_type = _NOT_DECODED
+        self.properties._invalidate()
+        if self._annotations is not None:
+            self._annotations._revision += 1
+        if indexed:
+            self._annotations._index(self)
 
     @property
     def spans(self):
@@ -243,51 +996,84 @@ class ThymeMLAnnotation(_XMLWrapper):
     def spansContent(self):
         raise NotImplementedError
 
-    def is_self_referential(self, seen_ids=None):
-        if seen_ids is None:
-            seen_ids = {}
-        seen_ids[id(self)] = self
-        for name in self.properties:
-            value = self.properties[name]
-            if seen_ids is not None and id(value) in seen_ids:
-                return True
-            if isinstance(value, ThymeMLAnnotation):
-                if value.is_self_referential(dict(seen_ids)):
-                    return True
-        return False
+    def is_self_referential(self):
+        """
+        :return bool: True if following the properties of this annotation (and of the annotations they refer to)
+            leads to a cycle
+        """
+        if self._annotations is not None and self._annotations._contains(self):
+            return self._annotations._references().reaches_cycle(self)
+        return _ReferenceGraph([self]).reaches_cycle(self)
 
 class ThymeMLProperties(_XMLWrapper):
-    def __init__(self, xml, _annotation):
+    # Property values are resolved to annotations once, and cached until a property, the type of the annotation or
+    # the ids of the annotations change (changes made to the XML elements directly are not tracked)
+    __slots__ = ("_annotation", "_tag_to_property_xml", "_resolved", "_resolved_generation")
+
+    def __init__(self, xml, _annotation, _record_elements=None):
         """
         :param xml.etree.ElementTree.Element xml: a <properties> element
         :param ThymeMLAnnotation _annotation: the annotation containing these properties
+        :param list _record_elements: stand-ins for the property elements of an annotation whose XML is not decoded
         """
         _XMLWrapper.__init__(self, xml)
         self._annotation = _annotation
         self._tag_to_property_xml = {}
-        if self.xml is not None:
-            for property_elem in self.xml:
+        self._resolved = None  # created on first use, most properties are never read
+        self._resolved_generation = None
+        if self._xml is not None:
+            self._index(self._xml, True)
+        elif _record_elements:
+            self._index(_record_elements, True)
 
-                keyExists = property_elem.tag in self._tag_to_property_xml
+    def _index(self, property_elems, report_duplicates):
+        for property_elem in property_elems:
 
-                useList = False                
-                if (property_elem.tag == "Coreferring_String" or # We know these keys should map to a list
-                    property_elem.tag == "Part" or
-                    property_elem.tag == "Subset"):
-                    useList = True
-                elif keyExists: # Key/Value already exists
+            keyExists = property_elem.tag in self._tag_to_property_xml
+
+            useList = False                
+            if (property_elem.tag == "Coreferring_String" or # We know these keys should map to a list
+                property_elem.tag == "Part" or
+                property_elem.tag == "Subset" or
+                property_elem.tag == "DerivedFrom"):
+                useList = True
+            elif keyExists: # Key/Value already exists
+                if report_duplicates:
                     print "PROPERTY (" + property_elem.tag + ") ALREADY EXISTS"
-                    useList = True
+                useList = True
 
-                if useList:
-                    if keyExists:
-                        self._tag_to_property_xml[property_elem.tag].append(property_elem)
-                    else:
-                        self._tag_to_property_xml[property_elem.tag] = [property_elem]
-                else: # Set value # Key/Value does not exist
-                    self._tag_to_property_xml[property_elem.tag] = property_elem
+            if useList:
+                if keyExists:
+                    self._tag_to_property_xml[property_elem.tag].append(property_elem)
+                else:
+                    self._tag_to_property_xml[property_elem.tag] = [property_elem]
+            else: # Set value # Key/Value does not exist
+                self._tag_to_property_xml[property_elem.tag] = property_elem
+
+    def _attach(self, xml):
+        """
+        Replaces the stand-ins with the property elements once the XML of the annotation has been decoded.
+
+        :param xml.etree.ElementTree.Element xml: the decoded <properties> element
+        """
+        self._xml = xml
+        self._tag_to_property_xml = {}
+        if self._xml is not None:
+            self._index(self._xml, False)
+
+    @property
+    def xml(self):
+        if self._xml is None and self._annotation is not None and self._annotation._record is not None:
+            self._annotation.xml # Decodes the annotation, which attaches its <properties> element
+        return self._xml
+
+    @xml.setter
+    def xml(self, value):
+        self._xml = value
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if not isinstance(other, ThymeMLProperties):
             return False
         for name in self:
@@ -318,16 +1104,40 @@ class ThymeMLProperties(_XMLWrapper):
     def __contains__(self, property_name):
         return property_name in self._tag_to_property_xml
 
-    def __getitem__(self, property_name):
+    def _invalidate(self):
+        self._resolved = None
+
+    def _cached(self, key, resolve):
+        """
+        :param key: a property name, or another value derived from the properties (e.g. _ALL_REFERENCES)
+        :param resolve: called with the key when its value is not cached
+        :return: the cached value of the key
+        """
+        annotations = self._annotation._annotations
+        if annotations is None: # Not in a collection, nothing to resolve against or to invalidate with
+            return resolve(key)
+        generation = annotations._generation
+        resolved = self._resolved
+        if resolved is None or self._resolved_generation != generation:
+            resolved = self._resolved = {}
+            self._resolved_generation = generation
+        if key in resolved:
+            return resolved[key]
+        value = resolved[key] = resolve(key)
+        return value
+
+    def _resolve(self, property_name):
+        id_to_annotation = self._annotation._annotations._id_to_annotation
         value = self._tag_to_property_xml[property_name]
         if type(value) is list:
-            valueList = []
-            for item in value:
-                valueList.append(self._annotation._annotations._id_to_annotation.get(item.text, item.text))
-            return valueList
-        else:
-            valueText = self._tag_to_property_xml[property_name].text
-            return self._annotation._annotations._id_to_annotation.get(valueText, valueText)
+            return tuple(id_to_annotation.get(item.text, item.text) for item in value)
+        return id_to_annotation.get(value.text, value.text)
+
+    def __getitem__(self, property_name):
+        value = self._cached(property_name, self._resolve)
+        if type(value) is tuple: # List-valued property, callers get their own list
+            return list(value)
+        return value
 
     def __setitem__(self, name, value):        
         if isinstance(value, ThymeMLAnnotation):
@@ -347,11 +1157,19 @@ class ThymeMLProperties(_XMLWrapper):
             property_elem.text = value.id
         else:
             property_elem.text = value
+        self._invalidate()
+        if self._annotation._annotations is not None:
+            self._annotation._annotations._reference_graph = None
+            self._annotation._annotations._revision += 1
 
     def __delitem__(self, name):
         if name not in self._tag_to_property_xml:
             raise ValueError('no such property {0!r}'.format(name))
         self.xml.remove(self._tag_to_property_xml.pop(name))
+        self._invalidate()
+        if self._annotation._annotations is not None:
+            self._annotation._annotations._reference_graph = None
+            self._annotation._annotations._revision += 1
         if not self._tag_to_property_xml:
             self._annotation.xml.remove(self.xml)
             self.xml = None
@@ -361,18 +1179,24 @@ class ThymeMLProperties(_XMLWrapper):
 
 
 class ThymeMLEntity(ThymeMLAnnotation):
-    def __init__(self, xml=None, _annotations=None, document=None):
-        if xml is None:
+    __slots__ = ("_spans",)
+
+    def __init__(self, xml=None, _annotations=None, document=None, _record=None):
+        if xml is None and _record is None:
             xml = ElementTree.Element("entity")
-        ThymeMLAnnotation.__init__(self, xml, _annotations, document)
+        self._spans = _NOT_DECODED
+        ThymeMLAnnotation.__init__(self, xml, _annotations, document, _record)
 
     @property
     def spans(self):
-        spans_text = self.xml.findtext("span")
-        if spans_text is None:
-            return ()
-        return tuple(tuple(int(offset) for offset in tuple(span_text.split(",")))
-                     for span_text in spans_text.split(";"))
+        if self._spans is _NOT_DECODED:
+            spans_text = self._findtext("span")
+            if spans_text is None:
+                self._spans = ()
+            else:
+                self._spans = tuple(tuple(int(offset) for offset in tuple(span_text.split(",")))
+                                    for span_text in spans_text.split(";"))
+        return self._spans
 
     @property
     def flatSpans(self):
@@ -394,19 +1218,25 @@ class ThymeMLEntity(ThymeMLAnnotation):
         if span_elem is None:
             span_elem = ElementTree.SubElement(self.xml, "span")
         span_elem.text = ";".join("{0:d},{1:d}".format(*span) for span in spans)
+        self._spans = _NOT_DECODED
+        if self._annotations is not None:
+            self._annotations._revision += 1
 
 class ThymeMLRelation(ThymeMLAnnotation):
-    def __init__(self, xml=None, _annotations=None, document=None):
-        if xml is None:
+    __slots__ = ()
+
+    def __init__(self, xml=None, _annotations=None, document=None, _record=None):
+        if xml is None and _record is None:
             xml = ElementTree.Element("relation")
-        ThymeMLAnnotation.__init__(self, xml, _annotations, document)
+        ThymeMLAnnotation.__init__(self, xml, _annotations, document, _record)
 
     @property
     def spans(self):
-        return tuple(
-            self.properties[name].spans
-            for name in sorted(self.properties)
-            if isinstance(self.properties[name], ThymeMLAnnotation))
+        return self.fingerprint.spans
+
+    def _fingerprint_spans(self, properties):
+        # Spans of the annotations the properties refer to, in the order of the property names
+        return tuple(value.spans for (name, value) in properties if isinstance(value, _Fingerprint))
     
     @property
     def flatSpans(self):
@@ -430,6 +1260,9 @@ class ThymeMLRelation(ThymeMLAnnotation):
     
     @property
     def allReferences(self):
+        return list(self.properties._cached(_ALL_REFERENCES, self._allReferences))
+
+    def _allReferences(self, key):
         references = []  
         if self.parents_type == "CorefChains":
             if self.type == "Identical":
@@ -447,4 +1280,4 @@ class ThymeMLRelation(ThymeMLAnnotation):
                 references = [self.properties["Source"], self.properties["Target"]]
             else:
                 print "Could not find references for temporal relation subtype: " + self.type
-        return references
+        return tuple(references)